@@ -0,0 +1,374 @@
+"""
+Нагрузочный тест сервера по настоящему протоколу.
+
+Поднимает сервер (srv.server) в отдельном процессе на временной базе и копии
+каталога, подключает N asyncio-клиентов и гоняет их по смеси запросов
+login/buy/sell/whoami. Печатает пропускную способность, p50/p95/p99 задержек
+и долю ошибок по каждому action, результат пишет в JSON-файл, чтобы прогоны
+можно было сравнивать между коммитами.
+
+    python -m bench.bench_load --clients 1000 --ops 50 --mix whoami=4,buy=3,sell=3
+    python -m bench.bench_load --set server_mode=asyncio --set workers=4 --out bench.json
+    python -m bench.bench_load --connect 127.0.0.1:5000   # уже запущенный сервер
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import math
+import multiprocessing
+import os
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from common.common_codec import CODECS, JSON_CODEC
+
+DEFAULT_MIX = {"whoami": 4, "buy": 3, "sell": 3}
+ACTIONS = ("login", "whoami", "buy", "sell", "logout")
+ITEMS_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "items.json")
+# Сервер для бенчмарка: кредитов хватает на покупки, журнал и БД — во временной папке.
+BENCH_SERVER_CONFIG = {
+    "host": "127.0.0.1",
+    "login_credit_min": 1000,
+    "login_credit_max": 1000,
+    "server_mode": "threaded",
+    "backlog": 1024,
+}
+
+
+def parse_mix(text: str) -> dict:
+    """'whoami=4,buy=3,sell=3' -> {"whoami": 4.0, ...}"""
+    mix = {}
+    for part in text.split(","):
+        if not part.strip():
+            continue
+        action, _, weight = part.partition("=")
+        action = action.strip()
+        if action not in ("whoami", "buy", "sell"):
+            raise ValueError(f"unknown action in mix: {action}")
+        mix[action] = float(weight or 1)
+    if not mix or sum(mix.values()) <= 0:
+        raise ValueError("empty mix")
+    return mix
+
+
+def parse_override(text: str):
+    """'key=value' для конфига сервера; value разбирается как JSON, иначе строка."""
+    key, _, value = text.partition("=")
+    try:
+        return key.strip(), json.loads(value)
+    except ValueError:
+        return key.strip(), value
+
+
+def free_port(host: str) -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind((host, 0))
+        return s.getsockname()[1]
+
+
+def percentile(sorted_values, q: float):
+    """Перцентиль методом ближайшего ранга по отсортированному списку."""
+    if not sorted_values:
+        return None
+    rank = max(math.ceil(q * len(sorted_values)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+# --- сервер ---
+
+def _server_process(cfg: dict, workdir: str):
+    os.chdir(workdir)
+    from srv import server
+    logging.getLogger().setLevel(logging.WARNING)  # без строки лога на каждое подключение
+    workers = int(cfg.get("workers", 1))
+    if workers > 1:
+        def interrupt(*_):
+            raise KeyboardInterrupt
+        signal.signal(signal.SIGTERM, interrupt)
+        server.main_prefork(cfg, workers)
+        return
+    service = server.build_service(cfg)
+    shutdown_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: shutdown_event.set())
+    if service.accounts:
+        threading.Thread(target=service.accounts.run_flusher, args=(shutdown_event,), daemon=True).start()
+    s = server.create_listener(cfg["host"], int(cfg["port"]), int(cfg.get("backlog", 128)))
+    try:
+        server.serve(s, service, cfg, shutdown_event)
+    finally:
+        s.close()
+        service.close()
+
+
+class BenchServer:
+    """Сервер в отдельном процессе (клиенты и сервер не делят GIL) на временных файлах."""
+
+    def __init__(self, overrides: dict = None, items_file: str = ITEMS_FILE):
+        self.workdir = tempfile.mkdtemp(prefix="tzl-bench-")
+        self.cfg = dict(BENCH_SERVER_CONFIG)
+        self.cfg.update(overrides or {})
+        self.cfg.setdefault("port", free_port(self.cfg["host"]))
+        self.cfg["db_file"] = os.path.join(self.workdir, "bench.db")
+        self.cfg["items_file"] = os.path.join(self.workdir, "items.json")
+        self.cfg["account_journal_file"] = os.path.join(self.workdir, "accounts.journal")
+        shutil.copyfile(items_file, self.cfg["items_file"])
+        self.process = None
+
+    def start(self, timeout=15.0):
+        self.process = multiprocessing.Process(target=_server_process, args=(self.cfg, self.workdir),
+                                               name="bench-server")
+        self.process.start()
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if not self.process.is_alive():
+                raise RuntimeError(f"bench server exited with {self.process.exitcode}")
+            try:
+                socket.create_connection((self.cfg["host"], self.cfg["port"]), timeout=0.5).close()
+                return self
+            except OSError:
+                time.sleep(0.05)
+        self.stop()
+        raise RuntimeError("bench server did not start")
+
+    def stop(self, timeout=10.0):
+        if self.process is not None and self.process.is_alive():
+            self.process.terminate()  # SIGTERM -> штатная остановка с flush кэша
+            self.process.join(timeout)
+            if self.process.is_alive():
+                self.process.kill()
+                self.process.join()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+# --- клиенты ---
+
+class LoadStats:
+    def __init__(self):
+        self.latencies = {}  # action -> [секунды]
+        self.errors = {}  # action -> {код ошибки: количество}
+        self.connect_failures = 0
+        self.disconnects = 0
+
+    def record(self, action, latency, resp):
+        self.latencies.setdefault(action, []).append(latency)
+        if resp.get("status") != "ok":
+            codes = self.errors.setdefault(action, {})
+            code = str(resp.get("error"))
+            codes[code] = codes.get(code, 0) + 1
+
+
+class BenchClient:
+    """Один игрок: запрос -> ответ, задержка меряется от отправки до полного ответа."""
+
+    def __init__(self, reader, writer, stats: LoadStats):
+        self.reader = reader
+        self.writer = writer
+        self.stats = stats
+        self.codec = JSON_CODEC
+        self.account = None
+        self.items = []
+
+    async def request(self, msg: dict) -> dict:
+        start = time.perf_counter()
+        self.writer.write(self.codec.encode(msg))
+        await self.writer.drain()
+        frame = await self.codec.aread_from(self.reader)
+        if frame is None:
+            raise ConnectionError("server closed the connection")
+        resp = self.codec.decode(frame)
+        self.stats.record(msg["action"], time.perf_counter() - start, resp)
+        if isinstance(resp.get("account"), dict):
+            self.account = resp["account"]
+        return resp
+
+    async def login(self, nickname, encoding):
+        msg = {"action": "login", "nickname": nickname}
+        if encoding != "json":
+            msg["encoding"] = encoding
+        resp = await self.request(msg)
+        if "encoding" in resp:
+            self.codec = CODECS[resp["encoding"]]
+        self.items = [it["id"] for it in resp.get("items_master") or []]
+        return resp
+
+    def next_request(self, rng: random.Random, mix: dict) -> dict:
+        action = rng.choices(list(mix), weights=list(mix.values()))[0]
+        if action == "whoami" or not self.items:
+            return {"action": "whoami"}
+        owned = (self.account or {}).get("items") or []
+        if action == "sell" and owned:
+            return {"action": "sell", "item_id": rng.choice(owned)}
+        return {"action": action, "item_id": rng.choice(self.items)}
+
+
+async def run_client(index, host, port, stats, params, rng):
+    await asyncio.sleep(rng.uniform(0, params["ramp"]))
+    try:
+        reader, writer = await asyncio.open_connection(host, port, limit=1 << 20)
+    except OSError:
+        stats.connect_failures += 1
+        return
+    client = BenchClient(reader, writer, stats)
+    try:
+        await client.login(f"{params['prefix']}{index}", params["encoding"])
+        for _ in range(params["ops"]):
+            await client.request(client.next_request(rng, params["mix"]))
+            if params["think"]:
+                await asyncio.sleep(params["think"])
+        await client.request({"action": "logout"})
+    except (ConnectionError, ValueError):
+        stats.disconnects += 1
+    finally:
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except Exception:
+            pass
+
+
+async def run_load(host, port, params) -> (LoadStats, float):
+    stats = LoadStats()
+    rng = random.Random(params["seed"])
+    start = time.perf_counter()
+    await asyncio.gather(*(run_client(i, host, port, stats, params, random.Random(rng.random()))
+                           for i in range(params["clients"])))
+    return stats, time.perf_counter() - start
+
+
+# --- отчёт ---
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(ITEMS_FILE), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def summarize(stats: LoadStats, elapsed: float, params: dict, server_cfg: dict = None) -> dict:
+    actions = {}
+    total = errors = 0
+    for action in ACTIONS:
+        values = sorted(stats.latencies.get(action, ()))
+        if not values:
+            continue
+        codes = stats.errors.get(action, {})
+        count, failed = len(values), sum(codes.values())
+        total += count
+        errors += failed
+        actions[action] = {
+            "count": count,
+            "errors": dict(sorted(codes.items())),
+            "error_rate": failed / count,
+            "mean_ms": sum(values) / count * 1000,
+            "p50_ms": percentile(values, 0.50) * 1000,
+            "p95_ms": percentile(values, 0.95) * 1000,
+            "p99_ms": percentile(values, 0.99) * 1000,
+            "max_ms": values[-1] * 1000,
+        }
+    params = dict(params)
+    params["mix"] = dict(params["mix"])
+    return {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "git_commit": _git_commit(),
+        "params": params,
+        "server_config": server_cfg,
+        "duration_s": elapsed,
+        "requests": total,
+        "throughput_rps": total / elapsed if elapsed > 0 else 0.0,
+        "errors": errors,
+        "error_rate": errors / total if total else 0.0,
+        "connect_failures": stats.connect_failures,
+        "disconnects": stats.disconnects,
+        "actions": actions,
+    }
+
+
+def format_report(result: dict) -> str:
+    lines = [f"{result['requests']} requests in {result['duration_s']:.2f}s "
+             f"-> {result['throughput_rps']:.0f} req/s, error rate {result['error_rate']:.2%}, "
+             f"connect failures {result['connect_failures']}, disconnects {result['disconnects']}",
+             f"{'action':<8} {'count':>8} {'err%':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}"]
+    for action, a in result["actions"].items():
+        lines.append(f"{action:<8} {a['count']:>8} {a['error_rate']:>7.2%} {a['p50_ms']:>8.2f} "
+                     f"{a['p95_ms']:>8.2f} {a['p99_ms']:>8.2f} {a['max_ms']:>8.2f}")
+        for code, n in a["errors"].items():
+            lines.append(f"{'':<8} {code}: {n}")
+    return "\n".join(lines)
+
+
+def _raise_fd_limit(needed: int):
+    try:
+        import resource
+    except ImportError:  # не unix
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < needed:
+        target = needed if hard == resource.RLIM_INFINITY else min(needed, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+
+
+def run_benchmark(clients=100, ops=20, mix=None, encoding="json", ramp=1.0, think=0.0, seed=1,
+                  server_overrides=None, connect=None, prefix=None) -> dict:
+    """
+    Прогон нагрузки и сводка результатов (dict, как в JSON-файле).
+    connect=(host, port) — нагружать уже запущенный сервер, иначе поднимается свой.
+    """
+    params = {"clients": clients, "ops": ops, "mix": mix or DEFAULT_MIX, "encoding": encoding,
+              "ramp": ramp, "think": think, "seed": seed,
+              "prefix": prefix or f"bench{os.getpid()}_{int(time.time())}_"}
+    # клиенты и сервер могут жить в одном процессе: запас на обе стороны соединения
+    _raise_fd_limit(clients * 2 + 256)
+    if connect is not None:
+        stats, elapsed = asyncio.run(run_load(connect[0], connect[1], params))
+        return summarize(stats, elapsed, params)
+    with BenchServer(server_overrides) as srv:
+        stats, elapsed = asyncio.run(run_load(srv.cfg["host"], srv.cfg["port"], params))
+        return summarize(stats, elapsed, params, srv.cfg)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load benchmark for the TZL server")
+    parser.add_argument("--clients", type=int, default=100, help="number of simulated players")
+    parser.add_argument("--ops", type=int, default=20, help="requests per player after login")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX, help="weights, e.g. whoami=4,buy=3,sell=3")
+    parser.add_argument("--encoding", choices=sorted(CODECS), default="json")
+    parser.add_argument("--ramp", type=float, default=1.0, help="seconds over which clients connect")
+    parser.add_argument("--think", type=float, default=0.0, help="pause between requests, seconds")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--set", dest="overrides", action="append", type=parse_override, default=[],
+                        metavar="KEY=VALUE", help="server config override, e.g. server_mode=asyncio")
+    parser.add_argument("--connect", metavar="HOST:PORT", help="benchmark an already running server")
+    parser.add_argument("--out", default="bench_result.json", help="JSON result file")
+    args = parser.parse_args(argv)
+
+    connect = None
+    if args.connect:
+        host, _, port = args.connect.rpartition(":")
+        connect = (host or "127.0.0.1", int(port))
+    result = run_benchmark(args.clients, args.ops, args.mix, args.encoding, args.ramp, args.think,
+                           args.seed, dict(args.overrides), connect)
+    print(format_report(result))
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print("Result written to", args.out)
+    return 0 if result["connect_failures"] == 0 and result["disconnects"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
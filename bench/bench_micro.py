@@ -0,0 +1,130 @@
+"""
+Микробенчмарки горячих путей (pytest-benchmark), по размеру данных 10/1k/100k:
+DB.get_account/add_credits, ItemRepository.get/list_all, кодирование ответа
+(send_json) и разбор кадров NetworkClient.recv.
+
+В обычный прогон тестов не входят, запускаются явно:
+
+    python -m pytest bench/bench_micro.py --benchmark-only
+    python -m pytest bench/bench_micro.py --benchmark-autosave        # сохранить прогон
+    python -m pytest bench/bench_micro.py --benchmark-compare          # сравнить с прошлым
+"""
+import itertools
+import json
+import random
+
+import pytest
+
+from cli.cli_network import RECV_CHUNK, NetworkClient
+from common.common_codec import CODECS, Raw
+from srv.srv_cli_handler import send_json
+from srv.srv_db import DB
+from srv.srv_items_repository import ItemRepository
+
+pytest.importorskip("pytest_benchmark")
+
+SIZES = [10, 1000, 100000]
+ITEMS_PER_ACCOUNT = 5
+
+
+@pytest.fixture(scope="module", params=SIZES, ids=lambda n: f"{n}_accounts")
+def db(request, tmp_path_factory):
+    """База с n аккаунтами по ITEMS_PER_ACCOUNT предметов у каждого."""
+    n = request.param
+    db = DB(str(tmp_path_factory.mktemp("db") / "bench.db"))
+    with db.transaction() as conn:
+        conn.executemany("INSERT INTO accounts (nickname, credits) VALUES (?, ?)",
+                         ((f"player{i}", 1000) for i in range(n)))
+        conn.executemany("INSERT INTO account_items (nickname, item_id) VALUES (?, ?)",
+                         ((f"player{i}", j) for i in range(n) for j in range(1, ITEMS_PER_ACCOUNT + 1)))
+    db.size = n
+    yield db
+    db.close()
+
+
+@pytest.fixture(scope="module", params=SIZES, ids=lambda n: f"{n}_items")
+def items_repo(request, tmp_path_factory):
+    n = request.param
+    path = tmp_path_factory.mktemp("items") / "items.json"
+    path.write_text(json.dumps([{"id": i, "name": f"Item {i}", "price": i % 1000 + 1} for i in range(1, n + 1)]))
+    return ItemRepository(str(path))
+
+
+class _NullSocket:
+    def sendall(self, data):
+        pass
+
+
+class _FeedSocket:
+    """Отдаёт заранее закодированный поток кусками по RECV_CHUNK, как TCP."""
+
+    def __init__(self, data: bytes):
+        self.view = memoryview(data)
+        self.pos = 0
+
+    def recv(self, bufsize):
+        chunk = self.view[self.pos:self.pos + min(bufsize, RECV_CHUNK)]
+        self.pos += len(chunk)
+        return bytes(chunk)
+
+
+def test_db_get_account(benchmark, db):
+    rng = random.Random(1)
+    nicknames = [f"player{rng.randrange(db.size)}" for _ in range(1000)]
+    it = itertools.cycle(nicknames)
+    acc = benchmark(lambda: db.get_account(next(it)))
+    assert len(acc["items"]) == ITEMS_PER_ACCOUNT
+
+
+def test_db_add_credits(benchmark, db):
+    rng = random.Random(2)
+    nicknames = [f"player{rng.randrange(db.size)}" for _ in range(1000)]
+    it = itertools.cycle(nicknames)
+    benchmark(lambda: db.add_credits(next(it), 1))
+
+
+def test_items_get(benchmark, items_repo):
+    rng = random.Random(3)
+    ids = [rng.randint(1, items_repo.snapshot().max_id) for _ in range(1000)]
+    it = itertools.cycle(ids)
+    assert benchmark(lambda: items_repo.get(next(it))) is not None
+
+
+def test_items_list_all(benchmark, items_repo):
+    items = benchmark(items_repo.list_all)
+    assert len(items) == len(items_repo.snapshot())
+
+
+@pytest.mark.parametrize("n", SIZES, ids=lambda n: f"{n}_items")
+@pytest.mark.parametrize("raw", [False, True], ids=["dict", "raw_payload"])
+def test_send_json_login_result(benchmark, n, raw):
+    """login_result с каталогом из n предметов: как dict и как готовый Raw-фрагмент снимка."""
+    items = [{"id": i, "name": f"Item {i}", "price": i} for i in range(1, n + 1)]
+    catalog = Raw(json.dumps(items, ensure_ascii=False).encode("utf-8")) if raw else items
+    resp = {"status": "ok", "action": "login_result", "login_bonus": 42,
+            "account": {"nickname": "player1", "credits": 1000, "items": [1, 2, 3]},
+            "catalog_status": "full", "items_master": catalog}
+    benchmark(send_json, _NullSocket(), resp)
+
+
+@pytest.mark.parametrize("n", SIZES, ids=lambda n: f"{n}_frames")
+@pytest.mark.parametrize("encoding", sorted(CODECS))
+def test_network_recv_frames(benchmark, n, encoding):
+    """Разбор n ответов whoami, пришедших одним потоком кусками по RECV_CHUNK."""
+    codec = CODECS[encoding]
+    frame = codec.encode({"status": "ok", "account": {"nickname": "player1", "credits": 1000,
+                                                      "items": [1, 2, 3]}})
+    data = frame * n
+
+    def setup():
+        client = NetworkClient("127.0.0.1", 0)
+        client.codec = codec
+        client.sock = _FeedSocket(data)
+        return (client,), {}
+
+    def read_all(client):
+        for _ in range(n):
+            client.recv()
+        return client.recv()
+
+    assert benchmark.pedantic(read_all, setup=setup, rounds=max(5, 100000 // n)) is None
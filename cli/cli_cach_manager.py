@@ -5,17 +5,70 @@ from cli.cli_setting import ITEMS_CACHE
 
 
 class CacheManager:
-    """Управляет сохранением и загрузкой предметов в кэше."""
+    """
+    Управляет сохранением и загрузкой предметов в кэше.
+    Вместе с предметами хранится версия и хэш каталога, присланные сервером:
+    при входе они отправляются обратно, и сервер отвечает not_modified или дельтой.
+    """
 
     def __init__(self, filename=ITEMS_CACHE):
         self.filename = filename
 
-    def save_items(self, items):
+    def save_items(self, items, version=None, catalog_hash=None):
+        data = {"version": version, "hash": catalog_hash, "items": items}
         with open(self.filename, "w", encoding="utf-8") as f:
-            json.dump(items, f, ensure_ascii=False, indent=2)
+            json.dump(data, f, ensure_ascii=False, indent=2)
 
-    def load_items(self):
+    def _load(self):
         if not os.path.exists(self.filename):
             return None
         with open(self.filename, "r", encoding="utf-8") as f:
-            return json.load(f)
\ No newline at end of file
+            data = json.load(f)
+        if isinstance(data, list):  # старый формат: только список предметов
+            return {"version": None, "hash": None, "items": data}
+        return data
+
+    def load_items(self):
+        data = self._load()
+        return data["items"] if data else None
+
+    def load_version(self):
+        """(version, hash) сохранённого каталога или (None, None)."""
+        data = self._load()
+        if not data:
+            return None, None
+        return data.get("version"), data.get("hash")
+
+    @staticmethod
+    def apply_delta(items, delta):
+        """Применяет дельту сервера (added/changed/removed) к списку предметов."""
+        removed = set(delta.get("removed", []))
+        updates = {it["id"]: it for it in delta.get("changed", [])}
+        result = []
+        for it in items:
+            if it["id"] in removed:
+                continue
+            result.append(updates.pop(it["id"], it))
+        result.extend(updates.values())
+        result.extend(delta.get("added", []))
+        return result
+
+    def sync_from_login(self, resp):
+        """
+        Обновляет кэш по ответу login_result и возвращает актуальный список предметов.
+        Понимает и старый ответ сервера (только items_master).
+        """
+        status = resp.get("catalog_status", "full")
+        items = None
+        if status == "not_modified":
+            items = self.load_items()
+        elif status == "delta":
+            cached = self.load_items()
+            if cached is not None:
+                items = self.apply_delta(cached, resp["catalog_delta"])
+        else:
+            items = resp.get("items_master")
+        if items is None:
+            return None
+        self.save_items(items, resp.get("catalog_version"), resp.get("catalog_hash"))
+        return items
@@ -1,6 +1,7 @@
 from cli.cli_cach_manager import CacheManager
 from cli.cli_menu import MainMenu
 from cli.cli_network import NetworkClient
+from cli.cli_setting import PROTOCOL_ENCODING
 
 
 class GameClient:
@@ -8,6 +9,7 @@ class GameClient:
         self.network = NetworkClient()
         self.cache = CacheManager()
         self.menu = MainMenu(self.network, self.cache)
+        self.encoding = PROTOCOL_ENCODING
 
     def run(self):
         print("=== Игровой клиент ===")
@@ -26,16 +28,27 @@ class GameClient:
                 if n.lower() in ("выход", "quit", "exit"):
                     self.network.disconnect()
                     return
-                self.network.send({"action": "login", "nickname": n})
+                login = {"action": "login", "nickname": n}
+                version, catalog_hash = self.cache.load_version()
+                if version or catalog_hash:
+                    login["catalog_version"] = version
+                    login["catalog_hash"] = catalog_hash
+                if self.encoding != "json":
+                    login["encoding"] = self.encoding
+                self.network.send(login)
                 resp = self.network.recv()
                 if not resp or resp.get("status") != "ok":
                     print("Ошибка входа:", resp.get("error") if resp else "Нет ответа")
                     continue
+                if resp.get("encoding"):
+                    self.network.set_encoding(resp["encoding"])
                 account = resp["account"]
-                master_items = resp["items_master"]
+                master_items = self.cache.sync_from_login(resp)
+                if master_items is None:
+                    # локальный кэш пропал между запросом и ответом — каталог будет пуст до следующего входа
+                    master_items = []
                 print("Вход выполнен как:", account["nickname"])
                 print("Бонус:", resp.get("login_bonus", 0), "кредитов")
-                self.cache.save_items(master_items)
                 self.menu.set_account(account, master_items)
                 nickname = n
                 input("\nНажмите Enter для меню...")
@@ -42,19 +42,92 @@ class MainMenu(Menu):
         self.cache = cache
         self.master_items = []
         self.account = None
+        self.catalog_stale = False  # сервер сообщил о новой версии каталога (catalog_update)
 
     def set_account(self, account, master_items):
         self.account = account
         self.master_items = master_items
+        self.catalog_stale = False
+
+    def recv(self):
+        """Ответ сервера; поле catalog_update помечает локальный каталог устаревшим."""
+        resp = self.network.recv()
+        if resp and resp.get("catalog_update"):
+            self.catalog_stale = True
+        return resp
+
+    def subscribe(self):
+        """Подписка на push-уведомления: баланс и каталог обновляются без опроса whoami."""
+        self.network.send({"action": "subscribe"})
+        self.recv()
+
+    def apply_pushes(self) -> bool:
+        """Применяет push-уведомления, пришедшие, пока меню ждало клавишу; False — сервер закрыл сессию."""
+        for push in self.network.poll_pushes():
+            if push.get("event") == "credits_changed" and push.get("account"):
+                self.account = push["account"]
+            elif push.get("event") == "catalog_changed":
+                self.catalog_stale = True
+            elif push.get("event") == "session_closed":
+                print("Сессия закрыта сервером:", push.get("reason"))
+                input("\nНажмите Enter...")
+                return False
+        return True
+
+    def refresh_catalog(self, attempts=3):
+        """
+        Перечитывает каталог страницами list_items и обновляет локальный кэш.
+        Все страницы должны прийти с одной catalog_version: если каталог изменился
+        во время чтения, чтение начинается заново — иначе в кэше под новой версией
+        осталась бы смесь старых и новых предметов.
+        """
+        self.catalog_stale = False
+        for _ in range(attempts):
+            items, cursor, version = [], None, None
+            while True:
+                msg = {"action": "list_items", "limit": 500}
+                if cursor:
+                    msg["cursor"] = cursor
+                self.network.send(msg)
+                resp = self.recv()
+                if not resp or resp.get("status") != "ok":
+                    self.catalog_stale = True
+                    return
+                if version is None:
+                    version = resp.get("catalog_version")
+                elif resp.get("catalog_version") != version:
+                    break
+                items.extend(resp["items"])
+                cursor = resp.get("next_cursor")
+                if not cursor:
+                    self.master_items = items
+                    self.cache.save_items(items, version)
+                    print("Каталог обновлён.")
+                    return
+        self.catalog_stale = True  # каталог всё время меняется — попробуем при следующем выборе
 
     def pretty_print_items(self, items):
         for it in items:
             print(f"  id:{it['id']}  {it['name']}  цена:{it['price']}")
 
+    def owned_quantity(self, item_id):
+        """Сколько штук предмета у игрока: стопки больше одной приходят в quantities."""
+        if item_id not in self.account.get("items", []):
+            return 0
+        return self.account.get("quantities", {}).get(str(item_id), 1)
+
+    @staticmethod
+    def ask_quantity():
+        value = input("Количество (Enter — 1): ").strip()
+        return int(value) if value.isdigit() and int(value) > 0 else 1
+
     def handle_choice(self, choice):
+        if self.catalog_stale and choice in ("Инвентарь", "Магазин", "Купить"):
+            self.refresh_catalog()
+
         if choice == "Баланс":
             self.network.send({"action": "whoami"})
-            resp = self.network.recv()
+            resp = self.recv()
             if resp and resp.get("status") == "ok":
                 self.account = resp["account"]
                 print("Ваши кредиты:", self.account["credits"])
@@ -63,8 +136,12 @@ class MainMenu(Menu):
         elif choice == "Инвентарь":
             print("Ваши предметы:", self.account.get("items", []))
             if self.account.get("items"):
-                owned = [it for it in self.master_items if it["id"] in self.account["items"]]
-                self.pretty_print_items(owned)
+                owned = set(self.account["items"])
+                for it in self.master_items:
+                    if it["id"] in owned:
+                        count = self.owned_quantity(it["id"])
+                        suffix = f"  x{count}" if count > 1 else ""
+                        print(f"  id:{it['id']}  {it['name']}  цена:{it['price']}{suffix}")
             input("\nНажмите Enter...")
 
         elif choice == "Магазин":
@@ -75,11 +152,15 @@ class MainMenu(Menu):
         elif choice == "Купить":
             item_id = input("Введите id предмета для покупки: ")
             if item_id.isdigit():
-                self.network.send({"action": "buy", "item_id": int(item_id)})
-                resp = self.network.recv()
+                msg = {"action": "buy", "item_id": int(item_id)}
+                item = next((it for it in self.master_items if it["id"] == int(item_id)), None)
+                if item and item.get("max_stack", 1) > 1:
+                    msg["quantity"] = self.ask_quantity()
+                self.network.send(msg)
+                resp = self.recv()
                 if resp and resp.get("status") == "ok":
                     self.account = resp["account"]
-                    print("Куплено:", resp["bought"]["name"])
+                    print("Куплено:", resp["bought"]["name"], f"x{resp.get('quantity', 1)}")
                     print("Остаток кредитов:", self.account["credits"])
                 else:
                     print("Ошибка:", resp.get("error"))
@@ -88,11 +169,14 @@ class MainMenu(Menu):
         elif choice == "Продать":
             item_id = input("Введите id предмета для продажи: ")
             if item_id.isdigit():
-                self.network.send({"action": "sell", "item_id": int(item_id)})
-                resp = self.network.recv()
+                msg = {"action": "sell", "item_id": int(item_id)}
+                if self.owned_quantity(int(item_id)) > 1:
+                    msg["quantity"] = self.ask_quantity()
+                self.network.send(msg)
+                resp = self.recv()
                 if resp and resp.get("status") == "ok":
                     self.account = resp["account"]
-                    print("Продано:", resp["sold"]["name"])
+                    print("Продано:", resp["sold"]["name"], f"x{resp.get('quantity', 1)}")
                     print("Кредитов теперь:", self.account["credits"])
                 else:
                     print("Ошибка:", resp.get("error"))
@@ -112,7 +196,10 @@ class MainMenu(Menu):
 
     def run(self, account):
         self.account = account
+        self.subscribe()
         while True:
+            if not self.apply_pushes():
+                return None
             self.display(self.account)
             key = readchar.readkey()
             if key in ('\x1b[A', readchar.key.UP):
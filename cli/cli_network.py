@@ -1,44 +1,139 @@
-import json
 import socket
+from collections import deque
 
 from cli.cli_setting import SERVER_HOST, SERVER_PORT
+from common.common_codec import CODECS, JSON_CODEC
+
+RECV_CHUNK = 64 * 1024
+# При таком объёме уже прочитанных кадров начало буфера освобождается.
+COMPACT_THRESHOLD = 256 * 1024
+# Сколько непрочитанных push-уведомлений хранить (старые вытесняются).
+PUSH_BACKLOG = 100
 
 
 class NetworkClient:
-    """Класс для работы с сервером (отправка/приём JSON)."""
+    """
+    Класс для работы с сервером (отправка/приём сообщений).
+    По умолчанию JSON по строкам; после подтверждения сервером в login
+    можно переключиться на бинарный кодек через set_encoding.
+
+    Входящие данные копятся в постоянном буфере: кадры выдаются по одному,
+    склеенные и разрезанные на части ответы не теряются, поэтому можно
+    отправить несколько запросов подряд (send_many) и читать ответы recv().
+
+    Push-уведомления сервера ({"type": "push"}) в recv() не возвращаются:
+    они копятся в self.pushes, poll_pushes() забирает их без ожидания.
+    """
 
     def __init__(self, host=SERVER_HOST, port=SERVER_PORT):
         self.host = host
         self.port = port
         self.sock = None
+        self.codec = JSON_CODEC
+        self.pushes = deque(maxlen=PUSH_BACKLOG)
+        self._reset_buffer()
+
+    def _reset_buffer(self):
+        self._buffer = bytearray()
+        self._responses = deque()  # ответы, прочитанные poll_pushes раньше recv()
+        self._pos = 0  # начало непрочитанных данных в _buffer
+        self._searched = 0  # сколько байт после _pos уже просмотрено без конца кадра
 
     def connect(self):
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.sock.connect((self.host, self.port))
+        self.codec = JSON_CODEC
+        self._reset_buffer()
+
+    def set_encoding(self, name):
+        self.codec = CODECS[name]
+        self._searched = 0
 
     def disconnect(self):
         if self.sock:
             self.sock.close()
             self.sock = None
+        self._reset_buffer()
 
     def send(self, obj: dict):
-        data = json.dumps(obj, ensure_ascii=False) + "\n"
-        self.sock.sendall(data.encode("utf-8"))
+        self.sock.sendall(self.codec.encode(obj))
 
-    def recv(self):
-        """Получение одного JSON-объекта из сокета."""
-        data = b""
+    def send_many(self, objs):
+        """Отправляет несколько запросов одним пакетом, не дожидаясь ответов."""
+        self.sock.sendall(b"".join(self.codec.encode(obj) for obj in objs))
+
+    def _next_frame(self):
+        end = self.codec.frame_end(self._buffer, self._pos, self._searched)
+        if end is None:
+            self._searched = len(self._buffer) - self._pos
+            return None
+        frame = bytes(memoryview(self._buffer)[self._pos:end])
+        self._pos = end
+        self._searched = 0
+        if self._pos == len(self._buffer):
+            self._buffer.clear()
+            self._pos = 0
+        elif self._pos >= COMPACT_THRESHOLD:
+            del self._buffer[:self._pos]
+            self._pos = 0
+        return frame
+
+    def recv_frame(self):
+        """Следующий полный кадр (bytes) или None, если соединение закрыто."""
         while True:
-            chunk = self.sock.recv(4096)
+            frame = self._next_frame()
+            if frame is not None:
+                return frame
+            chunk = self.sock.recv(RECV_CHUNK)
             if not chunk:
-                if data:
-                    break
                 return None
-            data += chunk
-            if b"\n" in chunk:
-                break
-        line, _, _ = data.partition(b"\n")
+            self._buffer += chunk
+
+    def _decode(self, frame):
         try:
-            return json.loads(line.decode("utf-8"))
+            return self.codec.decode(frame)
         except Exception:
             return None
+
+    def _is_push(self, msg) -> bool:
+        if isinstance(msg, dict) and msg.get("type") == "push":
+            self.pushes.append(msg)
+            return True
+        return False
+
+    def recv(self):
+        """Получение одного ответа из сокета (push-уведомления откладываются в self.pushes)."""
+        if self._responses:
+            return self._responses.popleft()
+        while True:
+            frame = self.recv_frame()
+            if frame is None:
+                return None
+            msg = self._decode(frame)
+            if not self._is_push(msg):
+                return msg
+
+    def poll_pushes(self):
+        """Читает без ожидания всё, что уже пришло, и возвращает накопленные push-уведомления."""
+        if self.sock is not None:
+            self.sock.setblocking(False)
+            try:
+                while True:
+                    chunk = self.sock.recv(RECV_CHUNK)
+                    if not chunk:
+                        break
+                    self._buffer += chunk
+            except (BlockingIOError, InterruptedError):
+                pass
+            finally:
+                self.sock.setblocking(True)
+            while True:
+                frame = self._next_frame()
+                if frame is None:
+                    break
+                msg = self._decode(frame)
+                if not self._is_push(msg):
+                    self._responses.append(msg)
+        pushes = list(self.pushes)
+        self.pushes.clear()
+        return pushes
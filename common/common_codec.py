@@ -0,0 +1,333 @@
+"""
+Кодеки протокола клиент-сервер.
+
+json    — JSON по строкам (по умолчанию, совместим со старыми клиентами);
+msgpack — кадры с 4-байтовым префиксом длины (big-endian) и компактной
+          бинарной сериализацией, совместимой с подмножеством MessagePack
+          (nil, bool, int, float, str, bin, array, map). Реализовано на struct,
+          без внешних зависимостей.
+
+Кодек выбирается при входе: клиент передаёт "encoding" в login, сервер
+отвечает на login текущим кодеком и подтверждает "encoding"; все следующие
+сообщения в обе стороны идут в новом кодеке.
+"""
+import asyncio
+import json
+import struct
+
+# Максимальный размер одного кадра/строки.
+MAX_FRAME = 16 << 20
+
+_LEN = struct.Struct(">I")
+
+
+class Raw(bytes):
+    """
+    Значение, уже закодированное текущим кодеком (например, кэшированный каталог).
+    Вставляется в сообщение как есть; в JSON поддерживается на верхнем уровне.
+    """
+
+
+class FrameError(ValueError):
+    """Повреждённый или слишком большой кадр."""
+
+
+class JsonLinesCodec:
+    name = "json"
+
+    def __init__(self, max_frame=MAX_FRAME):
+        self.max_frame = max_frame
+
+    def encode_value(self, value) -> bytes:
+        return json.dumps(value, ensure_ascii=False).encode("utf-8")
+
+    def encode(self, obj: dict) -> bytes:
+        if not any(isinstance(v, Raw) for v in obj.values()):
+            return (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+        parts = []
+        for key, value in obj.items():
+            if not isinstance(value, Raw):
+                value = self.encode_value(value)
+            parts.append(self.encode_value(key) + b": " + value)
+        return b"{" + b", ".join(parts) + b"}\n"
+
+    def decode(self, frame: bytes):
+        return json.loads(frame)
+
+    def read_from(self, f):
+        """Следующий кадр из блокирующего бинарного файла (socket.makefile("rb")) или None при EOF."""
+        line = f.readline(self.max_frame + 1)
+        if not line:
+            return None
+        if not line.endswith(b"\n"):
+            if len(line) > self.max_frame:
+                raise FrameError("frame_too_large")
+            return None  # соединение закрыто посреди строки
+        return line
+
+    async def aread_from(self, reader):
+        """То же для asyncio.StreamReader."""
+        line = await reader.readline()
+        if not line or not line.endswith(b"\n"):
+            return None
+        return line
+
+    def frame_end(self, buffer, start: int = 0, searched: int = 0):
+        """
+        Конец кадра, начинающегося в buffer[start], или None, если кадр ещё не весь.
+        searched — сколько байт после start уже просмотрено без результата.
+        """
+        end = buffer.find(b"\n", start + searched)
+        if end < 0:
+            if len(buffer) - start > self.max_frame:
+                raise FrameError("frame_too_large")
+            return None
+        return end + 1
+
+    def split(self, buffer: bytearray) -> list:
+        """Забирает из буфера все полные кадры; неполный хвост остаётся в буфере."""
+        return _split(self, buffer)
+
+
+class BinaryCodec:
+    name = "msgpack"
+
+    def __init__(self, max_frame=MAX_FRAME):
+        self.max_frame = max_frame
+
+    def encode_value(self, value) -> bytes:
+        out = bytearray()
+        _pack(value, out)
+        return bytes(out)
+
+    def encode(self, obj: dict) -> bytes:
+        out = bytearray(4)
+        _pack(obj, out)
+        _LEN.pack_into(out, 0, len(out) - 4)
+        return bytes(out)
+
+    def decode(self, frame: bytes):
+        value, pos = _unpack(frame, 4)
+        if pos != len(frame):
+            raise FrameError("trailing_data")
+        return value
+
+    def _check_length(self, header: bytes) -> int:
+        length = _LEN.unpack(header)[0]
+        if length > self.max_frame:
+            raise FrameError("frame_too_large")
+        return length
+
+    def read_from(self, f):
+        header = f.read(4)
+        if len(header) < 4:
+            return None
+        body = f.read(self._check_length(header))
+        if len(body) < _LEN.unpack(header)[0]:
+            return None
+        return header + body
+
+    async def aread_from(self, reader):
+        try:
+            header = await reader.readexactly(4)
+            body = await reader.readexactly(self._check_length(header))
+        except asyncio.IncompleteReadError:
+            return None
+        return header + body
+
+    def frame_end(self, buffer, start: int = 0, searched: int = 0):
+        if len(buffer) - start < 4:
+            return None
+        end = start + 4 + self._check_length(bytes(buffer[start:start + 4]))
+        return end if len(buffer) >= end else None
+
+    def split(self, buffer: bytearray) -> list:
+        return _split(self, buffer)
+
+
+def _split(codec, buffer: bytearray) -> list:
+    frames = []
+    start = 0
+    while True:
+        end = codec.frame_end(buffer, start)
+        if end is None:
+            break
+        frames.append(bytes(buffer[start:end]))
+        start = end
+    if start:
+        del buffer[:start]
+    return frames
+
+
+JSON_CODEC = JsonLinesCodec()
+BINARY_CODEC = BinaryCodec()
+CODECS = {JSON_CODEC.name: JSON_CODEC, BINARY_CODEC.name: BINARY_CODEC}
+
+
+def _pack(value, out: bytearray):
+    if value is None:
+        out.append(0xC0)
+    elif value is True:
+        out.append(0xC3)
+    elif value is False:
+        out.append(0xC2)
+    elif isinstance(value, Raw):
+        out += value
+    elif isinstance(value, int):
+        _pack_int(value, out)
+    elif isinstance(value, float):
+        out.append(0xCB)
+        out += struct.pack(">d", value)
+    elif isinstance(value, str):
+        data = value.encode("utf-8")
+        n = len(data)
+        if n < 32:
+            out.append(0xA0 | n)
+        elif n < 0x100:
+            out += struct.pack(">BB", 0xD9, n)
+        elif n < 0x10000:
+            out += struct.pack(">BH", 0xDA, n)
+        else:
+            out += struct.pack(">BI", 0xDB, n)
+        out += data
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        n = len(value)
+        if n < 0x100:
+            out += struct.pack(">BB", 0xC4, n)
+        elif n < 0x10000:
+            out += struct.pack(">BH", 0xC5, n)
+        else:
+            out += struct.pack(">BI", 0xC6, n)
+        out += value
+    elif isinstance(value, dict):
+        n = len(value)
+        if n < 16:
+            out.append(0x80 | n)
+        elif n < 0x10000:
+            out += struct.pack(">BH", 0xDE, n)
+        else:
+            out += struct.pack(">BI", 0xDF, n)
+        for k, v in value.items():
+            _pack(k, out)
+            _pack(v, out)
+    elif isinstance(value, (list, tuple)) or hasattr(value, "__iter__"):
+        items = value if isinstance(value, (list, tuple)) else list(value)
+        n = len(items)
+        if n < 16:
+            out.append(0x90 | n)
+        elif n < 0x10000:
+            out += struct.pack(">BH", 0xDC, n)
+        else:
+            out += struct.pack(">BI", 0xDD, n)
+        for v in items:
+            _pack(v, out)
+    else:
+        raise TypeError(f"cannot encode {type(value).__name__}")
+
+
+def _pack_int(value: int, out: bytearray):
+    if 0 <= value < 0x80:
+        out.append(value)
+    elif -32 <= value < 0:
+        out.append(value & 0xFF)
+    elif value >= 0:
+        if value < 0x100:
+            out += struct.pack(">BB", 0xCC, value)
+        elif value < 0x10000:
+            out += struct.pack(">BH", 0xCD, value)
+        elif value < 0x100000000:
+            out += struct.pack(">BI", 0xCE, value)
+        else:
+            out += struct.pack(">BQ", 0xCF, value)
+    else:
+        if value >= -0x80:
+            out += struct.pack(">Bb", 0xD0, value)
+        elif value >= -0x8000:
+            out += struct.pack(">Bh", 0xD1, value)
+        elif value >= -0x80000000:
+            out += struct.pack(">Bi", 0xD2, value)
+        else:
+            out += struct.pack(">Bq", 0xD3, value)
+
+
+# тип -> (struct-формат, размер) для чисел фиксированной длины
+_FIXED = {
+    0xCA: (">f", 4), 0xCB: (">d", 8),
+    0xCC: (">B", 1), 0xCD: (">H", 2), 0xCE: (">I", 4), 0xCF: (">Q", 8),
+    0xD0: (">b", 1), 0xD1: (">h", 2), 0xD2: (">i", 4), 0xD3: (">q", 8),
+}
+# тип -> (формат длины, размер) для str/bin/array/map
+_SIZED = {
+    0xD9: ("str", ">B", 1), 0xDA: ("str", ">H", 2), 0xDB: ("str", ">I", 4),
+    0xC4: ("bin", ">B", 1), 0xC5: ("bin", ">H", 2), 0xC6: ("bin", ">I", 4),
+    0xDC: ("array", ">H", 2), 0xDD: ("array", ">I", 4),
+    0xDE: ("map", ">H", 2), 0xDF: ("map", ">I", 4),
+}
+
+
+def _unpack(data: bytes, pos: int):
+    try:
+        b = data[pos]
+    except IndexError:
+        raise FrameError("truncated") from None
+    pos += 1
+    if b < 0x80:
+        return b, pos
+    if b >= 0xE0:
+        return b - 0x100, pos
+    if 0xA0 <= b <= 0xBF:
+        return _take_str(data, pos, b & 0x1F)
+    if 0x90 <= b <= 0x9F:
+        return _take_array(data, pos, b & 0x0F)
+    if 0x80 <= b <= 0x8F:
+        return _take_map(data, pos, b & 0x0F)
+    if b == 0xC0:
+        return None, pos
+    if b == 0xC2:
+        return False, pos
+    if b == 0xC3:
+        return True, pos
+    if b in _FIXED:
+        fmt, size = _FIXED[b]
+        if pos + size > len(data):
+            raise FrameError("truncated")
+        return struct.unpack_from(fmt, data, pos)[0], pos + size
+    if b in _SIZED:
+        kind, fmt, size = _SIZED[b]
+        if pos + size > len(data):
+            raise FrameError("truncated")
+        n = struct.unpack_from(fmt, data, pos)[0]
+        pos += size
+        if kind == "str":
+            return _take_str(data, pos, n)
+        if kind == "bin":
+            if pos + n > len(data):
+                raise FrameError("truncated")
+            return bytes(data[pos:pos + n]), pos + n
+        if kind == "array":
+            return _take_array(data, pos, n)
+        return _take_map(data, pos, n)
+    raise FrameError(f"unsupported type 0x{b:02x}")
+
+
+def _take_str(data, pos, n):
+    if pos + n > len(data):
+        raise FrameError("truncated")
+    return bytes(data[pos:pos + n]).decode("utf-8"), pos + n
+
+
+def _take_array(data, pos, n):
+    items = []
+    for _ in range(n):
+        value, pos = _unpack(data, pos)
+        items.append(value)
+    return items, pos
+
+
+def _take_map(data, pos, n):
+    result = {}
+    for _ in range(n):
+        key, pos = _unpack(data, pos)
+        value, pos = _unpack(data, pos)
+        result[key] = value
+    return result, pos
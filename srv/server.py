@@ -1,25 +1,77 @@
+import csv
+import multiprocessing
 import socket
 import threading
+import time
 import logging
 
-from srv.srv_cli_handler import ClientHandler
-from srv.srv_config import load_config, DEFAULT_ITEMS_FILE
+from srv.srv_async_server import run_async_server
+from srv.srv_backpressure import BoundedExecutor, ConnectionLimiter, busy_response
+from srv.srv_cli_handler import ClientHandler, send_json
+from srv.srv_config import load_config
 from srv.srv_db import DB
 from srv.srv_game import GameService
+from srv.srv_catalog_store import read_import_file
+from srv.srv_catalog_watcher import CatalogWatcher
 from srv.srv_items_repository import ItemRepository
+from srv.srv_metrics import REGISTRY, start_metrics_server, summary as metrics_summary
 
 
-def admin_console_loop(items_repo: ItemRepository, shutdown_event: threading.Event):
+def _csv_rows(path):
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        for row in csv.reader(f):
+            if row and row[0].strip():
+                yield [field.strip() for field in row]
+
+
+def _nicknames(args):
+    """Ники из аргументов команды или из файла (@file: ник в первой колонке каждой строки)."""
+    if len(args) == 1 and args[0].startswith("@"):
+        return (row[0] for row in _csv_rows(args[0][1:]))
+    return iter(args)
+
+
+def _bulk_command(db: DB, cmd: str, args: list):
+    """Массовые операции с аккаунтами из консоли; печатает число строк и время."""
+    start = time.perf_counter()
+    if cmd == "credits" and len(args) == 1 and args[0].startswith("@"):
+        count = db.grant_credits((row[0], int(row[1])) for row in _csv_rows(args[0][1:]))
+    elif cmd == "credits" and args[1:] == ["all"]:
+        count = db.grant_credits_all(int(args[0]))
+    elif cmd == "credits":
+        amount = int(args[0])
+        count = db.grant_credits((nickname, amount) for nickname in _nicknames(args[1:]))
+    elif cmd == "grant":
+        item_id, quantity = int(args[0]), int(args[1])
+        count = db.grant_items((nickname, item_id, quantity) for nickname in _nicknames(args[2:]))
+    else:  # revoke
+        item_id = int(args[0])
+        count = db.revoke_items((nickname, item_id, None) for nickname in _nicknames(args[1:]))
+    print(f"{cmd}: {count} rows updated in {time.perf_counter() - start:.2f}s")
+
+
+def admin_console_loop(items_repo: ItemRepository, shutdown_event: threading.Event, on_catalog_change=None,
+                       db: DB = None):
     """
+    on_catalog_change — вызывается после перечитывания каталога командой reload
+    (в режиме нескольких процессов рассылает воркерам команду reload).
+    Правки add/remove/import сохраняются отложенно (ItemRepository.schedule_save).
+    db — база аккаунтов для массовых операций (credits/grant/revoke, очистка при remove).
+
     Поддерживает простые команды:
       add <name> <price>   - добавить предмет
-      remove <id>          - удалить предмет
+      remove <id> [refund] - удалить предмет и изъять его у игроков (refund — вернуть цену)
+      import <file> [replace] - массовый импорт из .csv/.jsonl (replace — заменить каталог)
       list                 - вывести список предметов
-      save                 - сохранить в файл
-      reload               - перечитать items из файла (перезапишет текущий список)
+      save                 - сохранить в хранилище сразу
+      reload               - перечитать items из хранилища (перезапишет текущий список)
+      credits <amount> <nick...>|all|@file.csv - начислить кредиты (в файле: ник,сумма)
+      grant <item_id> <qty> <nick...>|@file    - выдать предмет игрокам
+      revoke <item_id> <nick...>|@file         - изъять предмет у игроков
+      stats                - метрики запросов, подключений и пула DB
       exit/shutdown        - завершить сервер
     """
-    print("Admin console ready. Команды: add/remove/list/save/reload/shutdown")
+    print("Admin console ready. Команды: add/remove/import/list/save/reload/credits/grant/revoke/stats/shutdown")
     while not shutdown_event.is_set():
         try:
             line = input("admin> ").strip()
@@ -34,13 +86,22 @@ def admin_console_loop(items_repo: ItemRepository, shutdown_event: threading.Eve
                 name = " ".join(parts[1:-1])
                 price = int(parts[-1])
                 new = items_repo.add(name, price)
-                items_repo.save()
+                items_repo.schedule_save()
                 print("Added:", new)
-            elif cmd == "remove" and len(parts) == 2:
+            elif cmd == "remove" and len(parts) in (2, 3):
                 iid = int(parts[1])
+                item = items_repo.get(iid)
                 ok = items_repo.remove(iid)
-                items_repo.save()
+                items_repo.schedule_save()
                 print("Removed:" if ok else "Not found")
+                if ok and db is not None:
+                    refund = item["price"] if len(parts) == 3 and parts[2].lower() == "refund" else 0
+                    print("Removed from inventories:", db.purge_item(iid, refund=refund))
+            elif cmd == "import" and len(parts) in (2, 3):
+                replace = len(parts) == 3 and parts[2].lower() == "replace"
+                count = items_repo.import_items(read_import_file(parts[1]), replace=replace)
+                items_repo.schedule_save()
+                print(f"Imported {count} items, catalog version {items_repo.version}")
             elif cmd == "list":
                 for it in items_repo.list_all():
                     print(f"{it['id']}: {it['name']} (price={it['price']})")
@@ -48,8 +109,14 @@ def admin_console_loop(items_repo: ItemRepository, shutdown_event: threading.Eve
                 items_repo.save()
                 print("Saved to", items_repo.path)
             elif cmd == "reload":
-                items_repo.load()
+                items_repo.load(validate=True)
+                if on_catalog_change:
+                    on_catalog_change()
                 print("Reloaded from", items_repo.path)
+            elif cmd in ("credits", "grant", "revoke") and len(parts) >= 2 and db is not None:
+                _bulk_command(db, cmd, parts[1:])
+            elif cmd == "stats":
+                print(metrics_summary())
             elif cmd in ("exit", "shutdown", "quit"):
                 print("Shutting down server (admin)...")
                 shutdown_event.set()
@@ -60,27 +127,30 @@ def admin_console_loop(items_repo: ItemRepository, shutdown_event: threading.Eve
             print("Admin command error:", e)
 
 
-def main():
-    cfg = load_config()
-    items_file = cfg.get("items_file", DEFAULT_ITEMS_FILE)
-    items_repo = ItemRepository(items_file)
-    db = DB(cfg.get("db_file", "game.db"))
-    service = GameService(db, items_repo, cfg)
-
-    host = cfg.get("host", "127.0.0.1")
-    port = int(cfg.get("port", 5000))
-
-    shutdown_event = threading.Event()
-
-    admin_thread = threading.Thread(target=admin_console_loop, args=(items_repo, shutdown_event), daemon=True)
-    admin_thread.start()
-
+def create_listener(host: str, port: int, backlog: int, reuse_port: bool = False) -> socket.socket:
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        # несколько процессов слушают один порт, ядро распределяет подключения
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
     s.bind((host, port))
-    s.listen(8)
-    logging.info("Server listening on %s:%s", host, port)
+    s.listen(backlog)
+    return s
+
+
+def request_executor(cfg: dict) -> BoundedExecutor:
+    workers = int(cfg.get("request_workers", cfg.get("async_workers", 8)))
+    return BoundedExecutor(workers, int(cfg.get("max_pending_requests", 1024)))
 
+
+def serve_threaded(s: socket.socket, service: GameService, shutdown_event: threading.Event):
+    """
+    Классический режим: отдельный поток ClientHandler на каждое подключение.
+    Число подключений ограничено max_connections, запросы выполняются в общем
+    ограниченном пуле; сверх лимитов клиент получает server_busy.
+    """
+    limiter = ConnectionLimiter(int(service.cfg.get("max_connections", 10000)))
+    executor = request_executor(service.cfg)
     try:
         while not shutdown_event.is_set():
             try:
@@ -90,9 +160,201 @@ def main():
                 continue
             except Exception:
                 raise
+            if not limiter.try_acquire():
+                logging.warning("Connection limit reached, rejecting %s", addr)
+                send_json(conn, busy_response())
+                conn.close()
+                continue
             logging.info("Connection from %s", addr)
-            handler = ClientHandler(conn, addr, service)
+            handler = ClientHandler(conn, addr, service, executor=executor, limiter=limiter)
             handler.start()
+    finally:
+        executor.shutdown()
+
+
+def build_service(cfg: dict) -> GameService:
+    items_repo = ItemRepository.from_config(cfg)
+    db = DB(cfg.get("db_file", "game.db"), pool_size=int(cfg.get("db_pool_size", 8)))
+    REGISTRY.register_collector(db.stats)
+    REGISTRY.register_collector(lambda: {"tzl_catalog_version": items_repo.version,
+                                         "tzl_catalog_items": len(items_repo.snapshot())})
+    return GameService(db, items_repo, cfg)
+
+
+def start_metrics(cfg: dict, offset: int = 0):
+    """HTTP /metrics, если задан metrics_port (в pre-fork режиме — порт + номер воркера)."""
+    port = int(cfg.get("metrics_port", 0))
+    if port:
+        start_metrics_server(cfg.get("metrics_host", "127.0.0.1"), port + offset)
+
+
+def serve(s: socket.socket, service: GameService, cfg: dict, shutdown_event: threading.Event):
+    if cfg.get("server_mode", "threaded") == "asyncio":
+        run_async_server(s, service, cfg, shutdown_event)
+    else:
+        serve_threaded(s, service, shutdown_event)
+
+
+def _worker_commands(commands, items_repo: ItemRepository, shutdown_event: threading.Event):
+    """Команды супервизора воркеру: reload — перечитать каталог, shutdown — остановиться."""
+    while not shutdown_event.is_set():
+        try:
+            cmd = commands.recv()
+        except (EOFError, OSError):
+            cmd = "shutdown"  # супервизор завершился
+        if cmd == "reload":
+            items_repo.load()
+            logging.info("Catalog reloaded (version %s)", items_repo.version)
+        elif cmd == "shutdown":
+            shutdown_event.set()
+
+
+def worker_main(cfg: dict, index: int, commands):
+    """Точка входа процесса-воркера: свой сокет с SO_REUSEPORT, свой пул DB."""
+    service = build_service(cfg)
+    start_metrics(cfg, offset=index)
+    shutdown_event = threading.Event()
+    threading.Thread(target=_worker_commands, args=(commands, service.items, shutdown_event), daemon=True).start()
+    threading.Thread(target=service.sessions.run_reaper, args=(shutdown_event,), daemon=True).start()
+    s = create_listener(cfg.get("host", "127.0.0.1"), int(cfg.get("port", 5000)),
+                        int(cfg.get("backlog", 128)), reuse_port=True)
+    logging.info("Worker %s listening (pid=%s)", index, multiprocessing.current_process().pid)
+    try:
+        serve(s, service, cfg, shutdown_event)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        shutdown_event.set()
+        s.close()
+        service.close()
+
+
+class WorkerPool:
+    """
+    Супервизор pre-fork режима: N процессов слушают один порт через SO_REUSEPORT
+    и делят базу SQLite (WAL + BEGIN IMMEDIATE). Упавшие воркеры перезапускаются.
+
+    Воркеры создаются однопоточным процессом forkserver, а не fork() самого
+    супервизора: в нём уже работают консоль и наблюдатель каталога, и дочерний
+    процесс мог унаследовать захваченные ими блокировки (logging, sqlite) и зависнуть.
+    """
+
+    def __init__(self, cfg: dict, count: int):
+        self.cfg = cfg
+        self.count = count
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else None
+        self.ctx = multiprocessing.get_context(method)
+        self.workers = {}  # index -> (process, command pipe)
+
+    def _spawn(self, index):
+        recv_end, send_end = self.ctx.Pipe(duplex=False)
+        p = self.ctx.Process(target=worker_main, args=(self.cfg, index, recv_end), daemon=True,
+                             name=f"srv-worker-{index}")
+        p.start()
+        recv_end.close()
+        self.workers[index] = (p, send_end)
+
+    def start(self):
+        for i in range(self.count):
+            self._spawn(i)
+
+    def broadcast(self, cmd):
+        for p, pipe in self.workers.values():
+            try:
+                pipe.send(cmd)
+            except (OSError, ValueError):
+                logging.warning("Worker %s did not receive %s", p.name, cmd)
+
+    def supervise(self, shutdown_event: threading.Event):
+        while not shutdown_event.wait(0.5):
+            for index, (p, pipe) in list(self.workers.items()):
+                if not p.is_alive():
+                    logging.warning("Worker %s exited with %s, restarting", p.name, p.exitcode)
+                    pipe.close()
+                    self._spawn(index)
+
+    def stop(self, timeout=5.0):
+        self.broadcast("shutdown")
+        for p, pipe in self.workers.values():
+            p.join(timeout)
+            if p.is_alive():
+                p.terminate()
+            pipe.close()
+
+
+def main_prefork(cfg: dict, workers: int):
+    if not hasattr(socket, "SO_REUSEPORT"):
+        raise RuntimeError("SO_REUSEPORT is not supported on this platform, set workers to 1")
+    if float(cfg.get("account_flush_interval", 0)) > 0:
+        # кэши разных процессов разошлись бы между собой
+        logging.warning("account_flush_interval is ignored when workers > 1")
+        cfg = dict(cfg, account_flush_interval=0)
+    # таблица сессий у каждого воркера своя (srv_sessions), SO_REUSEPORT распределяет подключения произвольно
+    logging.warning("duplicate_login_policy and resume tokens apply only within one worker when workers > 1: "
+                    "the same nickname can log in on several workers, and resume may fail on another worker")
+
+    pool = WorkerPool(cfg, workers)
+    pool.start()  # forkserver запускается до потоков супервизора
+    items_repo = ItemRepository.from_config(cfg)
+    # воркеры перечитывают каталог после каждой записи правок консоли
+    items_repo.add_save_listener(lambda: pool.broadcast("reload"))
+    # своё соединение с базой для массовых операций консоли (кэша аккаунтов в pre-fork нет)
+    db = DB(cfg.get("db_file", "game.db"), pool_size=2)
+    shutdown_event = threading.Event()
+    admin_thread = threading.Thread(target=admin_console_loop,
+                                    args=(items_repo, shutdown_event, lambda: pool.broadcast("reload"), db),
+                                    daemon=True)
+    admin_thread.start()
+    watcher = CatalogWatcher.from_config(items_repo, cfg, on_change=lambda: pool.broadcast("reload"))
+    if watcher:
+        watcher.start(shutdown_event)
+    logging.info("Supervisor started %s workers on %s:%s", workers, cfg.get("host"), cfg.get("port"))
+    try:
+        pool.supervise(shutdown_event)
+    except KeyboardInterrupt:
+        logging.info("KeyboardInterrupt -> shutting down")
+    finally:
+        logging.info("Server shutting down...")
+        shutdown_event.set()
+        items_repo.close()
+        pool.stop()
+        db.close()
+
+
+def main():
+    cfg = load_config()
+    workers = int(cfg.get("workers", 1))
+    if workers > 1:
+        main_prefork(cfg, workers)
+        return
+
+    service = build_service(cfg)
+    start_metrics(cfg)
+
+    host = cfg.get("host", "127.0.0.1")
+    port = int(cfg.get("port", 5000))
+    backlog = int(cfg.get("backlog", 128))
+    mode = cfg.get("server_mode", "threaded")
+
+    shutdown_event = threading.Event()
+
+    admin_thread = threading.Thread(target=admin_console_loop, args=(service.items, shutdown_event, None, service.db),
+                                    daemon=True)
+    admin_thread.start()
+
+    watcher = CatalogWatcher.from_config(service.items, cfg)
+    if watcher:
+        watcher.start(shutdown_event)
+
+    if service.accounts:
+        threading.Thread(target=service.accounts.run_flusher, args=(shutdown_event,), daemon=True).start()
+    threading.Thread(target=service.sessions.run_reaper, args=(shutdown_event,), daemon=True).start()
+
+    s = create_listener(host, port, backlog)
+    logging.info("Server listening on %s:%s (mode=%s, backlog=%s)", host, port, mode, backlog)
+
+    try:
+        serve(s, service, cfg, shutdown_event)
     except KeyboardInterrupt:
         logging.info("KeyboardInterrupt -> shutting down")
     except Exception:
@@ -101,6 +363,7 @@ def main():
         logging.info("Server shutting down...")
         shutdown_event.set()
         s.close()
+        service.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,324 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from srv.srv_db import DB, make_account
+
+SEQ_KEY = "account_journal_seq"
+
+
+def _inventory(acc: dict) -> dict:
+    """{item_id: количество} из аккаунта в формате протокола (см. make_account)."""
+    quantities = acc.get("quantities", {})
+    return {item_id: quantities.get(str(item_id), 1) for item_id in acc["items"]}
+
+
+class CachedAccount:
+    __slots__ = ("nickname", "credits", "items", "sessions", "pending")
+
+    def __init__(self, nickname, credits, items):
+        self.nickname = nickname
+        self.credits = credits
+        self.items = dict(items)  # item_id -> количество: проверка и изменение за O(1)
+        self.sessions = 0  # активные подключения с этим ником
+        self.pending = 0  # операции, ещё не записанные в DB
+
+    def as_dict(self):
+        return make_account(self.nickname, self.credits, self.items)
+
+
+class AccountCache:
+    """
+    Кэш аккаунтов в памяти с отложенной записью в DB (write-behind).
+
+    Каждое изменение сначала дописывается в журнал (write-ahead), затем
+    применяется к памяти; фоновый поток раз в flush_interval секунд переносит
+    накопленные операции в DB одной транзакцией (DB.apply_account_ops).
+    При старте незаписанные операции из журнала применяются к DB; операции
+    с номером не больше сохранённого в meta пропускаются.
+
+    Запись в кэше = состояние в DB + незаписанные операции, поэтому бонус за вход
+    записывается в DB под блокировкой кэша (login). Операция, которую DB отклонила
+    (нарушено ограничение), не применяется и переносится в <журнал>.rejected.
+    Аккаунты без активных подключений вытесняются по LRU, если все их
+    операции уже записаны.
+    """
+
+    def __init__(self, db: DB, journal_path, max_entries=10000, flush_interval=1.0, fsync=False):
+        self.db = db
+        self.journal_path = journal_path
+        self.max_entries = max_entries
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        self._entries = OrderedDict()  # nickname -> CachedAccount; начало — давно не использованные
+        self._pending = []  # [(seq, nickname, credits_delta, item_id, quantity_delta)]
+        self._local = threading.local()  # журнал отмены для transaction()
+        self._seq = int(db.get_meta(SEQ_KEY, 0))
+        self._replay()
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+        db.bulk_guard = self.external_changes
+
+    @classmethod
+    def from_config(cls, db: DB, cfg: dict):
+        """Кэш по настройкам сервера или None, если account_flush_interval не задан."""
+        interval = float(cfg.get("account_flush_interval", 0))
+        if interval <= 0:
+            return None
+        return cls(db, cfg.get("account_journal_file", "accounts.journal"),
+                   max_entries=int(cfg.get("account_cache_size", 10000)),
+                   flush_interval=interval,
+                   fsync=bool(cfg.get("account_journal_fsync", False)))
+
+    def _replay(self):
+        if not os.path.exists(self.journal_path):
+            return
+        ops = []
+        with open(self.journal_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    seq, nickname, delta, item_id, qty_delta = json.loads(line)
+                except ValueError:
+                    continue  # недописанная строка при аварийном завершении
+                if isinstance(qty_delta, bool):
+                    qty_delta = 1 if qty_delta else -1  # журнал до появления количеств
+                if seq > self._seq:
+                    ops.append((seq, nickname, delta, item_id, qty_delta or 0))
+        if ops:
+            logging.info("Replaying %s account operations from %s", len(ops), self.journal_path)
+            self._apply(ops)
+            self._seq = ops[-1][0]
+        open(self.journal_path, "w").close()
+
+    def _apply(self, ops) -> set:
+        """
+        Записывает ops в DB; возвращает ники отклонённых операций. Если пачку целиком
+        DB не принимает, операции применяются по одной: отклонённые пропускаются
+        (номер всё равно сохраняется в meta) и дописываются в <журнал>.rejected,
+        чтобы одна операция не блокировала запись остальных и запуск сервера.
+        """
+        try:
+            self.db.apply_account_ops(ops, SEQ_KEY)
+            return set()
+        except sqlite3.IntegrityError as e:
+            logging.error("Account operations batch rejected by DB (%s), applying one by one", e)
+        rejected = set()
+        for op in ops:
+            try:
+                self.db.apply_account_ops([op], SEQ_KEY)
+            except sqlite3.IntegrityError as e:
+                logging.error("Account operation %s rejected by DB (%s), moved to %s.rejected",
+                              op, e, self.journal_path)
+                with open(self.journal_path + ".rejected", "a", encoding="utf-8") as f:
+                    f.write(json.dumps(op) + "\n")
+                self.db.apply_account_ops([(op[0], op[1], 0, None, 0)], SEQ_KEY)
+                rejected.add(op[1])
+        return rejected
+
+    def _reload(self, nickname):
+        # вызывается под self.lock: запись = DB + оставшиеся незаписанные операции
+        entry = self._entries.get(nickname)
+        acc = self.db.get_account(nickname) if entry is not None else None
+        if acc is None:
+            return
+        entry.credits = acc["credits"]
+        entry.items = _inventory(acc)
+        for _, op_nickname, delta, item_id, qty_delta in self._pending:
+            if op_nickname != nickname:
+                continue
+            entry.credits += delta
+            if item_id is not None:
+                qty = entry.items.get(item_id, 0) + qty_delta
+                if qty > 0:
+                    entry.items[item_id] = qty
+                else:
+                    entry.items.pop(item_id, None)
+
+    def _entry(self, nickname) -> CachedAccount:
+        # вызывается под self.lock
+        entry = self._entries.get(nickname)
+        if entry is None:
+            acc = self.db.get_account(nickname)
+            if acc is None:
+                return None
+            entry = CachedAccount(nickname, acc["credits"], _inventory(acc))
+            self._evict(self.max_entries - 1)  # освобождаем место под новую запись
+            self._entries[nickname] = entry
+        else:
+            self._entries.move_to_end(nickname)
+        return entry
+
+    def _evict(self, limit=None):
+        limit = self.max_entries if limit is None else limit
+        if len(self._entries) <= limit:
+            return
+        for nickname in list(self._entries):
+            if len(self._entries) <= limit:
+                break
+            entry = self._entries[nickname]
+            if entry.sessions == 0 and entry.pending == 0:
+                del self._entries[nickname]
+
+    def _record(self, entry, credits_delta, item_id=None, qty_delta=0):
+        # вызывается под self.lock: сначала журнал, потом память
+        self._seq += 1
+        op = (self._seq, entry.nickname, credits_delta, item_id, qty_delta)
+        self._journal.write(json.dumps(op) + "\n")
+        self._journal.flush()
+        if self.fsync:
+            os.fsync(self._journal.fileno())
+        self._pending.append(op)
+        entry.pending += 1
+        entry.credits += credits_delta
+        if item_id is not None:
+            qty = entry.items.get(item_id, 0) + qty_delta
+            if qty > 0:
+                entry.items[item_id] = qty
+            else:
+                entry.items.pop(item_id, None)
+        undo = getattr(self._local, "undo", None)
+        if undo is not None:
+            undo.append(op)
+
+    def login(self, nickname, bonus, period_start, now):
+        """
+        Вход игрока (DB.login_account) и acquire(). Бонус записывается в DB под
+        блокировкой кэша: иначе параллельный вход того же ника мог прочитать из DB
+        запись уже с бонусом, и бонус учитывался в кэше дважды.
+        Возвращает (аккаунт, начисленный бонус).
+        """
+        with self.lock:
+            _, granted = self.db.login_account(nickname, bonus, period_start, now, read_account=False)
+            entry = self._entries.get(nickname)
+            if entry is not None:
+                entry.credits += granted
+            return self.acquire(nickname), granted
+
+    def acquire(self, nickname):
+        """Подключение игрока: аккаунт закрепляется в кэше до release()."""
+        with self.lock:
+            entry = self._entry(nickname)
+            if entry is None:
+                return None
+            entry.sessions += 1
+            return entry.as_dict()
+
+    def release(self, nickname):
+        with self.lock:
+            entry = self._entries.get(nickname)
+            if entry is not None and entry.sessions > 0:
+                entry.sessions -= 1
+            self._evict()
+
+    def get(self, nickname):
+        with self.lock:
+            entry = self._entry(nickname)
+            return entry.as_dict() if entry else None
+
+    def trade(self, nickname, item_id, credits_delta, acquire, quantity=1, max_stack=1):
+        """То же, что DB.execute_trade, но в памяти с записью в журнал."""
+        with self.lock:
+            entry = self._entry(nickname)
+            if entry is None:
+                return {"error": "not_logged_in"}
+            owned = entry.items.get(item_id, 0)
+            if acquire and (quantity > max_stack or owned + quantity > max_stack):
+                return {"error": "already_owned" if quantity <= max_stack == 1 else "stack_limit"}
+            if not acquire and owned < quantity:
+                return {"error": "not_enough_items" if owned else "not_owned"}
+            if credits_delta < 0 and entry.credits < -credits_delta:
+                return {"error": "not_enough_credits"}
+            self._record(entry, credits_delta, item_id, quantity if acquire else -quantity)
+            return {"account": entry.as_dict()}
+
+    @contextmanager
+    def transaction(self):
+        """
+        Несколько операций атомарно относительно других потоков.
+        При исключении уже выполненные операции компенсируются обратными.
+        """
+        with self.lock:
+            if getattr(self._local, "undo", None) is not None:
+                yield  # вложенный вызов — внешняя транзакция отвечает за откат
+                return
+            self._local.undo = []
+            try:
+                yield
+            except BaseException:
+                undo, self._local.undo = self._local.undo, None
+                for _, nickname, delta, item_id, qty_delta in reversed(undo):
+                    entry = self._entry(nickname)
+                    self._record(entry, -delta, item_id, -qty_delta)
+                raise
+            finally:
+                self._local.undo = None
+
+    def flush(self):
+        """Записывает накопленные операции в DB; возвращает их количество."""
+        with self._flush_lock:
+            with self.lock:
+                ops = list(self._pending)
+            if not ops:
+                return 0
+            rejected = self._apply(ops)
+            with self.lock:
+                self._flushed(ops, rejected)
+            return len(ops)
+
+    def _flushed(self, ops, rejected=()):
+        # вызывается под self.lock: ops записаны в DB, кроме операций ников rejected
+        del self._pending[:len(ops)]
+        for _, nickname, *_rest in ops:
+            entry = self._entries.get(nickname)
+            if entry is not None:
+                entry.pending -= 1
+        for nickname in rejected:
+            self._reload(nickname)  # кэш разошёлся с DB — берём состояние DB
+        self._rewrite_journal()
+        self._evict()
+
+    @contextmanager
+    def external_changes(self):
+        """
+        Изменение DB в обход кэша (массовые операции администратора, DB.bulk_guard).
+        Незаписанные операции сначала переносятся в DB, на время изменения сделки
+        ждут, а записи кэша для ников, добавленных в touched, перечитываются из DB.
+        """
+        with self._flush_lock, self.lock:
+            ops = list(self._pending)
+            if ops:
+                self._flushed(ops, self._apply(ops))
+            touched = set()
+            yield touched
+            for nickname in touched:
+                self._reload(nickname)
+
+    def _rewrite_journal(self):
+        # вызывается под self.lock: в журнале остаются только незаписанные операции
+        tmp = self.journal_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for op in self._pending:
+                f.write(json.dumps(op) + "\n")
+        self._journal.close()
+        os.replace(tmp, self.journal_path)
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+
+    def run_flusher(self, shutdown_event: threading.Event):
+        """Цикл фонового потока: периодический flush до shutdown_event."""
+        while not shutdown_event.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                logging.exception("Account cache flush failed")
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            self._journal.close()
+        if self.db.bulk_guard == self.external_changes:
+            self.db.bulk_guard = None
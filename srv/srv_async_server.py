@@ -0,0 +1,140 @@
+import asyncio
+import logging
+import socket
+import threading
+import time
+
+from common.common_codec import JSON_CODEC
+from srv.srv_backpressure import BoundedExecutor, ConnectionLimiter, busy_response
+from srv.srv_cli_handler import ClientSession
+from srv.srv_game import GameService
+from srv.srv_metrics import CONNECTIONS, action_label, call_with_db_time, record_request
+
+# Максимальная длина одной JSON-строки от клиента (буфер StreamReader).
+READ_LIMIT = 1 << 20
+
+
+class AsyncServer:
+    """
+    Asyncio-сервер: одна корутина на подключение вместо потока.
+    Протокол тот же (JSON по строкам), логика — общий ClientSession.
+    Вызовы GameService (sqlite) выполняются в ограниченном пуле потоков,
+    чтобы не блокировать event loop. При переполнении пула, лимита
+    подключений или буфера отправки клиент получает server_busy/отключается.
+    Push-уведомления из других потоков передаются в event loop
+    через call_soon_threadsafe.
+    """
+
+    def __init__(self, service: GameService, cfg: dict):
+        self.service = service
+        self.cfg = cfg
+        self.executor = BoundedExecutor(int(cfg.get("request_workers", cfg.get("async_workers", 8))),
+                                        int(cfg.get("max_pending_requests", 1024)))
+        self.limiter = ConnectionLimiter(int(cfg.get("max_connections", 10000)))
+        self.high_water = int(cfg.get("send_queue_high_water", 1 << 20))
+        self.send_timeout = float(cfg.get("send_timeout", 10))
+        self._tasks = set()
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        addr = writer.get_extra_info("peername")
+        if not self.limiter.try_acquire():
+            logging.warning("Connection limit reached, rejecting %s", addr)
+            writer.write(JSON_CODEC.encode(busy_response()))
+            writer.close()
+            return
+        logging.info("Client connected: %s", addr)
+        self._tasks.add(asyncio.current_task())
+        CONNECTIONS.inc()
+        writer.transport.set_write_buffer_limits(high=self.high_water)
+        loop = asyncio.get_running_loop()
+        session = ClientSession(self.service, send_push=lambda data: self._push(loop, writer, data),
+                                disconnect=lambda: self._close_soon(loop, writer))
+        try:
+            while not session.closed:
+                try:
+                    frame = await session.codec.aread_from(reader)
+                except (asyncio.LimitOverrunError, ValueError, ConnectionError):
+                    break
+                if frame is None:
+                    break
+                start = time.perf_counter()
+                try:
+                    msg = session.decode(frame)
+                except Exception:
+                    break
+                parse = time.perf_counter() - start
+                fut = self.executor.try_submit(call_with_db_time, session.handle, msg)
+                if fut is None:
+                    resp, service, db = busy_response(msg), 0.0, 0.0
+                else:
+                    resp, service, db = await asyncio.wrap_future(fut)
+                start = time.perf_counter()
+                writer.write(session.encode(resp))
+                try:
+                    await asyncio.wait_for(writer.drain(), self.send_timeout)
+                    slow = False
+                except asyncio.TimeoutError:
+                    slow = True
+                record_request(action_label(msg, session.actions), resp,
+                               parse, service, db, time.perf_counter() - start)
+                if slow:
+                    logging.warning("Client %s is too slow to read responses, disconnecting", addr)
+                    break
+        except asyncio.CancelledError:
+            pass
+        except ConnectionError:
+            pass
+        except Exception:
+            logging.exception("Exception handling client %s", addr)
+        finally:
+            self._tasks.discard(asyncio.current_task())
+            self.limiter.release()
+            CONNECTIONS.dec()
+            session.close()
+            try:
+                writer.close()
+            except Exception:
+                pass
+            logging.info("Connection closed: %s", addr)
+
+    def _push(self, loop, writer: asyncio.StreamWriter, data: bytes) -> bool:
+        # вызывается из любого потока; при заполненном буфере уведомление отбрасывается
+        if writer.is_closing() or writer.transport.get_write_buffer_size() >= self.high_water:
+            return False
+        try:
+            loop.call_soon_threadsafe(self._write_push, writer, data)
+        except RuntimeError:  # event loop уже закрыт
+            return False
+        return True
+
+    @staticmethod
+    def _close_soon(loop, writer: asyncio.StreamWriter):
+        # kick из другого потока: чтение получит EOF, уже поставленные данные дописываются
+        try:
+            loop.call_soon_threadsafe(writer.close)
+        except RuntimeError:
+            pass
+
+    @staticmethod
+    def _write_push(writer: asyncio.StreamWriter, data: bytes):
+        if not writer.is_closing():
+            writer.write(data)
+
+    async def serve(self, sock: socket.socket, shutdown_event: threading.Event):
+        server = await asyncio.start_server(self.handle_connection, sock=sock, limit=READ_LIMIT)
+        logging.info("Async server listening on %s:%s", *sock.getsockname()[:2])
+        try:
+            while not shutdown_event.is_set():
+                await asyncio.sleep(0.5)
+        finally:
+            server.close()
+            for task in list(self._tasks):
+                task.cancel()
+            await server.wait_closed()
+            self.executor.shutdown(wait=False)
+
+
+def run_async_server(sock: socket.socket, service: GameService, cfg: dict, shutdown_event: threading.Event):
+    """Блокирующий запуск asyncio-сервера на уже слушающем сокете."""
+    sock.setblocking(False)
+    asyncio.run(AsyncServer(service, cfg).serve(sock, shutdown_event))
@@ -0,0 +1,178 @@
+import socket
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional
+
+# неблокирующая отправка одного вызова send (нет на Windows)
+_DONTWAIT = getattr(socket, "MSG_DONTWAIT", 0)
+
+SERVER_BUSY = {"status": "error", "error": "server_busy"}
+
+
+def busy_response(msg=None) -> dict:
+    """Ответ при перегрузке; id запроса сохраняется, чтобы клиент мог повторить его."""
+    resp = dict(SERVER_BUSY)
+    if isinstance(msg, dict) and "id" in msg:
+        resp["id"] = msg["id"]
+    return resp
+
+
+class ConnectionLimiter:
+    """Ограничение числа одновременных подключений."""
+
+    def __init__(self, max_connections: int):
+        self.max_connections = max_connections
+        self._lock = threading.Lock()
+        self.active = 0
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            if self.active >= self.max_connections:
+                return False
+            self.active += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.active -= 1
+
+
+class BoundedExecutor:
+    """
+    Пул потоков для обработки запросов с ограниченной очередью:
+    одновременно выполняется не больше max_workers задач, ждёт не больше
+    max_pending; сверх этого задача не принимается (try_submit -> None).
+    """
+
+    def __init__(self, max_workers: int, max_pending: int):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="srv-worker")
+        self._slots = threading.BoundedSemaphore(max_workers + max_pending)
+
+    def try_submit(self, fn, *args) -> Optional[Future]:
+        if not self._slots.acquire(blocking=False):
+            return None
+        try:
+            fut = self._executor.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        fut.add_done_callback(lambda _: self._slots.release())
+        return fut
+
+    def shutdown(self, wait=False):
+        self._executor.shutdown(wait=wait)
+
+
+class OutboundQueue:
+    """
+    Очередь исходящих данных одного подключения.
+    Данные сначала отправляются сразу неблокирующим send из потока, который их
+    поставил; поток записи запускается, только если сокет принял не всё
+    (клиент не успевает читать), и завершается, когда очередь опустела, —
+    обычно у подключения нет второго потока. Без MSG_DONTWAIT (Windows) поток
+    записи работает всё время жизни подключения.
+    Если в очереди больше high_water байт, put ждёт освобождения места
+    (чтение новых запросов приостанавливается) или отказывает по таймауту.
+    """
+
+    def __init__(self, conn: socket.socket, high_water: int):
+        self.conn = conn
+        self.high_water = high_water
+        self.closed = False
+        self._items = deque()
+        self._size = 0
+        self._cond = threading.Condition()
+        self._writer = None  # поток записи, пока в очереди есть данные
+
+    @property
+    def pending_bytes(self) -> int:
+        return self._size
+
+    def start(self):
+        if not _DONTWAIT:
+            with self._cond:
+                self._start_writer()
+
+    def _start_writer(self):
+        # вызывается под self._cond
+        if self._writer is None:
+            self._writer = threading.Thread(target=self._run, daemon=True)
+            self._writer.start()
+
+    def _try_send(self, data: bytes) -> bytes:
+        # вызывается под self._cond при пустой очереди: возвращает неотправленный остаток
+        try:
+            sent = self.conn.send(data, _DONTWAIT)
+        except (BlockingIOError, InterruptedError):
+            return data
+        return data[sent:]
+
+    def put(self, data: bytes, block=True, timeout=None) -> bool:
+        with self._cond:
+            if self.closed:
+                return False
+            if self._size >= self.high_water:
+                if not block:
+                    return False
+                if not self._cond.wait_for(lambda: self._size < self.high_water or self.closed, timeout):
+                    return False
+                if self.closed:
+                    return False
+            if _DONTWAIT and not self._items and self._writer is None:
+                try:
+                    data = self._try_send(data)
+                except OSError:
+                    self.closed = True
+                    return False
+                if not data:
+                    return True
+            self._items.append(data)
+            self._size += len(data)
+            self._start_writer()
+            self._cond.notify_all()
+            return True
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not _DONTWAIT:
+                    self._cond.wait_for(lambda: self._items or self.closed)
+                if not self._items:
+                    self._writer = None
+                    self._cond.notify_all()
+                    return
+                data = b"".join(self._items) if len(self._items) > 1 else self._items[0]
+                self._items.clear()
+            try:
+                self.conn.sendall(data)
+            except OSError:
+                with self._cond:
+                    self.closed = True
+                    self._items.clear()
+                    self._size = 0
+                    self._writer = None
+                    self._cond.notify_all()
+                return
+            with self._cond:
+                self._size -= len(data)
+                self._cond.notify_all()
+
+    def close(self, timeout=None):
+        """
+        Дописывает оставшиеся данные (не дольше timeout) и останавливает поток записи.
+        Если клиент так и не дочитал, соединение обрывается (shutdown): иначе поток
+        остался бы навсегда заблокирован в sendall — close() сокета его не будит.
+        """
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+            writer = self._writer
+        if writer is not None and writer.is_alive():
+            writer.join(timeout)
+            if writer.is_alive():
+                try:
+                    self.conn.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                writer.join()
@@ -0,0 +1,171 @@
+import base64
+import hashlib
+import json
+from bisect import bisect_left, bisect_right
+from typing import Optional
+
+from common.common_codec import JSON_CODEC
+
+# ключи сортировки для list_items; при равных ключах порядок задаёт id
+SORT_KEYS = {
+    "id": lambda it: it["id"],
+    "price": lambda it: it["price"],
+    "name": lambda it: str(it["name"]).casefold(),
+}
+
+
+def encode_cursor(sort: str, order: str, position: tuple) -> str:
+    """Непрозрачный для клиента курсор: позиция (ключ, id) последнего выданного предмета."""
+    raw = json.dumps([sort, order, *position], ensure_ascii=False, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str, sort: str, order: str) -> tuple:
+    """Позиция из курсора; ValueError, если курсор испорчен или от другой сортировки."""
+    try:
+        c_sort, c_order, key, item_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (AttributeError, TypeError, ValueError):
+        raise ValueError("bad cursor")
+    if (c_sort, c_order) != (sort, order) or not isinstance(item_id, int) \
+            or not isinstance(key, str if sort == "name" else (int, float)):
+        raise ValueError("bad cursor")
+    return key, item_id
+
+
+class CatalogSnapshot:
+    """
+    Неизменяемая версия каталога предметов.
+    Опубликованный снимок никогда не изменяется: писатели строят новый снимок
+    и подменяют ссылку в ItemRepository, читатели берут ссылку без блокировки.
+    Производные данные, зависящие только от содержимого, кэшируются в _derived.
+
+    changes — журнал последних публикаций: кортеж (version, {id: existed_before}),
+    по нему строится дельта для клиентов с устаревшим кэшем.
+    """
+
+    def __init__(self, version: int, by_id: dict, max_id: int, changes: tuple = ()):
+        self.version = version
+        self.by_id = by_id
+        self.max_id = max_id
+        self.changes = changes
+        self._derived = {}
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def get(self, item_id: int) -> Optional[dict]:
+        """Предмет по id (общий объект снимка — не изменять)."""
+        return self.by_id.get(item_id)
+
+    def items(self):
+        """Предметы в порядке каталога (общие объекты снимка — не изменять)."""
+        return self.by_id.values()
+
+    def payload(self, codec) -> bytes:
+        """
+        Каталог (массив предметов), закодированный кодеком протокола.
+        Считается один раз на версию и кодек: снимок неизменяем, новая версия — новый кэш.
+        """
+        key = ("items", codec.name)
+        payload = self._derived.get(key)
+        if payload is None:
+            payload = codec.encode_value(list(self.by_id.values()))
+            self._derived[key] = payload
+        return payload
+
+    def json_payload(self) -> bytes:
+        """Каталог в UTF-8 JSON."""
+        return self.payload(JSON_CODEC)
+
+    def content_hash(self) -> str:
+        """Хэш содержимого каталога: совпадает у одинаковых каталогов даже после рестарта."""
+        digest = self._derived.get("hash")
+        if digest is None:
+            digest = hashlib.sha256(self.json_payload()).hexdigest()
+            self._derived["hash"] = digest
+        return digest
+
+    def delta_since(self, base_version: int) -> Optional[dict]:
+        """
+        Изменения относительно версии base_version: {"added", "changed", "removed"}.
+        None — если журнал не покрывает эту версию (клиенту нужен полный каталог).
+        """
+        if base_version > self.version:
+            return None
+        entries = [e for e in self.changes if e[0] > base_version]
+        if len(entries) != self.version - base_version:
+            return None
+        existed = {}
+        for _, touched in entries:
+            for item_id, existed_before in touched.items():
+                existed.setdefault(item_id, existed_before)
+        delta = {"added": [], "changed": [], "removed": []}
+        for item_id, existed_before in existed.items():
+            it = self.by_id.get(item_id)
+            if it is None:
+                if existed_before:
+                    delta["removed"].append(item_id)
+            elif existed_before:
+                delta["changed"].append(it)
+            else:
+                delta["added"].append(it)
+        return delta
+
+    def delta_payload(self, base_version: int, codec=JSON_CODEC) -> Optional[bytes]:
+        """delta_since, закодированная кодеком; кэшируется в снимке по базовой версии."""
+        cache = self._derived.setdefault(("delta", codec.name), {})
+        if base_version not in cache:
+            delta = self.delta_since(base_version)
+            cache[base_version] = None if delta is None else codec.encode_value(delta)
+        return cache[base_version]
+
+    def sorted_index(self, sort: str) -> list:
+        """Отсортированный список (ключ, id) для сортировки sort; строится один раз на снимок."""
+        key = ("index", sort)
+        index = self._derived.get(key)
+        if index is None:
+            keyfn = SORT_KEYS[sort]
+            index = sorted((keyfn(it), item_id) for item_id, it in self.by_id.items())
+            self._derived[key] = index
+        return index
+
+    def query(self, sort="id", descending=False, min_price=None, max_price=None, name_prefix=None,
+              after=None, limit=50):
+        """
+        Страница каталога: (предметы, позиция последнего или None, если страница последняя).
+        Фильтр по полю сортировки сужает диапазон индекса бинарным поиском,
+        остальные фильтры проверяются при просмотре. after — позиция (ключ, id)
+        из предыдущей страницы: пагинация по ключу устойчива к правкам каталога.
+        """
+        index = self.sorted_index(sort)
+        lo, hi = 0, len(index)
+        prefix = name_prefix.casefold() if name_prefix else None
+        if sort == "price":
+            if min_price is not None:
+                lo = bisect_left(index, (min_price,))
+            if max_price is not None:
+                hi = bisect_right(index, (max_price, float("inf")))
+        elif sort == "name" and prefix:
+            lo = bisect_left(index, (prefix,))
+            hi = bisect_left(index, (prefix + "\U0010ffff",))
+        if after is not None:
+            if descending:
+                hi = min(hi, bisect_left(index, tuple(after)))
+            else:
+                lo = max(lo, bisect_right(index, tuple(after)))
+        positions = range(hi - 1, lo - 1, -1) if descending else range(lo, hi)
+
+        page = []
+        last = None
+        for i in positions:
+            it = self.by_id[index[i][1]]
+            if sort != "price" and ((min_price is not None and it["price"] < min_price)
+                                    or (max_price is not None and it["price"] > max_price)):
+                continue
+            if sort != "name" and prefix and not str(it["name"]).casefold().startswith(prefix):
+                continue
+            if len(page) == limit:
+                return page, last  # есть ещё хотя бы один подходящий предмет
+            page.append(it)
+            last = index[i]
+        return page, None
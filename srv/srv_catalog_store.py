@@ -0,0 +1,211 @@
+"""
+Хранилища каталога предметов для ItemRepository и чтение файлов для массового импорта.
+
+Хранилище умеет load() — предметы в порядке каталога (итератор) и
+save(snap, delta) — записать снимок; delta (см. CatalogSnapshot.delta_since)
+изменения с прошлой записи или None, если их нет в журнале снимка.
+Необязательный signature() — подпись содержимого для отслеживания внешних правок.
+"""
+import csv
+import json
+import os
+import sqlite3
+
+# один кодировщик на модуль: json.dumps на каждый предмет заметно медленнее
+_encode = json.JSONEncoder(ensure_ascii=False).encode
+
+
+def validate_item(record: dict) -> dict:
+    """Проверка и приведение типов записи каталога; ValueError, если запись некорректна."""
+    if not isinstance(record, dict):
+        raise ValueError("item must be an object")
+    item = dict(record)
+    name = item.get("name")
+    if not isinstance(name, str) or not name.strip():
+        raise ValueError("item name is required")
+    try:
+        item["price"] = int(item.get("price"))
+    except (TypeError, ValueError):
+        raise ValueError(f"bad price: {item.get('price')!r}")
+    if item["price"] < 0:
+        raise ValueError(f"negative price: {item['price']}")
+    if item.get("max_stack") not in (None, ""):
+        try:
+            item["max_stack"] = int(item["max_stack"])
+        except (TypeError, ValueError):
+            raise ValueError(f"bad max_stack: {item['max_stack']!r}")
+        if item["max_stack"] <= 0:
+            raise ValueError(f"bad max_stack: {item['max_stack']}")
+    else:
+        item.pop("max_stack", None)
+    if item.get("id") in (None, ""):
+        item.pop("id", None)
+    else:
+        try:
+            item["id"] = int(item["id"])
+        except (TypeError, ValueError):
+            raise ValueError(f"bad id: {item['id']!r}")
+        if item["id"] <= 0:
+            raise ValueError(f"bad id: {item['id']}")
+    return item
+
+
+def number_items(items):
+    """Предметам без id присваивается следующий за наибольшим встреченным id (как при загрузке файла)."""
+    next_id = 1
+    for it in items:
+        if "id" not in it:
+            it["id"] = next_id
+        next_id = max(next_id, it["id"] + 1)
+        yield it
+
+
+def read_items_csv(path):
+    """Построчно читает CSV с заголовком (name, price, необязательный id и другие поля)."""
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        reader = csv.DictReader(f)
+        for record in reader:
+            yield reader.line_num, record
+
+
+def read_items_jsonl(path):
+    """Построчно читает JSONL: один объект предмета на строку, пустые строки пропускаются."""
+    with open(path, "r", encoding="utf-8") as f:
+        for lineno, line in enumerate(f, 1):
+            if line.strip():
+                try:
+                    yield lineno, json.loads(line)
+                except ValueError as e:
+                    raise ValueError(f"{path}:{lineno}: {e}")
+
+
+def read_import_file(path):
+    """Итератор проверенных предметов из .csv или .jsonl; ошибка указывает файл и строку."""
+    reader = read_items_csv if path.lower().endswith(".csv") else read_items_jsonl
+    for lineno, record in reader(path):
+        try:
+            yield validate_item(record)
+        except ValueError as e:
+            raise ValueError(f"{path}:{lineno}: {e}")
+
+
+class JsonFileCatalogStore:
+    """
+    Каталог в JSON-файле (массив предметов). Файл пишется целиком во временный
+    файл рядом и подменяется через os.replace: читатель файла никогда не увидит
+    его недописанным. Один предмет на строку — файл остаётся читаемым и diff-friendly.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def signature(self):
+        """(mtime_ns, размер) файла или None, если файла нет — для CatalogWatcher."""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def save(self, snap, delta=None):
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write("[")
+            first = True
+            for it in snap.items():
+                f.write("\n" if first else ",\n")
+                f.write(_encode(it))
+                first = False
+            f.write("\n]\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+
+class SqliteCatalogStore:
+    """
+    Каталог в SQLite: загрузка идёт курсором, а запись при известной дельте
+    затрагивает только изменённые предметы — миллионный каталог не переписывается
+    из-за одного add/remove. Порядок каталога хранится в seq.
+    Если таблица пуста, а рядом есть JSON-каталог (seed_path), он импортируется.
+    """
+
+    def __init__(self, path, seed_path=None):
+        self.path = path
+        self.seed_path = seed_path
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS catalog_items (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    id INTEGER NOT NULL UNIQUE,
+                    data TEXT NOT NULL
+                );
+            """)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30.0)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def load(self):
+        conn = self._connect()
+        try:
+            if self.seed_path and os.path.exists(self.seed_path) and self._empty(conn):
+                self._seed(conn)
+            for (data,) in conn.execute("SELECT data FROM catalog_items ORDER BY seq"):
+                yield json.loads(data)
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _empty(conn) -> bool:
+        return conn.execute("SELECT 1 FROM catalog_items LIMIT 1").fetchone() is None
+
+    def _seed(self, conn):
+        # несколько процессов (pre-fork) стартуют одновременно: пустоту проверяем
+        # повторно под блокировкой записи, заполняет таблицу только первый
+        items = list(number_items(JsonFileCatalogStore(self.seed_path).load()))
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if self._empty(conn):
+                conn.executemany("INSERT INTO catalog_items (id, data) VALUES (?, ?)",
+                                 ((it["id"], _encode(it)) for it in items))
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+    def save(self, snap, delta=None):
+        conn = self._connect()
+        try:
+            with conn:
+                if delta is None:
+                    conn.execute("DELETE FROM catalog_items")
+                    upsert = snap.items()
+                else:
+                    conn.executemany("DELETE FROM catalog_items WHERE id = ?", ((iid,) for iid in delta["removed"]))
+                    upsert = delta["added"] + delta["changed"]
+                # существующий предмет сохраняет seq (место в каталоге), новый — в конец
+                conn.executemany("INSERT INTO catalog_items (id, data) VALUES (?, ?) "
+                                 "ON CONFLICT(id) DO UPDATE SET data = excluded.data",
+                                 ((it["id"], _encode(it)) for it in upsert))
+        finally:
+            conn.close()
+
+
+def store_from_config(cfg: dict, default_items_file: str):
+    """Хранилище каталога по настройке catalog_store: "json" (по умолчанию) или "sqlite"."""
+    items_file = cfg.get("items_file", default_items_file)
+    kind = cfg.get("catalog_store", "json")
+    if kind == "sqlite":
+        return SqliteCatalogStore(cfg.get("catalog_db_file", "catalog.db"), seed_path=items_file)
+    if kind != "json":
+        raise ValueError(f"unknown catalog_store: {kind}")
+    return JsonFileCatalogStore(items_file)
@@ -0,0 +1,59 @@
+"""
+Горячая перезагрузка каталога: поток периодически сравнивает подпись файла
+каталога (mtime, размер) с последней загрузкой/записью ItemRepository и при
+внешней правке перечитывает его. Разбор и проверка идут вне блокировки
+писателей, новая версия публикуется атомарно — get() из buy/sell не ждёт.
+Без внешних зависимостей (опрос вместо inotify); хранилище без signature()
+(SqliteCatalogStore) не отслеживается.
+"""
+import logging
+import threading
+
+from srv.srv_items_repository import ItemRepository
+
+
+class CatalogWatcher:
+    """
+    on_change — вызывается после публикации перечитанного каталога
+    (в режиме нескольких процессов рассылает воркерам reload).
+    Клиенты узнают о новой версии из поля catalog_update ответов (см. ClientSession).
+    """
+
+    def __init__(self, items_repo: ItemRepository, interval=1.0, on_change=None):
+        self.items_repo = items_repo
+        self.interval = interval
+        self.on_change = on_change
+
+    @classmethod
+    def from_config(cls, items_repo: ItemRepository, cfg: dict, on_change=None):
+        """Наблюдатель по настройке catalog_watch_interval или None, если он выключен (0)."""
+        interval = float(cfg.get("catalog_watch_interval", 0))
+        if interval <= 0:
+            return None
+        if getattr(items_repo.store, "signature", None) is None:
+            logging.warning("catalog_watch_interval is ignored for catalog_store %r", cfg.get("catalog_store"))
+            return None
+        return cls(items_repo, interval, on_change)
+
+    def check(self) -> bool:
+        """Одна проверка; True, если каталог перечитан и изменился."""
+        try:
+            changed = self.items_repo.reload_if_changed()
+        except (OSError, ValueError) as e:
+            logging.error("Catalog reload failed, keeping version %s: %s", self.items_repo.version, e)
+            return False
+        if changed:
+            logging.info("Catalog file changed, reloaded (version %s)", self.items_repo.version)
+            if self.on_change:
+                self.on_change()
+        return changed
+
+    def run(self, shutdown_event: threading.Event):
+        """Цикл проверок до shutdown_event (в отдельном daemon-потоке)."""
+        while not shutdown_event.wait(self.interval):
+            self.check()
+
+    def start(self, shutdown_event: threading.Event) -> threading.Thread:
+        thread = threading.Thread(target=self.run, args=(shutdown_event,), name="catalog-watcher", daemon=True)
+        thread.start()
+        return thread
@@ -1,97 +1,446 @@
-import json
 import logging
 import socket
 import threading
+import time
 
+from common.common_codec import CODECS, JSON_CODEC, FrameError, Raw
+from srv.srv_catalog import SORT_KEYS, decode_cursor, encode_cursor
+from srv.srv_backpressure import BoundedExecutor, ConnectionLimiter, OutboundQueue, busy_response
 from srv.srv_game import GameService
+from srv.srv_metrics import CONNECTIONS, action_label, call_with_db_time, record_request
+from srv.srv_push import PUSH_EVENTS, SESSION_CLOSED, push_message
 
 
 def send_json(conn: socket.socket, obj: dict):
     try:
-        data = json.dumps(obj, ensure_ascii=False) + "\n"
-        conn.sendall(data.encode("utf-8"))
+        conn.sendall(JSON_CODEC.encode(obj))
     except Exception as e:
         logging.debug("send_json failed: %s", e)
 
 
+class ClientSession:
+    """
+    Состояние протокола одного подключения (ник, разбор action).
+    Не знает о транспорте: используется и потоковым, и asyncio сервером.
+    Хранит текущий кодек протокола; смена кодека, запрошенная в login,
+    вступает в силу сразу после отправки ответа на login.
+    Если после login каталог сменил версию (правка из консоли, CatalogWatcher),
+    в ближайший ответ добавляется catalog_update — токен новой версии.
+
+    send_push(data) -> bool — неблокирующая постановка кадра в очередь отправки
+    подключения; без неё подписка на push-уведомления недоступна.
+    disconnect() — закрыть подключение из другого потока (kick из SessionRegistry).
+    """
+
+    def __init__(self, service: GameService, send_push=None, disconnect=None):
+        self.service = service
+        self._send_push = send_push
+        self._disconnect = disconnect
+        self.last_active = time.monotonic()  # для закрытия простаивающих сессий
+        self._resumable = True  # обрыв соединения (не logout): сессию можно возобновить
+        self._sink = self._push_frame  # один объект: ключ подписки в PushHub
+        self.nickname = None
+        self.closed = False
+        self.codec = JSON_CODEC
+        self._next_codec = None
+        self._catalog_seen = None  # версия каталога, о которой клиент уже знает
+        self.actions = {
+            "login": self._login,
+            "resume": self._resume,
+            "logout": self._logout,
+            "whoami": self._whoami,
+            "buy": self._buy,
+            "sell": self._sell,
+            "batch": self._batch,
+            "list_items": self._list_items,
+            "subscribe": self._subscribe,
+            "unsubscribe": self._unsubscribe,
+            "ping": self._ping,
+        }
+
+    def decode(self, frame: bytes):
+        return self.codec.decode(frame)
+
+    def encode(self, resp: dict) -> bytes:
+        """Кодирует ответ текущим кодеком и применяет отложенную смену кодека."""
+        data = self.codec.encode(resp)
+        if self._next_codec is not None:
+            self.codec, self._next_codec = self._next_codec, None
+        return data
+
+    def handle(self, msg) -> dict:
+        """
+        Обрабатывает одно сообщение клиента и возвращает ответ.
+        Поле "id" запроса копируется в ответ, чтобы клиент мог
+        отправлять запросы конвейером и сопоставлять ответы.
+        """
+        self.last_active = time.monotonic()
+        if not isinstance(msg, dict):
+            return {"status": "error", "error": "unknown_action"}
+        resp = self._dispatch(msg, self.actions)
+        if "id" in msg:
+            resp["id"] = msg["id"]
+        if self._catalog_seen is not None and self.nickname:
+            snap = self.service.items.snapshot()
+            if snap.version != self._catalog_seen:
+                self._catalog_seen = snap.version
+                resp["catalog_update"] = self.service.items.version_token(snap)
+        return resp
+
+    @staticmethod
+    def _dispatch(msg, actions) -> dict:
+        handler = actions.get(msg.get("action"))
+        if handler is None:
+            return {"status": "error", "error": "unknown_action"}
+        return handler(msg)
+
+    def _login(self, msg):
+        nickname = msg.get("nickname")
+        if not nickname:
+            return {"status": "error", "error": "no_nickname"}
+        claim = self.service.sessions.claim(nickname, self)
+        if "error" in claim:
+            return {"status": "error", "error": claim["error"]}
+        try:
+            result = self.service.login(nickname)
+        except Exception:
+            self._unclaim(nickname)
+            raise
+        self._leave(next_nickname=nickname)
+        self.nickname = nickname
+        logging.info("User logged in: %s bonus=%s", nickname, result["login_bonus"])
+        resp = {"status": "ok", "action": "login_result",
+                "account": result["account"],
+                "login_bonus": result["login_bonus"],
+                "resume_token": claim["token"]}
+        resp.update(self._catalog_sync(result["catalog"], msg.get("catalog_version"), msg.get("catalog_hash")))
+        self._negotiate_encoding(msg, resp)
+        return resp
+
+    def _resume(self, msg):
+        """
+        Продолжение сессии после переподключения по resume_token (из login_result
+        или прошлого resume_result): без бонуса и записи в DB. Подписки на push
+        не переносятся. Поля каталога и encoding — как в login.
+        """
+        res = self.service.sessions.resume(msg.get("resume_token"), self)
+        if "error" in res:
+            return {"status": "error", "error": res["error"]}
+        nickname = res["nickname"]
+        try:
+            result = self.service.resume(nickname)
+        except Exception:
+            self._unclaim(nickname)
+            raise
+        if result["account"] is None:
+            self._unclaim(nickname)
+            return {"status": "error", "error": "bad_resume_token"}
+        self._leave(next_nickname=nickname)
+        self.nickname = nickname
+        logging.info("Session resumed: %s", nickname)
+        resp = {"status": "ok", "action": "resume_result",
+                "account": result["account"],
+                "resume_token": res["token"]}
+        resp.update(self._catalog_sync(result["catalog"], msg.get("catalog_version"), msg.get("catalog_hash")))
+        self._negotiate_encoding(msg, resp)
+        return resp
+
+    def _unclaim(self, nickname):
+        # вход не состоялся: запись в таблице сессий не должна держать ник
+        if nickname != self.nickname:
+            self.service.sessions.release(nickname, self, resumable=False)
+
+    def _negotiate_encoding(self, msg, resp):
+        encoding = msg.get("encoding")
+        if encoding is not None:
+            codec = CODECS.get(encoding, self.codec)
+            if codec is not self.codec:
+                self._next_codec = codec
+            resp["encoding"] = codec.name
+
+    def _catalog_sync(self, snap, client_version, client_hash) -> dict:
+        """
+        Поля каталога для login_result с учётом кэша клиента:
+        not_modified — кэш актуален, delta — изменения с версии клиента,
+        full — весь каталог в items_master (как раньше для старых клиентов).
+        """
+        items = self.service.items
+        sync = {"catalog_version": items.version_token(snap), "catalog_hash": snap.content_hash()}
+        self._catalog_seen = snap.version
+        if client_hash and client_hash == sync["catalog_hash"]:
+            sync["catalog_status"] = "not_modified"
+            return sync
+        base = items.parse_version_token(client_version)
+        delta = snap.delta_payload(base, self.codec) if base is not None else None
+        if delta is not None:
+            sync["catalog_status"] = "delta"
+            sync["catalog_delta"] = Raw(delta)
+        else:
+            sync["catalog_status"] = "full"
+            sync["items_master"] = Raw(snap.payload(self.codec))
+        return sync
+
+    def _logout(self, msg):
+        self._resumable = False
+        self.close()
+        return {"status": "ok", "action": "logout"}
+
+    def _leave(self, next_nickname=None, resumable=False):
+        """Освобождает текущий ник: подписки, запись в таблице сессий (если ник меняется), кэш аккаунта."""
+        if not self.nickname:
+            return
+        self.service.push.unsubscribe(self.nickname, self._sink)
+        if self.nickname != next_nickname:
+            self.service.sessions.release(self.nickname, self, resumable)
+        self.service.logout(self.nickname)
+
+    def close(self):
+        """Завершение сессии (logout или обрыв соединения)."""
+        self._leave(resumable=self._resumable)
+        self.nickname = None
+        self.closed = True
+
+    def kick(self, reason: str):
+        """
+        Закрытие сессии сервером (SessionRegistry): вход этим ником с другого
+        подключения или простой. Клиент получает push session_closed.
+        """
+        # сначала уведомление: увидев closed, поток подключения закроет очередь отправки
+        if self._send_push is not None:
+            self._push_frame(push_message(SESSION_CLOSED, reason=reason))
+        self.closed = True
+        if self._disconnect is not None:
+            self._disconnect()
+
+    def _whoami(self, msg):
+        if not self.nickname:
+            return {"status": "error", "error": "not_logged_in"}
+        acc = self.service.whoami(self.nickname)
+        return {"status": "ok", "account": acc}
+
+    def _quantity(self, msg):
+        """Количество штук в buy/sell (по умолчанию 1) или None, если оно некорректно."""
+        quantity = msg.get("quantity", 1)
+        if not isinstance(quantity, int) or isinstance(quantity, bool) \
+                or not 0 < quantity <= int(self.service.cfg.get("max_trade_quantity", 1000)):
+            return None
+        return quantity
+
+    @staticmethod
+    def _item_id(msg):
+        """id предмета в buy/sell (число или строка из цифр) или None, если оно некорректно."""
+        item_id = msg.get("item_id")
+        if isinstance(item_id, str) and item_id.isdecimal():
+            return int(item_id)
+        if not isinstance(item_id, int) or isinstance(item_id, bool):
+            return None
+        return item_id
+
+    def _buy(self, msg):
+        if msg.get("item_id") is None:
+            return {"status": "error", "error": "no_item_id"}
+        item_id = self._item_id(msg)
+        if item_id is None:
+            return {"status": "error", "error": "bad_item_id"}
+        quantity = self._quantity(msg)
+        if quantity is None:
+            return {"status": "error", "error": "bad_quantity"}
+        res = self.service.buy(self.nickname, item_id, quantity)
+        if "error" in res:
+            return {"status": "error", "error": res["error"]}
+        return {"status": "ok", "action": "buy_result", "account": res["account"], "bought": res["bought"],
+                "quantity": quantity}
+
+    def _sell(self, msg):
+        if msg.get("item_id") is None:
+            return {"status": "error", "error": "no_item_id"}
+        item_id = self._item_id(msg)
+        if item_id is None:
+            return {"status": "error", "error": "bad_item_id"}
+        quantity = self._quantity(msg)
+        if quantity is None:
+            return {"status": "error", "error": "bad_quantity"}
+        res = self.service.sell(self.nickname, item_id, quantity)
+        if "error" in res:
+            return {"status": "error", "error": res["error"]}
+        return {"status": "ok", "action": "sell_result", "account": res["account"],
+                "sold": res["sold"], "received": res["received"], "quantity": quantity}
+
+    def _list_items(self, msg):
+        """
+        Страница каталога с фильтрами (min_price, max_price, name_prefix),
+        сортировкой (sort: id/price/name, order: asc/desc) и курсором next_cursor.
+        """
+        sort = msg.get("sort", "id")
+        order = msg.get("order", "asc")
+        if sort not in SORT_KEYS or order not in ("asc", "desc"):
+            return {"status": "error", "error": "bad_sort"}
+        min_price, max_price, prefix = msg.get("min_price"), msg.get("max_price"), msg.get("name_prefix")
+        limit = msg.get("limit", 50)
+        max_limit = int(self.service.cfg.get("list_items_max_limit", 500))
+        if any(v is not None and (not isinstance(v, int) or isinstance(v, bool)) for v in (min_price, max_price)) \
+                or (prefix is not None and not isinstance(prefix, str)) \
+                or not isinstance(limit, int) or not 0 < limit <= max_limit:
+            return {"status": "error", "error": "bad_filter"}
+        after = None
+        if msg.get("cursor") is not None:
+            try:
+                after = decode_cursor(msg["cursor"], sort, order)
+            except ValueError:
+                return {"status": "error", "error": "bad_cursor"}
+        snap = self.service.items.snapshot()
+        items, last = snap.query(sort, order == "desc", min_price, max_price, prefix, after, limit)
+        return {"status": "ok", "action": "list_items_result", "items": items,
+                "next_cursor": encode_cursor(sort, order, last) if last is not None else None,
+                "catalog_version": self.service.items.version_token(snap)}
+
+    def _push_frame(self, msg) -> bool:
+        return self._send_push(self.codec.encode(msg))
+
+    def _subscribe(self, msg):
+        """
+        Подписка подключения на push-уведомления (events — список, по умолчанию все).
+        Действует до logout/повторного login; повторный subscribe заменяет список.
+        """
+        if not self.nickname:
+            return {"status": "error", "error": "not_logged_in"}
+        if self._send_push is None:
+            return {"status": "error", "error": "push_unsupported"}
+        events = msg.get("events", sorted(PUSH_EVENTS))
+        if not isinstance(events, list) or not all(isinstance(e, str) and e in PUSH_EVENTS for e in events):
+            return {"status": "error", "error": "bad_events"}
+        self.service.push.subscribe(self.nickname, self._sink, events)
+        return {"status": "ok", "action": "subscribe_result", "events": sorted(set(events))}
+
+    @staticmethod
+    def _ping(msg):
+        """
+        Keepalive: продлевает сессию (session_idle_timeout) без обращения к DB.
+        Клиенты, которые только слушают push, отправляют его периодически.
+        """
+        return {"status": "ok", "action": "pong"}
+
+    def _unsubscribe(self, msg):
+        if self.nickname:
+            self.service.push.unsubscribe(self.nickname, self._sink)
+        return {"status": "ok", "action": "unsubscribe_result"}
+
+    def _batch(self, msg):
+        """
+        Несколько запросов (whoami/buy/sell) по порядку в одной транзакции БД
+        с одним общим ответом. Отклонённый подзапрос откатывается отдельно;
+        при "atomic": true первая ошибка откатывает весь batch.
+        """
+        if not self.nickname:
+            return {"status": "error", "error": "not_logged_in"}
+        requests = msg.get("requests")
+        if not isinstance(requests, list) or not requests:
+            return {"status": "error", "error": "no_requests"}
+        if len(requests) > int(self.service.cfg.get("max_batch_size", 100)):
+            return {"status": "error", "error": "batch_too_large"}
+        actions = {"whoami": self._whoami, "buy": self._buy, "sell": self._sell}
+        atomic = bool(msg.get("atomic"))
+        results = []
+        try:
+            with self.service.transaction():
+                for sub in requests:
+                    res = self._dispatch(sub, actions) if isinstance(sub, dict) else \
+                        {"status": "error", "error": "unknown_action"}
+                    if isinstance(sub, dict) and "id" in sub:
+                        res["id"] = sub["id"]
+                    results.append(res)
+                    if atomic and res["status"] != "ok":
+                        raise _BatchAborted()
+        except _BatchAborted:
+            return {"status": "error", "error": "batch_aborted", "action": "batch_result", "results": results}
+        return {"status": "ok", "action": "batch_result", "results": results}
+
+
+class _BatchAborted(Exception):
+    pass
+
+
 class ClientHandler(threading.Thread):
-    def __init__(self, conn: socket.socket, addr, service: GameService):
+    """
+    Поток чтения одного подключения. Запросы выполняются в общем BoundedExecutor
+    (если он передан), ответы и push-уведомления уходят через OutboundQueue
+    с отдельным потоком записи.
+    """
+
+    def __init__(self, conn: socket.socket, addr, service: GameService,
+                 executor: BoundedExecutor = None, limiter: ConnectionLimiter = None):
         super().__init__(daemon=True)
         self.conn = conn
         self.addr = addr
         self.service = service
-        self.nickname = None
-        self.conn_file = conn.makefile("r", encoding="utf-8")
+        self.executor = executor
+        self.limiter = limiter
+        self.outbound = OutboundQueue(conn, int(service.cfg.get("send_queue_high_water", 1 << 20)))
+        # push не ждёт места в очереди: медленному клиенту уведомление не достаётся
+        self.session = ClientSession(service, send_push=lambda data: self.outbound.put(data, block=False),
+                                     disconnect=self._shutdown_read)
+        self.conn_file = conn.makefile("rb")
+        self.send_timeout = float(service.cfg.get("send_timeout", 10))
 
-    def recv_json_line(self):
+    @property
+    def nickname(self):
+        return self.session.nickname
+
+    def _shutdown_read(self):
+        # поток чтения получает EOF и завершает подключение; очередь ответов дописывается
         try:
-            line = self.conn_file.readline()
-            if not line:
-                return None
-            try:
-                return json.loads(line.strip())
-            except Exception:
-                return None
-        except Exception:
+            self.conn.shutdown(socket.SHUT_RD)
+        except OSError:
+            pass
+
+    def recv_frame(self):
+        """Следующий кадр в текущем кодеке сессии или None (EOF/ошибка кадра)."""
+        try:
+            return self.session.codec.read_from(self.conn_file)
+        except (FrameError, OSError):
             return None
 
+    def process(self, msg):
+        """(ответ, время обработки, время в DB) — в общем пуле, если он задан."""
+        if self.executor is None:
+            return call_with_db_time(self.session.handle, msg)
+        fut = self.executor.try_submit(call_with_db_time, self.session.handle, msg)
+        if fut is None:
+            return busy_response(msg), 0.0, 0.0
+        return fut.result()
+
+    def send(self, data: bytes) -> bool:
+        """В очередь на отправку; при переполнении ждёт клиента не дольше send_timeout."""
+        return self.outbound.put(data, timeout=self.send_timeout)
+
     def run(self):
         logging.info("Client connected: %s", self.addr)
+        CONNECTIONS.inc()
+        self.outbound.start()
         try:
-            while True:
-                msg = self.recv_json_line()
-                if msg is None:
+            while not self.session.closed:
+                frame = self.recv_frame()
+                if frame is None:
+                    break
+                start = time.perf_counter()
+                try:
+                    msg = self.session.decode(frame)
+                except Exception:
                     break
-                action = msg.get("action")
-                if action == "login":
-                    nickname = msg.get("nickname")
-                    if not nickname:
-                        send_json(self.conn, {"status": "error", "error": "no_nickname"})
-                        continue
-                    result = self.service.login(nickname)
-                    self.nickname = nickname
-                    send_json(self.conn, {"status": "ok", "action": "login_result",
-                                          "account": result["account"],
-                                          "items_master": result["items_master"],
-                                          "login_bonus": result["login_bonus"]})
-                    logging.info("User logged in: %s bonus=%s", nickname, result["login_bonus"])
-                elif action == "logout":
-                    send_json(self.conn, {"status": "ok", "action": "logout"})
-                    self.nickname = None
+                parse = time.perf_counter() - start
+                resp, service, db = self.process(msg)
+                start = time.perf_counter()
+                sent = self.send(self.session.encode(resp))
+                record_request(action_label(msg, self.session.actions), resp,
+                               parse, service, db, time.perf_counter() - start)
+                if not sent:
+                    logging.warning("Client %s is too slow to read responses, disconnecting", self.addr)
                     break
-                elif action == "whoami":
-                    if not self.nickname:
-                        send_json(self.conn, {"status": "error", "error": "not_logged_in"})
-                        continue
-                    acc = self.service.whoami(self.nickname)
-                    send_json(self.conn, {"status": "ok", "account": acc})
-                elif action == "buy":
-                    item_id = msg.get("item_id")
-                    if item_id is None:
-                        send_json(self.conn, {"status": "error", "error": "no_item_id"})
-                        continue
-                    res = self.service.buy(self.nickname, int(item_id))
-                    if "error" in res:
-                        send_json(self.conn, {"status": "error", "error": res["error"]})
-                    else:
-                        send_json(self.conn, {"status": "ok", "action": "buy_result", "account": res["account"],
-                                              "bought": res["bought"]})
-                elif action == "sell":
-                    item_id = msg.get("item_id")
-                    if item_id is None:
-                        send_json(self.conn, {"status": "error", "error": "no_item_id"})
-                        continue
-                    res = self.service.sell(self.nickname, int(item_id))
-                    if "error" in res:
-                        send_json(self.conn, {"status": "error", "error": res["error"]})
-                    else:
-                        send_json(self.conn, {"status": "ok", "action": "sell_result", "account": res["account"],
-                                              "sold": res["sold"], "received": res["received"]})
-                else:
-                    send_json(self.conn, {"status": "error", "error": "unknown_action"})
         except Exception:
             logging.exception("Exception handling client %s", self.addr)
         finally:
+            self.session.close()
+            self.outbound.close(self.send_timeout)
             try:
                 self.conn_file.close()
             except Exception:
@@ -100,4 +449,7 @@ class ClientHandler(threading.Thread):
                 self.conn.close()
             except Exception:
                 pass
-            logging.info("Connection closed: %s", self.addr)
\ No newline at end of file
+            if self.limiter:
+                self.limiter.release()
+            CONNECTIONS.dec()
+            logging.info("Connection closed: %s", self.addr)
@@ -1,82 +1,427 @@
+import queue
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+from srv.srv_metrics import add_db_time
+from srv.srv_migrations import migrate
+
+# строк в одной транзакции массовой операции: между порциями успевают пройти сделки игроков
+BULK_CHUNK_SIZE = 5000
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class _TradeRejected(Exception):
+    def __init__(self, code):
+        super().__init__(code)
+        self.code = code
+
+
+def make_account(nickname, credits, inventory: dict) -> dict:
+    """
+    Аккаунт для протокола: items — отсортированные id предметов (как раньше),
+    quantities — {"id": количество} только для стопок больше одного предмета.
+    """
+    acc = {"nickname": nickname, "credits": credits, "items": sorted(inventory)}
+    stacks = {str(item_id): qty for item_id, qty in inventory.items() if qty > 1}
+    if stacks:
+        acc["quantities"] = stacks
+    return acc
 
 
 class DB:
-    """Небольшой wrapper для sqlite операций (каждый вызов — новое соединение)."""
+    """
+    Небольшой wrapper для sqlite операций.
+    Соединения постоянные и берутся из ограниченного пула: WAL-журнал,
+    synchronous=NORMAL и кэш подготовленных выражений sqlite3 переживают запросы.
+    """
 
-    def __init__(self, db_file):
+    def __init__(self, db_file, pool_size=8):
         self.db_file = db_file
-        self._ensure_schema()
-
-    def _conn(self):
-        return sqlite3.connect(self.db_file, check_same_thread=False)
-
-    def _ensure_schema(self):
-        conn = self._conn()
-        cur = conn.cursor()
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS accounts (
-                nickname TEXT PRIMARY KEY,
-                credits INTEGER NOT NULL
-            );
-        """)
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS account_items (
-                nickname TEXT,
-                item_id INTEGER,
-                PRIMARY KEY (nickname, item_id),
-                FOREIGN KEY (nickname) REFERENCES accounts(nickname)
-            );
-        """)
-        conn.commit()
-        conn.close()
+        # in-memory база существует только внутри одного соединения
+        self.pool_size = 1 if db_file == ":memory:" else max(1, int(pool_size))
+        self._pool = queue.LifoQueue()
+        self._pool_lock = threading.Lock()
+        self._created = 0
+        self._in_use = 0
+        self._waits = 0  # сколько раз пришлось ждать свободное соединение
+        self._local = threading.local()  # транзакция, открытая текущим потоком
+        # контекст вокруг каждой порции массовой операции, yield -> set затронутых ников
+        # (AccountCache подставляет свой, чтобы сбросить и перечитать записи кэша)
+        self.bulk_guard = None
+        # listener(затронутые ники) после каждой записанной порции массовой операции
+        self.bulk_listeners = []
+        self.schema_version = migrate(self)
 
-    def get_account(self, nickname):
-        conn = self._conn()
-        cur = conn.cursor()
-        cur.execute("SELECT credits FROM accounts WHERE nickname = ?", (nickname,))
-        row = cur.fetchone()
-        if not row:
+    def _connect(self):
+        conn = sqlite3.connect(self.db_file, check_same_thread=False, isolation_level=None,
+                               timeout=5.0, cached_statements=256)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA cache_size=-16000")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+
+    def _acquire(self):
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            pass
+        with self._pool_lock:
+            create = self._created < self.pool_size
+            if create:
+                self._created += 1
+        if create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._pool_lock:
+                    self._created -= 1
+                raise
+        with self._pool_lock:
+            self._waits += 1
+        return self._pool.get()
+
+    def _release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        self._pool.put(conn)
+
+    @contextmanager
+    def _connection(self):
+        """
+        Соединение из пула в режиме autocommit (одно выражение — одна транзакция).
+        Внутри transaction() этого же потока возвращается её соединение.
+        """
+        active = getattr(self._local, "conn", None)
+        if active is not None:
+            yield active
+            return
+        start = time.perf_counter()
+        conn = self._acquire()
+        self._in_use += 1
+        try:
+            yield conn
+        finally:
+            self._in_use -= 1
+            self._release(conn)
+            add_db_time(time.perf_counter() - start)
+
+    def stats(self) -> dict:
+        """Состояние пула соединений для метрик."""
+        return {
+            "tzl_db_pool_size": self.pool_size,
+            "tzl_db_connections_open": self._created,
+            "tzl_db_connections_in_use": self._in_use,
+            "tzl_db_pool_waits_total": self._waits,
+        }
+
+    @contextmanager
+    def transaction(self, immediate=False):
+        """
+        Несколько выражений в одной транзакции на одном соединении.
+        Все вызовы DB из этого потока внутри блока идут в ту же транзакцию;
+        вложенный transaction() становится SAVEPOINT и откатывается отдельно.
+        """
+        active = getattr(self._local, "conn", None)
+        if active is not None:
+            self._local.depth += 1
+            name = f"sp{self._local.depth}"
+            active.execute(f"SAVEPOINT {name}")
+            try:
+                yield active
+            except BaseException:
+                active.execute(f"ROLLBACK TO {name}")
+                active.execute(f"RELEASE {name}")
+                raise
+            else:
+                active.execute(f"RELEASE {name}")
+            finally:
+                self._local.depth -= 1
+            return
+        with self._connection() as conn:
+            conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+            self._local.conn = conn
+            self._local.depth = 0
+            try:
+                yield conn
+                conn.execute("COMMIT")
+            except BaseException:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
+            finally:
+                self._local.conn = None
+
+    def close(self):
+        """Закрывает простаивающие соединения пула."""
+        while True:
+            try:
+                conn = self._pool.get_nowait()
+            except queue.Empty:
+                break
             conn.close()
+            with self._pool_lock:
+                self._created -= 1
+
+    def get_meta(self, key, default=None):
+        with self._connection() as conn:
+            row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        with self._connection() as conn:
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    @staticmethod
+    def _read_account(conn, nickname):
+        row = conn.execute("SELECT credits FROM accounts WHERE nickname = ?", (nickname,)).fetchone()
+        if not row:
             return None
-        credits = row[0]
-        cur.execute("SELECT item_id FROM account_items WHERE nickname = ?", (nickname,))
-        items = [r[0] for r in cur.fetchall()]
-        conn.close()
-        return {"nickname": nickname, "credits": credits, "items": items}
+        return make_account(nickname, row[0], DB._read_inventory(conn, nickname))
+
+    @staticmethod
+    def _read_inventory(conn, nickname) -> dict:
+        return dict(conn.execute("SELECT item_id, quantity FROM account_items WHERE nickname = ?", (nickname,)))
+
+    def get_account(self, nickname):
+        with self.transaction() as conn:
+            return self._read_account(conn, nickname)
+
+    def login_account(self, nickname, bonus, period_start, now, read_account=True):
+        """
+        Вход игрока одним выражением: создаёт аккаунт, если его нет, и начисляет
+        бонус, если прошлый бонус был раньше period_start (или его не было).
+        UPSERT с условием в WHERE ничего не меняет и не возвращает строку,
+        если бонус уже получен, — повторные входы не начисляют кредиты.
+        Возвращает (аккаунт или None при read_account=False, начисленный бонус).
+        """
+        with self.transaction(immediate=True) as conn:
+            row = conn.execute("""
+                INSERT INTO accounts (nickname, credits, last_bonus_at) VALUES (?1, ?2, ?3)
+                ON CONFLICT (nickname) DO UPDATE SET credits = credits + ?2, last_bonus_at = ?3
+                WHERE last_bonus_at IS NULL OR last_bonus_at < ?4
+                RETURNING credits
+            """, (nickname, bonus, now, period_start)).fetchone()
+            granted = bonus if row is not None else 0
+            if not read_account:
+                return None, granted
+            if row is None:
+                return self._read_account(conn, nickname), granted
+            return make_account(nickname, row[0], self._read_inventory(conn, nickname)), granted
 
     def create_account_if_missing(self, nickname, credits=0):
-        conn = self._conn()
-        cur = conn.cursor()
-        cur.execute("INSERT OR IGNORE INTO accounts (nickname, credits) VALUES (?, ?)", (nickname, credits))
-        conn.commit()
-        conn.close()
+        with self._connection() as conn:
+            conn.execute("INSERT OR IGNORE INTO accounts (nickname, credits) VALUES (?, ?)", (nickname, credits))
 
     def set_credits(self, nickname, credits):
-        conn = self._conn()
-        cur = conn.cursor()
-        cur.execute("UPDATE accounts SET credits = ? WHERE nickname = ?", (credits, nickname))
-        conn.commit()
-        conn.close()
+        with self._connection() as conn:
+            conn.execute("UPDATE accounts SET credits = ? WHERE nickname = ?", (credits, nickname))
 
     def add_credits(self, nickname, amount):
-        conn = self._conn()
-        cur = conn.cursor()
-        cur.execute("UPDATE accounts SET credits = credits + ? WHERE nickname = ?", (amount, nickname))
-        conn.commit()
-        conn.close()
-
-    def add_item(self, nickname, item_id):
-        conn = self._conn()
-        cur = conn.cursor()
-        cur.execute("INSERT OR IGNORE INTO account_items (nickname, item_id) VALUES (?, ?)", (nickname, item_id))
-        conn.commit()
-        conn.close()
+        with self._connection() as conn:
+            conn.execute("UPDATE accounts SET credits = credits + ? WHERE nickname = ?", (amount, nickname))
+
+    def add_item(self, nickname, item_id, quantity=1):
+        """Выдаёт предмет; уже имеющийся в стопке не дублируется (количество не меняется)."""
+        with self._connection() as conn:
+            conn.execute("INSERT OR IGNORE INTO account_items (nickname, item_id, quantity) VALUES (?, ?, ?)",
+                         (nickname, item_id, quantity))
 
     def remove_item(self, nickname, item_id):
-        conn = self._conn()
-        cur = conn.cursor()
-        cur.execute("DELETE FROM account_items WHERE nickname = ? AND item_id = ?", (nickname, item_id))
-        conn.commit()
-        conn.close()
+        with self._connection() as conn:
+            conn.execute("DELETE FROM account_items WHERE nickname = ? AND item_id = ?", (nickname, item_id))
+
+    def execute_trade(self, nickname, item_id, credits_delta, acquire, quantity=1, max_stack=1):
+        """
+        Атомарная сделка в одной транзакции BEGIN IMMEDIATE: изменение стопки
+        предмета (не больше max_stack штук), условное списание
+        (UPDATE ... WHERE credits >= ?) и чтение аккаунта.
+        acquire=True — покупка quantity штук, False — продажа.
+        Возвращает {"account": ...} с обновлённым аккаунтом или {"error": code}.
+        """
+        try:
+            with self.transaction(immediate=True) as conn:
+                if acquire:
+                    self._add_to_stack(conn, nickname, item_id, quantity, max_stack)
+                else:
+                    self._take_from_stack(conn, nickname, item_id, quantity)
+                if credits_delta < 0:
+                    cur = conn.execute("UPDATE accounts SET credits = credits + ? WHERE nickname = ? AND credits >= ?",
+                                       (credits_delta, nickname, -credits_delta))
+                    if cur.rowcount == 0:
+                        raise _TradeRejected("not_enough_credits")
+                elif credits_delta > 0:
+                    conn.execute("UPDATE accounts SET credits = credits + ? WHERE nickname = ?",
+                                 (credits_delta, nickname))
+                acc = self._read_account(conn, nickname)
+        except _TradeRejected as e:
+            return {"error": e.code}
+        return {"account": acc}
+
+    @staticmethod
+    def _add_to_stack(conn, nickname, item_id, quantity, max_stack):
+        # больше max_stack штук за раз нельзя независимо от того, что уже есть
+        if quantity > max_stack:
+            raise _TradeRejected("stack_limit")
+        cur = conn.execute("""
+            INSERT INTO account_items (nickname, item_id, quantity) VALUES (?1, ?2, ?3)
+            ON CONFLICT (nickname, item_id) DO UPDATE SET quantity = quantity + ?3
+            WHERE quantity + ?3 <= ?4
+        """, (nickname, item_id, quantity, max_stack))
+        if not cur.rowcount:
+            raise _TradeRejected("already_owned" if max_stack == 1 else "stack_limit")
+
+    @staticmethod
+    def _take_from_stack(conn, nickname, item_id, quantity):
+        # стопка из quantity штук удаляется целиком, большая — уменьшается
+        cur = conn.execute("DELETE FROM account_items WHERE nickname = ? AND item_id = ? AND quantity = ?",
+                           (nickname, item_id, quantity))
+        if cur.rowcount:
+            return
+        cur = conn.execute("UPDATE account_items SET quantity = quantity - ? "
+                           "WHERE nickname = ? AND item_id = ? AND quantity > ?",
+                           (quantity, nickname, item_id, quantity))
+        if cur.rowcount:
+            return
+        owned = conn.execute("SELECT 1 FROM account_items WHERE nickname = ? AND item_id = ?",
+                             (nickname, item_id)).fetchone()
+        raise _TradeRejected("not_enough_items" if owned else "not_owned")
+
+    def apply_account_ops(self, ops, seq_key="account_journal_seq"):
+        """
+        Применяет пачку отложенных операций с аккаунтами одной транзакцией.
+        ops — [(seq, nickname, credits_delta, item_id, quantity_delta)], item_id может быть None.
+        Изменения кредитов и количеств суммируются по нику и паре (ник, предмет);
+        номер последней операции сохраняется в meta[seq_key] в той же транзакции,
+        поэтому повторное применение журнала безопасно.
+        """
+        if not ops:
+            return
+        credits = {}
+        items = {}
+        for _, nickname, delta, item_id, qty_delta in ops:
+            if delta:
+                credits[nickname] = credits.get(nickname, 0) + delta
+            if item_id is not None:
+                items[(nickname, item_id)] = items.get((nickname, item_id), 0) + qty_delta
+        added = [(n, i, q) for (n, i), q in items.items() if q > 0]
+        taken = [(-q, n, i) for (n, i), q in items.items() if q < 0]
+        with self.transaction(immediate=True) as conn:
+            conn.executemany("UPDATE accounts SET credits = credits + ? WHERE nickname = ?",
+                             [(delta, nickname) for nickname, delta in credits.items() if delta])
+            conn.executemany("INSERT INTO account_items (nickname, item_id, quantity) VALUES (?1, ?2, ?3) "
+                             "ON CONFLICT (nickname, item_id) DO UPDATE SET quantity = quantity + ?3", added)
+            conn.executemany("DELETE FROM account_items WHERE quantity <= ?1 AND nickname = ?2 AND item_id = ?3",
+                             taken)
+            conn.executemany("UPDATE account_items SET quantity = quantity - ?1 WHERE nickname = ?2 AND item_id = ?3",
+                             taken)
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (seq_key, ops[-1][0]))
+
+    @contextmanager
+    def _bulk_chunk(self):
+        """Порция массовой операции: отдельная транзакция под bulk_guard -> (conn, затронутые ники)."""
+        guard = self.bulk_guard() if self.bulk_guard is not None else nullcontext(set())
+        with guard as touched:
+            with self.transaction(immediate=True) as conn:
+                yield conn, touched
+        for listener in self.bulk_listeners:
+            listener(touched)
+
+    def grant_credits(self, rows, chunk_size=BULK_CHUNK_SIZE) -> int:
+        """
+        Массовое начисление: rows — итератор (nickname, amount); отрицательная сумма
+        списывает, но не ниже нуля. Возвращает число изменённых аккаунтов.
+        """
+        total = 0
+        for chunk in _chunks(rows, chunk_size):
+            with self._bulk_chunk() as (conn, touched):
+                total += conn.executemany("UPDATE accounts SET credits = MAX(credits + ?, 0) WHERE nickname = ?",
+                                          [(amount, nickname) for nickname, amount in chunk]).rowcount
+                touched.update(nickname for nickname, _ in chunk)
+        return total
+
+    def grant_credits_all(self, amount, chunk_size=BULK_CHUNK_SIZE) -> int:
+        """Начисление всем аккаунтам порциями по rowid: блокировка записи не держится на всю таблицу."""
+        total = 0
+        last = 0
+        while True:
+            with self._bulk_chunk() as (conn, touched):
+                rows = conn.execute("""
+                    UPDATE accounts SET credits = MAX(credits + ?, 0)
+                    WHERE rowid IN (SELECT rowid FROM accounts WHERE rowid > ? ORDER BY rowid LIMIT ?)
+                    RETURNING rowid, nickname
+                """, (amount, last, chunk_size)).fetchall()
+                touched.update(nickname for _, nickname in rows)
+            total += len(rows)
+            if len(rows) < chunk_size:
+                return total
+            last = max(rowid for rowid, _ in rows)
+
+    def grant_items(self, rows, chunk_size=BULK_CHUNK_SIZE) -> int:
+        """
+        Массовая выдача предметов: rows — (nickname, item_id, quantity), количество
+        добавляется к стопке (без ограничения max_stack). Несуществующие аккаунты пропускаются.
+        """
+        total = 0
+        for chunk in _chunks(rows, chunk_size):
+            with self._bulk_chunk() as (conn, touched):
+                total += conn.executemany("""
+                    INSERT INTO account_items (nickname, item_id, quantity)
+                    SELECT ?1, ?2, ?3 WHERE EXISTS (SELECT 1 FROM accounts WHERE nickname = ?1)
+                    ON CONFLICT (nickname, item_id) DO UPDATE SET quantity = quantity + ?3
+                """, chunk).rowcount
+                touched.update(row[0] for row in chunk)
+        return total
+
+    def revoke_items(self, rows, chunk_size=BULK_CHUNK_SIZE) -> int:
+        """
+        Массовое изъятие: rows — (nickname, item_id, quantity); quantity None — вся стопка.
+        Возвращает число изменённых или удалённых стопок.
+        """
+        total = 0
+        for chunk in _chunks(rows, chunk_size):
+            whole = [(n, i) for n, i, q in chunk if q is None]
+            part = [(q, n, i) for n, i, q in chunk if q is not None]
+            with self._bulk_chunk() as (conn, touched):
+                total += conn.executemany("DELETE FROM account_items WHERE nickname = ? AND item_id = ?",
+                                          whole).rowcount
+                total += conn.executemany("DELETE FROM account_items WHERE quantity <= ?1 AND nickname = ?2 "
+                                          "AND item_id = ?3", part).rowcount
+                total += conn.executemany("UPDATE account_items SET quantity = quantity - ?1 "
+                                          "WHERE nickname = ?2 AND item_id = ?3 AND quantity > ?1", part).rowcount
+                touched.update(row[0] for row in chunk)
+        return total
 
+    def purge_item(self, item_id, refund=0, chunk_size=BULK_CHUNK_SIZE) -> int:
+        """
+        Удаляет предмет из всех инвентарей (предмет убран из каталога), порциями
+        по индексу account_items.item_id; refund — кредиты за каждую изъятую штуку.
+        Возвращает число удалённых стопок.
+        """
+        total = 0
+        while True:
+            with self._bulk_chunk() as (conn, touched):
+                rows = conn.execute("""
+                    DELETE FROM account_items
+                    WHERE rowid IN (SELECT rowid FROM account_items WHERE item_id = ? LIMIT ?)
+                    RETURNING nickname, quantity
+                """, (item_id, chunk_size)).fetchall()
+                if refund:
+                    conn.executemany("UPDATE accounts SET credits = credits + ? WHERE nickname = ?",
+                                     [(refund * quantity, nickname) for nickname, quantity in rows])
+                touched.update(nickname for nickname, _ in rows)
+            total += len(rows)
+            if len(rows) < chunk_size:
+                return total
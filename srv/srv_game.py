@@ -1,7 +1,11 @@
 import random
+import time
 
+from srv.srv_account_cache import AccountCache
 from srv.srv_db import DB
 from srv.srv_items_repository import ItemRepository
+from srv.srv_push import CATALOG_CHANGED, CREDITS_CHANGED, PushHub
+from srv.srv_sessions import SessionRegistry
 
 
 class GameService:
@@ -9,51 +13,105 @@ class GameService:
         self.db = db
         self.items = items_repo
         self.cfg = cfg
+        # кэш аккаунтов с отложенной записью (включается account_flush_interval)
+        self.accounts = AccountCache.from_config(db, cfg)
+        # подписки подключений на push-уведомления (см. srv_push)
+        self.push = PushHub()
+        # ник -> живое подключение, токены возобновления (см. srv_sessions)
+        self.sessions = SessionRegistry.from_config(cfg)
+        items_repo.add_change_listener(self._catalog_changed)
+        db.bulk_listeners.append(self._accounts_changed)
+
+    def _catalog_changed(self, snap):
+        self.push.broadcast(CATALOG_CHANGED, catalog_version=self.items.version_token(snap))
+
+    def _accounts_changed(self, nicknames):
+        """Массовая операция изменила аккаунты: свежие данные подписанным игрокам."""
+        for nickname in self.push.nicknames() & nicknames:
+            acc = self.whoami(nickname)
+            if acc is not None:
+                self.push.publish(nickname, CREDITS_CHANGED, account=acc)
 
     def login(self, nickname: str):
         if not nickname:
             raise ValueError("no_nickname")
-        self.db.create_account_if_missing(nickname, 0)
         minb = int(self.cfg.get("login_credit_min", 0))
         maxb = int(self.cfg.get("login_credit_max", 0))
         bonus = random.randint(minb, maxb) if maxb >= minb else 0
-        if bonus:
-            self.db.add_credits(nickname, bonus)
-        acc = self.db.get_account(nickname)
-        return {"account": acc, "items_master": self.items.list_all(), "login_bonus": bonus}
+        now = int(time.time())
+        if self.accounts:
+            acc, bonus = self.accounts.login(nickname, bonus, self._bonus_period_start(now), now)
+        else:
+            acc, bonus = self.db.login_account(nickname, bonus, self._bonus_period_start(now), now)
+        return {"account": acc, "catalog": self.items.snapshot(), "login_bonus": bonus}
+
+    def resume(self, nickname: str):
+        """Возобновление сессии по resume_token: аккаунт без бонуса и записи в DB."""
+        acc = self.accounts.acquire(nickname) if self.accounts else self.db.get_account(nickname)
+        return {"account": acc, "catalog": self.items.snapshot()}
+
+    def _bonus_period_start(self, now: int) -> int:
+        """
+        Начало текущего периода бонуса (login_bonus_period секунд, по умолчанию сутки UTC):
+        бонус начисляется, если прошлый был раньше. 0 — бонус за каждый вход.
+        """
+        period = int(self.cfg.get("login_bonus_period", 86400))
+        if period <= 0:
+            return now + 1
+        return now - now % period
+
+    def logout(self, nickname: str):
+        """Игрок отключился: его аккаунт можно вытеснить из кэша."""
+        if self.accounts and nickname:
+            self.accounts.release(nickname)
+
+    def close(self):
+        if self._accounts_changed in self.db.bulk_listeners:
+            self.db.bulk_listeners.remove(self._accounts_changed)
+        if self.accounts:
+            self.accounts.close()
+        self.items.close()
+
+    def transaction(self):
+        """Общая транзакция для нескольких операций подряд (batch)."""
+        if self.accounts:
+            return self.accounts.transaction()
+        return self.db.transaction(immediate=True)
 
     def whoami(self, nickname: str):
+        if self.accounts:
+            return self.accounts.get(nickname)
         acc = self.db.get_account(nickname)
         return acc
 
-    def buy(self, nickname: str, item_id: int):
+    def _trade(self, nickname, item_id, credits_delta, acquire, quantity, max_stack=1):
+        if self.accounts:
+            return self.accounts.trade(nickname, item_id, credits_delta, acquire, quantity, max_stack)
+        return self.db.execute_trade(nickname, item_id, credits_delta, acquire, quantity, max_stack)
+
+    def max_stack(self, item: dict) -> int:
+        """Сколько штук предмета можно держать: поле max_stack или default_max_stack (1 — без стопок)."""
+        return int(item.get("max_stack", self.cfg.get("default_max_stack", 1)))
+
+    def buy(self, nickname: str, item_id: int, quantity: int = 1):
         if not nickname:
             return {"error": "not_logged_in"}
         item = self.items.get(item_id)
         if not item:
             return {"error": "item_not_found"}
-        acc = self.db.get_account(nickname)
-        if item_id in acc["items"]:
-            return {"error": "already_owned"}
-        if acc["credits"] < item["price"]:
-            return {"error": "not_enough_credits"}
-        self.db.add_item(nickname, item_id)
-        self.db.add_credits(nickname, -item["price"])
-        acc = self.db.get_account(nickname)
-        return {"account": acc, "bought": item}
+        res = self._trade(nickname, item_id, -item["price"] * quantity, True, quantity, self.max_stack(item))
+        if "error" in res:
+            return res
+        return {"account": res["account"], "bought": item, "quantity": quantity}
 
-    def sell(self, nickname: str, item_id: int):
+    def sell(self, nickname: str, item_id: int, quantity: int = 1):
         if not nickname:
             return {"error": "not_logged_in"}
         item = self.items.get(item_id)
         if not item:
             return {"error": "item_not_found"}
-        acc = self.db.get_account(nickname)
-        if item_id not in acc["items"]:
-            return {"error": "not_owned"}
-        sale_price = int(item["price"] * 0.5)
-        self.db.remove_item(nickname, item_id)
-        self.db.add_credits(nickname, sale_price)
-        acc = self.db.get_account(nickname)
-        return {"account": acc, "sold": item, "received": sale_price}
-
+        sale_price = int(item["price"] * 0.5) * quantity
+        res = self._trade(nickname, item_id, sale_price, False, quantity)
+        if "error" in res:
+            return res
+        return {"account": res["account"], "sold": item, "received": sale_price, "quantity": quantity}
@@ -1,73 +1,259 @@
-import json
-import os
+import logging
 import threading
+import uuid
 from typing import Optional
 
+from srv.srv_catalog import CatalogSnapshot
+from srv.srv_catalog_store import JsonFileCatalogStore, number_items, store_from_config, validate_item
 from srv.srv_config import DEFAULT_ITEMS_FILE
 
 
 class ItemRepository:
     """
-    Хранит master-list предметов в файле JSON и предоставляет методы для управления ими.
-    Потокобезопасен.
+    Хранит master-list предметов (JSON-файл или SqliteCatalogStore) и предоставляет методы для управления ими.
+    Каталог хранится как неизменяемый CatalogSnapshot (id -> item в порядке файла):
+    читатели берут текущую ссылку без блокировок, писатели под self.lock строят
+    новую версию и атомарно подменяют её (copy-on-write). Номер версии растёт
+    при каждой публикации; последние history_size изменений хранятся в снимке
+    для дельта-синхронизации клиентского кэша.
+
+    Запись в хранилище идёт вне self.lock по опубликованному снимку.
+    schedule_save() откладывает запись на save_delay секунд, чтобы серия правок
+    из консоли сохранялась одной записью; после каждой записи вызываются
+    слушатели add_save_listener (например, рассылка reload воркерам).
+    reload_if_changed() перечитывает хранилище, если оно изменено не этим
+    репозиторием (см. CatalogWatcher). Слушатели add_change_listener получают
+    каждую новую версию (push catalog_changed). Потокобезопасен.
     """
-    def __init__(self, path=DEFAULT_ITEMS_FILE):
-        self.path = path
-        self.lock = threading.Lock()
-        self.items = []
+    def __init__(self, path=DEFAULT_ITEMS_FILE, history_size=64, store=None, save_delay=0.0):
+        self.store = store if store is not None else JsonFileCatalogStore(path)
+        self.path = self.store.path
+        self.history_size = history_size
+        self.save_delay = save_delay
+        self.lock = threading.Lock()  # сериализует только писателей
+        self._save_lock = threading.Lock()  # сериализует load/save хранилища
+        self._save_timer = None
+        self._saved_version = 0
+        self._save_listeners = []
+        self._change_listeners = []
+        self._store_signature = None  # подпись хранилища после нашей последней загрузки/записи
+        # версии нумеруются заново после рестарта, epoch отличает их от прежних
+        self.epoch = uuid.uuid4().hex[:12]
+        self._snapshot = CatalogSnapshot(0, {}, 0)
         self.load()
 
-    def load(self):
+    @classmethod
+    def from_config(cls, cfg: dict):
+        """Репозиторий по настройкам сервера: catalog_store, items_file/catalog_db_file, catalog_save_delay."""
+        return cls(store=store_from_config(cfg, DEFAULT_ITEMS_FILE),
+                   save_delay=float(cfg.get("catalog_save_delay", 1.0)))
+
+    @property
+    def version(self) -> int:
+        return self._snapshot.version
+
+    def snapshot(self) -> CatalogSnapshot:
+        """Текущая версия каталога; чтение ссылки атомарно, блокировка не нужна."""
+        return self._snapshot
+
+    def catalog_payload(self) -> bytes:
+        """Закодированный JSON текущей версии каталога (кэшируется в снимке)."""
+        return self._snapshot.json_payload()
+
+    def version_token(self, snap: CatalogSnapshot) -> str:
+        """Версия каталога для клиента: "<epoch>:<version>"."""
+        return f"{self.epoch}:{snap.version}"
+
+    def parse_version_token(self, token) -> Optional[int]:
+        """Номер версии из токена клиента или None, если токен от другого запуска сервера."""
+        if not isinstance(token, str):
+            return None
+        epoch, _, version = token.partition(":")
+        if epoch != self.epoch or not version.isdigit():
+            return None
+        return int(version)
+
+    def _publish(self, by_id: dict, max_id: int, touched: dict) -> CatalogSnapshot:
+        # вызывается под self.lock; touched — {id: существовал ли предмет до изменения}
+        prev = self._snapshot
+        version = prev.version + 1
+        changes = (prev.changes + ((version, touched),))[-self.history_size:]
+        self._snapshot = CatalogSnapshot(version, by_id, max_id, changes)
+        for listener in self._change_listeners:
+            listener(self._snapshot)
+        return self._snapshot
+
+    def _signature(self):
+        signature = getattr(self.store, "signature", None)
+        return signature() if signature is not None else None
+
+    def load(self, validate=False) -> bool:
+        """
+        Перечитывает каталог из хранилища; разбор идёт до взятия блокировки писателей.
+        validate=True — каждая запись проверяется validate_item, при ошибке (ValueError)
+        текущий каталог не меняется. Возвращает True, если каталог изменился.
+        """
+        with self._save_lock:
+            return self._load(validate)
+
+    def _load(self, validate):
+        # вызывается под self._save_lock
+        signature = self._signature()  # до чтения: запись во время разбора заметим в следующий раз
+        items = self.store.load()
+        if validate:
+            items = self._validated(items)
+        by_id = {}
+        for it in number_items(items):
+            by_id[it["id"]] = it
         with self.lock:
-            if os.path.exists(self.path):
-                with open(self.path, "r", encoding="utf-8") as f:
-                    data = json.load(f)
-                    normalized = []
-                    next_id = 1
-                    for it in data:
-                        if "id" not in it:
-                            it["id"] = next_id
-                        normalized.append(it)
-                        next_id = max(next_id, it["id"] + 1)
-                    self.items = normalized
-            else:
-                self.items = []
+            self._store_signature = signature
+            old = self._snapshot.by_id
+            touched = {iid: iid in old for iid in old.keys() | by_id.keys() if old.get(iid) != by_id.get(iid)}
+            if touched or not self._snapshot.version:
+                self._publish(by_id, max(by_id, default=0), touched)
+            self._saved_version = self._snapshot.version
+            return bool(touched)
+
+    def _validated(self, items):
+        for index, it in enumerate(items, 1):
+            try:
+                yield validate_item(it)
+            except ValueError as e:
+                raise ValueError(f"{self.path}: item #{index}: {e}")
+
+    def reload_if_changed(self) -> bool:
+        """
+        Перечитывает хранилище (с проверкой записей), если его подпись (mtime, размер)
+        изменилась после нашей последней загрузки или записи. Собственные save()
+        подпись обновляют и перезагрузки не вызывают. Ошибка разбора пробрасывается,
+        повторно тот же файл не перечитывается.
+        """
+        with self._save_lock:
+            signature = self._signature()
+            if signature is None or signature == self._store_signature:
+                return False
+            if self._snapshot.version != self._saved_version:
+                logging.warning("Catalog changed externally, unsaved console edits are discarded")
+            try:
+                return self._load(validate=True)
+            except (OSError, ValueError):
+                self._store_signature = signature
+                raise
 
     def save(self):
+        """Записывает текущую версию в хранилище (SqliteCatalogStore — только изменения)."""
+        with self._save_lock:
+            snap = self._snapshot
+            self.store.save(snap, snap.delta_since(self._saved_version))
+            self._saved_version = snap.version
+            self._store_signature = self._signature()
+        for listener in self._save_listeners:
+            listener()
+
+    def flush(self) -> bool:
+        """Сохраняет каталог, если есть несохранённые изменения."""
+        if self._snapshot.version == self._saved_version:
+            return False
+        self.save()
+        return True
+
+    def schedule_save(self):
+        """Отложенная запись: изменения за save_delay секунд сохраняются одной записью."""
+        if self.save_delay <= 0:
+            self.save()
+            return
         with self.lock:
-            with open(self.path, "w", encoding="utf-8") as f:
-                json.dump(self.items, f, ensure_ascii=False, indent=2)
+            if self._save_timer is None:
+                self._save_timer = threading.Timer(self.save_delay, self._deferred_save)
+                self._save_timer.daemon = True
+                self._save_timer.start()
 
-    def list_all(self):
+    def _deferred_save(self):
         with self.lock:
-            return [dict(it) for it in self.items]
+            self._save_timer = None  # правки во время записи запланируют новую
+        try:
+            self.flush()
+        except Exception:
+            logging.exception("Catalog save failed")
 
-    def get(self, item_id: int) -> Optional[dict]:
+    def add_save_listener(self, listener):
+        self._save_listeners.append(listener)
+
+    def add_change_listener(self, listener):
+        """listener(snap) вызывается под блокировкой писателей после публикации версии — должен быть быстрым."""
+        self._change_listeners.append(listener)
+
+    def close(self):
+        """Отменяет отложенную запись и сохраняет несохранённые изменения."""
         with self.lock:
-            for it in self.items:
-                if it["id"] == item_id:
-                    return dict(it)
-            return None
+            timer, self._save_timer = self._save_timer, None
+        if timer is not None:
+            timer.cancel()
+        self.flush()
+
+    def list_all(self):
+        return [dict(it) for it in self._snapshot.items()]
+
+    def get(self, item_id: int) -> Optional[dict]:
+        it = self._snapshot.get(item_id)
+        return dict(it) if it is not None else None
 
     def add(self, name: str, price: int) -> dict:
         with self.lock:
-            max_id = max((it.get("id", 0) for it in self.items), default=0)
-            new = {"id": max_id + 1, "name": name, "price": int(price)}
-            self.items.append(new)
+            snap = self._snapshot
+            # счётчик только растёт: id удалённых предметов не переиспользуются
+            new = {"id": snap.max_id + 1, "name": name, "price": int(price)}
+            by_id = dict(snap.by_id)
+            by_id[new["id"]] = new
+            self._publish(by_id, new["id"], {new["id"]: False})
             return dict(new)
 
     def remove(self, item_id: int) -> bool:
         with self.lock:
-            for i, it in enumerate(self.items):
-                if it["id"] == item_id:
-                    del self.items[i]
-                    return True
-            return False
+            snap = self._snapshot
+            if item_id not in snap.by_id:
+                return False
+            by_id = dict(snap.by_id)
+            del by_id[item_id]
+            self._publish(by_id, snap.max_id, {item_id: True})
+            return True
 
     def update(self, item_id: int, **kwargs) -> Optional[dict]:
         with self.lock:
-            for it in self.items:
-                if it["id"] == item_id:
-                    it.update(kwargs)
-                    return dict(it)
-            return None
+            snap = self._snapshot
+            it = snap.get(item_id)
+            if it is None:
+                return None
+            kwargs.pop("id", None)  # id — ключ индекса, его не меняем
+            changed = dict(it, **kwargs)
+            by_id = dict(snap.by_id)
+            by_id[item_id] = changed
+            self._publish(by_id, snap.max_id, {item_id: True})
+            return dict(changed)
+
+    def import_items(self, items, replace=False) -> int:
+        """
+        Массовое добавление предметов одной публикацией (одна новая версия).
+        items — итератор проверенных записей (см. read_import_file), он читается
+        до взятия блокировки. Предмет с существующим id заменяется на месте,
+        без id — получает новый id. replace=True — каталог целиком заменяется.
+        Возвращает число импортированных предметов.
+        """
+        records = list(items)
+        with self.lock:
+            snap = self._snapshot
+            by_id = {} if replace else dict(snap.by_id)
+            max_id = max([snap.max_id] + [rec["id"] for rec in records if "id" in rec])
+            touched = {}
+            for rec in records:
+                if "id" not in rec:
+                    max_id += 1
+                    rec = {"id": max_id, **rec}
+                iid = rec["id"]
+                by_id[iid] = rec
+                if snap.by_id.get(iid) != rec:
+                    touched[iid] = iid in snap.by_id
+            if replace:
+                touched.update((iid, True) for iid in snap.by_id if iid not in by_id)
+            self._publish(by_id, max_id, touched)
+        return len(records)
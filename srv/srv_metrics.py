@@ -0,0 +1,238 @@
+import bisect
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Границы корзин гистограмм задержек, секунды.
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _fmt_labels(names, values) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def items(self):
+        with self._lock:
+            return sorted(self._values.items())
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in self.items():
+            lines.append(f"{self.name}{_fmt_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels, value):
+        with self._lock:
+            self._values[labels] = value
+
+    def render(self):
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._values = {}  # labels -> [counts по корзинам + inf, сумма, количество]
+
+    def observe(self, value, *labels):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            data = self._values.get(labels)
+            if data is None:
+                data = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            data[0][i] += 1
+            data[1] += value
+            data[2] += 1
+
+    def quantile(self, q, *labels):
+        """Приблизительный квантиль: верхняя граница корзины, в которую он попал."""
+        data = self._values.get(labels)
+        if not data or not data[2]:
+            return None
+        rank = q * data[2]
+        seen = 0
+        for bound, count in zip(self.buckets + (float("inf"),), data[0]):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def items(self):
+        with self._lock:
+            return sorted((labels, ([*d[0]], d[1], d[2])) for labels, d in self._values.items())
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = self.labelnames + ("le",)
+        for labels, (counts, total, n) in self.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_fmt_labels(names, labels + (bound,))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_fmt_labels(names, labels + ('+Inf',))} {n}")
+            lines.append(f"{self.name}_sum{_fmt_labels(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{_fmt_labels(self.labelnames, labels)} {n}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Реестр метрик процесса. Метрики рендерятся в текстовом формате Prometheus;
+    collectors — функции, которые при каждом рендере возвращают {имя: значение}
+    для gauge без меток (например, статистика пула DB).
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, help_text, labelnames=()):
+        m = Counter(name, help_text, labelnames)
+        self._metrics.append(m)
+        return m
+
+    def gauge(self, name, help_text, labelnames=()):
+        m = Gauge(name, help_text, labelnames)
+        self._metrics.append(m)
+        return m
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        m = Histogram(name, help_text, labelnames, buckets)
+        self._metrics.append(m)
+        return m
+
+    def register_collector(self, fn):
+        self._collectors.append(fn)
+
+    def collect(self) -> dict:
+        values = {}
+        for fn in self._collectors:
+            try:
+                values.update(fn())
+            except Exception:
+                logging.exception("Metrics collector failed")
+        return values
+
+    def render(self) -> str:
+        lines = []
+        for m in self._metrics:
+            lines.extend(m.render())
+        for name, value in sorted(self.collect().items()):
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+REQUESTS = REGISTRY.counter("tzl_requests_total", "Processed requests", ("action",))
+ERRORS = REGISTRY.counter("tzl_request_errors_total", "Requests answered with an error", ("action", "error"))
+LATENCY = REGISTRY.histogram("tzl_request_phase_seconds", "Request latency by phase", ("action", "phase"))
+CONNECTIONS = REGISTRY.gauge("tzl_active_connections", "Open client connections")
+
+PHASES = ("parse", "service", "db", "send")
+_local = threading.local()
+
+
+def add_db_time(elapsed: float):
+    """DB сообщает время работы с соединением; копится для текущего запроса потока."""
+    _local.db_time = getattr(_local, "db_time", 0.0) + elapsed
+
+
+def call_with_db_time(fn, *args):
+    """Выполняет fn и возвращает (результат, общее время, время в DB)."""
+    _local.db_time = 0.0
+    start = time.perf_counter()
+    result = fn(*args)
+    elapsed = time.perf_counter() - start
+    return result, elapsed, _local.db_time
+
+
+def action_label(msg, known) -> str:
+    action = msg.get("action") if isinstance(msg, dict) else None
+    return action if action in known else "unknown"
+
+
+def record_request(action, resp, parse, service, db, send):
+    REQUESTS.inc(action)
+    if isinstance(resp, dict) and resp.get("status") == "error":
+        ERRORS.inc(action, str(resp.get("error")))
+    for phase, value in zip(PHASES, (parse, max(service - db, 0.0), db, send)):
+        LATENCY.observe(value, action, phase)
+
+
+def summary(registry: MetricsRegistry = REGISTRY) -> str:
+    """Короткая сводка для консоли администратора (команда stats)."""
+    lines = [f"connections: {CONNECTIONS.value()}"]
+    for (action,), count in REQUESTS.items():
+        errors = sum(v for (a, _), v in ERRORS.items() if a == action)
+        p50 = LATENCY.quantile(0.5, action, "service")
+        p95 = LATENCY.quantile(0.95, action, "service")
+        db95 = LATENCY.quantile(0.95, action, "db")
+        lines.append(f"{action}: requests={count} errors={errors} "
+                     f"service_p50<={p50}s service_p95<={p95}s db_p95<={db95}s")
+    for (action, error), count in ERRORS.items():
+        lines.append(f"  error {action}/{error}: {count}")
+    for name, value in sorted(registry.collect().items()):
+        lines.append(f"{name}: {value}")
+    return "\n".join(lines)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        pass
+
+
+def start_metrics_server(host: str, port: int) -> ThreadingHTTPServer:
+    """HTTP /metrics в фоновом потоке (только локально: host по умолчанию 127.0.0.1)."""
+    httpd = ThreadingHTTPServer((host, port), _MetricsHandler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True, name="metrics-http").start()
+    logging.info("Metrics endpoint on http://%s:%s/metrics", host, httpd.server_address[1])
+    return httpd
@@ -0,0 +1,98 @@
+"""
+Версионирование схемы базы: номер текущей версии хранится в PRAGMA user_version,
+при старте DB применяются все миграции с большим номером по порядку.
+
+Каждая миграция выполняется в своей транзакции BEGIN IMMEDIATE вместе с
+обновлением user_version: упавшая миграция откатывается целиком, а несколько
+процессов (pre-fork) не применят одну миграцию дважды. В WAL-режиме читатели
+не блокируются даже на время перестройки таблицы — до COMMIT они видят старую схему.
+
+Новая миграция — функция (conn) -> None в конце MIGRATIONS; старые не меняются.
+"""
+import logging
+
+
+def _baseline(conn):
+    # схема до появления миграций: на существующей базе ничего не меняет
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS accounts (
+            nickname TEXT PRIMARY KEY,
+            credits INTEGER NOT NULL
+        );
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS account_items (
+            nickname TEXT,
+            item_id INTEGER,
+            PRIMARY KEY (nickname, item_id),
+            FOREIGN KEY (nickname) REFERENCES accounts(nickname)
+        );
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER
+        );
+    """)
+
+
+def _account_items_item_index(conn):
+    # "у кого есть предмет X" и очистка инвентарей при удалении предмета из каталога;
+    # первичный ключ (nickname, item_id) для поиска по item_id не подходит
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_account_items_item_id ON account_items (item_id)")
+
+
+def _credits_check(conn):
+    # CHECK нельзя добавить через ALTER TABLE: таблица перестраивается
+    conn.execute("""
+        CREATE TABLE accounts_new (
+            nickname TEXT PRIMARY KEY,
+            credits INTEGER NOT NULL CHECK (credits >= 0)
+        );
+    """)
+    conn.execute("INSERT INTO accounts_new (nickname, credits) SELECT nickname, MAX(credits, 0) FROM accounts")
+    conn.execute("DROP TABLE accounts")
+    conn.execute("ALTER TABLE accounts_new RENAME TO accounts")
+
+
+def _item_quantity(conn):
+    conn.execute("ALTER TABLE account_items ADD COLUMN quantity INTEGER NOT NULL DEFAULT 1 CHECK (quantity > 0)")
+
+
+def _last_bonus_at(conn):
+    # время последнего бонуса за вход (unix time), NULL — бонуса ещё не было
+    conn.execute("ALTER TABLE accounts ADD COLUMN last_bonus_at INTEGER")
+
+
+# (версия, описание, функция) — версии идут подряд с 1
+MIGRATIONS = [
+    (1, "baseline schema", _baseline),
+    (2, "index account_items.item_id", _account_items_item_index),
+    (3, "accounts.credits CHECK (credits >= 0)", _credits_check),
+    (4, "account_items.quantity", _item_quantity),
+    (5, "accounts.last_bonus_at", _last_bonus_at),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(conn) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(db, target=SCHEMA_VERSION) -> int:
+    """Доводит схему базы до версии target; возвращает итоговую версию."""
+    with db._connection() as conn:
+        current = schema_version(conn)
+    if current > SCHEMA_VERSION:
+        raise RuntimeError(f"Database schema version {current} is newer than supported {SCHEMA_VERSION}")
+    for version, description, apply in MIGRATIONS:
+        if version <= current or version > target:
+            continue
+        with db.transaction(immediate=True) as conn:
+            if schema_version(conn) >= version:
+                continue  # уже применил другой процесс
+            logging.info("Applying database migration %s: %s", version, description)
+            apply(conn)
+            conn.execute(f"PRAGMA user_version = {int(version)}")
+    with db._connection() as conn:
+        return schema_version(conn)
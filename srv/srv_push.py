@@ -0,0 +1,74 @@
+"""
+Серверные уведомления (push): сообщения {"type": "push", "event": ..., ...},
+которые сервер отправляет подписанному клиенту без запроса.
+
+События:
+  catalog_changed  — опубликована новая версия каталога (catalog_version);
+  credits_changed  — аккаунт изменён не этим подключением (account): массовая
+                     операция администратора. Сделки и бонус за вход меняют аккаунт
+                     только из его единственной сессии (srv_sessions) и приходят
+                     в ответе на запрос.
+  session_closed   — сервер закрывает подключение (reason: duplicate_login,
+                     resumed_elsewhere, idle_timeout); приходит без подписки.
+
+Обычные ответы поля "type" не содержат — по нему клиент отличает push от ответа.
+"""
+import threading
+
+CATALOG_CHANGED = "catalog_changed"
+CREDITS_CHANGED = "credits_changed"
+PUSH_EVENTS = frozenset((CATALOG_CHANGED, CREDITS_CHANGED))
+SESSION_CLOSED = "session_closed"
+
+
+def push_message(event: str, **fields) -> dict:
+    msg = {"type": "push", "event": event}
+    msg.update(fields)
+    return msg
+
+
+class PushHub:
+    """
+    Реестр подписок: ник -> {sink: события}. sink — функция (msg) -> bool,
+    которая ставит сообщение в очередь отправки своего подключения и не
+    блокируется (переполненной очереди уведомление не достаётся — следующее
+    событие или ответ всё равно принесут актуальное состояние).
+    Отправка идёт вне блокировки реестра. Потокобезопасен.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subs = {}
+
+    def subscribe(self, nickname: str, sink, events=PUSH_EVENTS):
+        with self._lock:
+            self._subs.setdefault(nickname, {})[sink] = frozenset(events)
+
+    def unsubscribe(self, nickname: str, sink):
+        with self._lock:
+            sinks = self._subs.get(nickname)
+            if sinks is not None:
+                sinks.pop(sink, None)
+                if not sinks:
+                    del self._subs[nickname]
+
+    def nicknames(self):
+        """Копия множества ников с подписками."""
+        with self._lock:
+            return set(self._subs)
+
+    def publish(self, nickname: str, event: str, **fields) -> int:
+        """Уведомление подпискам одного ника; возвращает число доставленных в очередь."""
+        with self._lock:
+            sinks = [sink for sink, events in self._subs.get(nickname, {}).items() if event in events]
+        return self._deliver(sinks, push_message(event, **fields))
+
+    def broadcast(self, event: str, **fields) -> int:
+        """Уведомление всем подписанным на event."""
+        with self._lock:
+            sinks = [sink for subs in self._subs.values() for sink, events in subs.items() if event in events]
+        return self._deliver(sinks, push_message(event, **fields))
+
+    @staticmethod
+    def _deliver(sinks, msg) -> int:
+        return sum(1 for sink in sinks if sink(msg))
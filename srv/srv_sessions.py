@@ -0,0 +1,153 @@
+"""
+Таблица сессий процесса: ник -> подключение (ClientSession) и токен возобновления.
+
+Один ник — одна живая сессия. Повторный вход тем же ником решается политикой
+duplicate_login_policy: kick_old — старое подключение закрывается (по умолчанию),
+reject_new — новый вход получает already_logged_in.
+
+При обрыве соединения (не logout) запись остаётся session_resume_timeout секунд:
+клиент переподключается с resume_token и продолжает сессию без login (без бонуса
+и UPSERT аккаунта). Токен одноразовый — каждый вход и возобновление выдают новый,
+а возобновление по токену вытесняет прежнее подключение при любой политике.
+Сессии без запросов дольше session_idle_timeout секунд закрываются фоновым потоком.
+
+В режиме нескольких процессов (workers > 1) таблица у каждого воркера своя.
+"""
+import logging
+import secrets
+import threading
+import time
+
+KICK_OLD = "kick_old"
+REJECT_NEW = "reject_new"
+POLICIES = (KICK_OLD, REJECT_NEW)
+
+
+class _Entry:
+    __slots__ = ("nickname", "session", "token", "detached_at")
+
+    def __init__(self, nickname, session, token):
+        self.nickname = nickname
+        self.session = session  # None — подключение оборвалось, ждём resume
+        self.token = token
+        self.detached_at = None
+
+
+class SessionRegistry:
+    """
+    Сессия — объект с last_active (time.monotonic() последнего запроса),
+    closed и kick(reason), который закрывает подключение. kick вызывается вне блокировки.
+    Потокобезопасен.
+    """
+
+    def __init__(self, policy=KICK_OLD, idle_timeout=0.0, resume_timeout=300.0):
+        if policy not in POLICIES:
+            raise ValueError(f"unknown duplicate_login_policy: {policy}")
+        self.policy = policy
+        self.idle_timeout = idle_timeout
+        self.resume_timeout = resume_timeout
+        self._lock = threading.Lock()
+        self._by_nick = {}
+        self._by_token = {}
+
+    @classmethod
+    def from_config(cls, cfg: dict):
+        return cls(cfg.get("duplicate_login_policy", KICK_OLD),
+                   float(cfg.get("session_idle_timeout", 0)),
+                   float(cfg.get("session_resume_timeout", 300)))
+
+    def __len__(self):
+        """Число живых сессий."""
+        with self._lock:
+            return sum(1 for entry in self._by_nick.values() if entry.session is not None)
+
+    def get(self, nickname):
+        """Живая сессия ника или None."""
+        entry = self._by_nick.get(nickname)
+        return entry.session if entry is not None else None
+
+    def _attach(self, nickname, session) -> str:
+        # вызывается под self._lock: новая запись с новым токеном, старый токен недействителен
+        old = self._by_nick.get(nickname)
+        if old is not None:
+            self._by_token.pop(old.token, None)
+        entry = _Entry(nickname, session, secrets.token_urlsafe(18))
+        self._by_nick[nickname] = entry
+        self._by_token[entry.token] = entry
+        return entry.token
+
+    def claim(self, nickname, session) -> dict:
+        """Вход: {"token": resume_token} или {"error": "already_logged_in"} (reject_new)."""
+        with self._lock:
+            entry = self._by_nick.get(nickname)
+            old = entry.session if entry is not None and entry.session is not session else None
+            if old is not None and self.policy == REJECT_NEW:
+                return {"error": "already_logged_in"}
+            token = self._attach(nickname, session)
+        if old is not None:
+            logging.info("Duplicate login for %s, closing previous session", nickname)
+            old.kick("duplicate_login")
+        return {"token": token}
+
+    def resume(self, token, session) -> dict:
+        """Возобновление: {"nickname", "token"} или {"error": "bad_resume_token"}."""
+        with self._lock:
+            entry = self._by_token.get(token) if isinstance(token, str) else None
+            if entry is None or self._expired(entry, time.monotonic()):
+                return {"error": "bad_resume_token"}
+            old = entry.session if entry.session is not session else None
+            new_token = self._attach(entry.nickname, session)
+        if old is not None:
+            old.kick("resumed_elsewhere")
+        return {"nickname": entry.nickname, "token": new_token}
+
+    def release(self, nickname, session, resumable=True):
+        """
+        Сессия завершилась. resumable — обрыв соединения: запись ждёт resume;
+        иначе (logout) удаляется вместе с токеном. Чужую запись не трогает.
+        """
+        with self._lock:
+            entry = self._by_nick.get(nickname)
+            if entry is None or entry.session is not session:
+                return
+            if resumable and self.resume_timeout > 0:
+                entry.session = None
+                entry.detached_at = time.monotonic()
+            else:
+                del self._by_nick[nickname]
+                self._by_token.pop(entry.token, None)
+
+    def _expired(self, entry, now) -> bool:
+        return entry.session is None and now - entry.detached_at > self.resume_timeout
+
+    def reap(self, now=None) -> int:
+        """
+        Закрывает сессии, простаивающие дольше idle_timeout, и удаляет просроченные
+        токены. Запись закрытой сессии, которая не вызвала release, считается обрывом.
+        """
+        now = time.monotonic() if now is None else now
+        idle = []
+        with self._lock:
+            for nickname, entry in list(self._by_nick.items()):
+                if entry.session is not None and getattr(entry.session, "closed", False):
+                    entry.session = None
+                    entry.detached_at = now
+                if self._expired(entry, now) or (entry.session is None and self.resume_timeout <= 0):
+                    del self._by_nick[nickname]
+                    self._by_token.pop(entry.token, None)
+                elif entry.session is not None and self.idle_timeout > 0 \
+                        and now - entry.session.last_active > self.idle_timeout:
+                    idle.append(entry.session)
+        for session in idle:
+            session.kick("idle_timeout")
+        return len(idle)
+
+    def run_reaper(self, shutdown_event: threading.Event):
+        """Периодический reap() до shutdown_event (в отдельном daemon-потоке)."""
+        timeouts = [t for t in (self.idle_timeout, self.resume_timeout) if t > 0]
+        interval = min([5.0] + [t / 2 for t in timeouts])
+        while not shutdown_event.wait(interval):
+            try:
+                self.reap()
+            except Exception:
+                logging.exception("Session reaper failed")
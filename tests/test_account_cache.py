@@ -0,0 +1,176 @@
+import json
+import threading
+import time
+
+from srv.srv_account_cache import AccountCache
+from srv.srv_db import DB
+
+
+def make_cache(tmp_path, **kwargs):
+    db = DB(str(tmp_path / "game.db"))
+    return db, AccountCache(db, str(tmp_path / "accounts.journal"), **kwargs)
+
+
+def test_trades_stay_in_memory_until_flush(tmp_path):
+    db, cache = make_cache(tmp_path)
+    db.create_account_if_missing("nick", 100)
+    assert cache.acquire("nick") == {"nickname": "nick", "credits": 100, "items": []}
+
+    assert cache.trade("nick", 1, -60, acquire=True)["account"] == {"nickname": "nick", "credits": 40, "items": [1]}
+    assert cache.trade("nick", 1, -10, acquire=True) == {"error": "already_owned"}
+    assert cache.trade("nick", 2, -50, acquire=True) == {"error": "not_enough_credits"}
+    assert cache.trade("nick", 3, 5, acquire=False) == {"error": "not_owned"}
+    assert db.get_account("nick")["credits"] == 100
+
+    assert cache.flush() == 1
+    assert db.get_account("nick") == {"nickname": "nick", "credits": 40, "items": [1]}
+    assert cache.flush() == 0
+
+
+def test_journal_is_replayed_after_crash(tmp_path):
+    db, cache = make_cache(tmp_path)
+    db.create_account_if_missing("nick", 100)
+    cache.acquire("nick")
+    cache.trade("nick", 1, -60, acquire=True)
+    cache.flush()
+    cache.trade("nick", 1, 30, acquire=False)
+    cache.trade("nick", 2, -20, acquire=True)
+    # процесс «упал»: flush не вызывался, журнал остался на диске
+
+    _, restarted = make_cache(tmp_path)
+    assert db.get_account("nick") == {"nickname": "nick", "credits": 50, "items": [2]}
+    _, again = make_cache(tmp_path)
+    assert db.get_account("nick")["credits"] == 50
+
+
+def test_login_bonus_and_eviction(tmp_path):
+    db, cache = make_cache(tmp_path, max_entries=1)
+    for nick in ("a", "b"):
+        db.create_account_if_missing(nick, 10)
+
+    cache.acquire("a")
+    cache.trade("a", 1, -5, acquire=True)
+    acc, bonus = cache.login("a", 7, 100, 100)  # бонус записан в DB, в кэше — к незаписанной сделке
+    assert (acc["credits"], bonus) == (12, 7)
+    assert cache.login("a", 7, 100, 100)[1] == 0
+    cache.release("a")
+    cache.release("a")
+    cache.release("a")
+
+    cache.acquire("b")
+    assert "a" in cache._entries  # есть незаписанные операции — не вытесняется
+    cache.flush()
+    assert "a" not in cache._entries
+    assert cache.get("a") == {"nickname": "a", "credits": 12, "items": [1]}
+
+
+def test_transaction_compensates_on_error(tmp_path):
+    db, cache = make_cache(tmp_path)
+    db.create_account_if_missing("nick", 100)
+    try:
+        with cache.transaction():
+            cache.trade("nick", 1, -60, acquire=True)
+            raise RuntimeError
+    except RuntimeError:
+        pass
+    assert cache.get("nick") == {"nickname": "nick", "credits": 100, "items": []}
+    cache.flush()
+    assert db.get_account("nick") == {"nickname": "nick", "credits": 100, "items": []}
+
+
+def test_concurrent_trades_do_not_double_spend(tmp_path):
+    db, cache = make_cache(tmp_path)
+    db.create_account_if_missing("nick", 100)
+    results = []
+    threads = [threading.Thread(target=lambda i=i: results.append(cache.trade("nick", i, -100, True)))
+               for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sum(1 for r in results if "account" in r) == 1
+    cache.close()
+    assert db.get_account("nick")["credits"] == 0
+
+
+def test_stacks_in_cache_and_old_journal_format(tmp_path):
+    db, cache = make_cache(tmp_path)
+    db.create_account_if_missing("nick", 100)
+    cache.acquire("nick")
+    assert cache.trade("nick", 4, -40, True, quantity=4, max_stack=10)["account"]["quantities"] == {"4": 4}
+    assert cache.trade("nick", 4, 0, False, quantity=5) == {"error": "not_enough_items"}
+    assert cache.trade("nick", 5, -20, True, quantity=2) == {"error": "stack_limit"}
+    cache.trade("nick", 4, 10, False, quantity=3)
+    cache.flush()
+    assert db.get_account("nick") == {"nickname": "nick", "credits": 70, "items": [4]}
+
+    # строки журнала старого формата: acquire вместо изменения количества
+    cache.close()
+    with open(tmp_path / "accounts.journal", "a", encoding="utf-8") as f:
+        f.write('[1000, "nick", 5, 4, false]\n[1001, "nick", -5, 9, true]\n')
+    make_cache(tmp_path)
+    assert db.get_account("nick") == {"nickname": "nick", "credits": 70, "items": [9]}
+
+
+def test_bulk_operations_refresh_cached_accounts(tmp_path):
+    db, cache = make_cache(tmp_path)
+    db.create_account_if_missing("nick", 100)
+    cache.acquire("nick")
+    cache.trade("nick", 1, -30, acquire=True)
+
+    # незаписанная сделка попадает в DB до массового начисления, запись кэша перечитывается
+    assert db.grant_credits_all(10) == 1
+    db.grant_items([("nick", 2, 1)])
+    assert cache.get("nick") == {"nickname": "nick", "credits": 80, "items": [1, 2]}
+    assert cache.flush() == 0
+    assert db.get_account("nick") == {"nickname": "nick", "credits": 80, "items": [1, 2]}
+
+
+def test_concurrent_logins_count_bonus_once(tmp_path):
+    db, cache = make_cache(tmp_path)
+    login_account = db.login_account
+    first = threading.Event()
+
+    def slow_login_account(*args, **kwargs):
+        res = login_account(*args, **kwargs)
+        if not first.is_set():
+            first.set()
+            time.sleep(0.2)  # второй вход успевает прочитать аккаунт, пока первый не дошёл до кэша
+        return res
+
+    db.login_account = slow_login_account
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.login("nick", 100, 100, 100)))
+               for _ in range(2)]
+    for t in threads:
+        t.start()
+        first.wait()
+    for t in threads:
+        t.join()
+    assert sorted(bonus for _, bonus in results) == [0, 100]
+    assert cache.get("nick")["credits"] == db.get_account("nick")["credits"] == 100
+
+
+def test_rejected_operation_does_not_block_flush_and_startup(tmp_path):
+    db, cache = make_cache(tmp_path)
+    for nick in ("a", "b"):
+        db.create_account_if_missing(nick, 50)
+        cache.acquire(nick)
+    cache.trade("b", 2, -20, acquire=True)
+    cache._entries["a"].credits += 100  # кэш разошёлся с DB
+    cache.trade("a", 1, -120, acquire=True)
+    cache.trade("b", 3, -10, acquire=True)
+
+    assert cache.flush() == 3
+    assert db.get_account("b") == {"nickname": "b", "credits": 20, "items": [2, 3]}
+    assert db.get_account("a") == cache.get("a") == {"nickname": "a", "credits": 50, "items": []}
+    assert cache.flush() == 0
+    assert len((tmp_path / "accounts.journal.rejected").read_text().splitlines()) == 1
+
+    # такая же операция в журнале после аварии не мешает запуску
+    with open(tmp_path / "accounts.journal", "a", encoding="utf-8") as f:
+        f.write(json.dumps([cache._seq + 1, "a", -500, None, 0]) + "\n")
+        f.write(json.dumps([cache._seq + 2, "a", -5, None, 0]) + "\n")
+    make_cache(tmp_path)
+    assert db.get_account("a")["credits"] == 45
+    assert len((tmp_path / "accounts.journal.rejected").read_text().splitlines()) == 2
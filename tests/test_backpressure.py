@@ -0,0 +1,97 @@
+import socket
+import threading
+import time
+
+import pytest
+
+from srv.srv_backpressure import BoundedExecutor, ConnectionLimiter, OutboundQueue, busy_response
+
+
+def test_connection_limiter():
+    limiter = ConnectionLimiter(2)
+    assert limiter.try_acquire() and limiter.try_acquire()
+    assert not limiter.try_acquire()
+    limiter.release()
+    assert limiter.try_acquire()
+    assert limiter.active == 2
+
+
+def test_bounded_executor_rejects_when_full():
+    gate = threading.Event()
+    executor = BoundedExecutor(max_workers=1, max_pending=1)
+    running = executor.try_submit(gate.wait)
+    queued = executor.try_submit(lambda: 42)
+    assert running is not None and queued is not None
+    assert executor.try_submit(lambda: 0) is None
+    gate.set()
+    assert queued.result(timeout=1) == 42
+    assert executor.try_submit(lambda: 7).result(timeout=1) == 7
+    executor.shutdown()
+
+
+def test_busy_response_keeps_request_id():
+    assert busy_response({"action": "buy", "id": 5}) == {"status": "error", "error": "server_busy", "id": 5}
+    assert busy_response() == {"status": "error", "error": "server_busy"}
+
+
+def test_outbound_queue_high_water_blocks_until_drained():
+    a, b = socket.socketpair()
+    a.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+    q = OutboundQueue(a, high_water=64 * 1024)
+    q.start()
+    chunk = b"x" * 32 * 1024
+    accepted = 0
+    while q.put(chunk, timeout=0.2):
+        accepted += 1
+        assert accepted < 1000
+    assert q.pending_bytes >= 64 * 1024
+
+    received = bytearray()
+    b.settimeout(1)
+    while len(received) < accepted * len(chunk):
+        received += b.recv(1 << 20)
+    assert q.put(b"tail", timeout=1)
+    q.close(timeout=1)
+    time.sleep(0.05)
+    assert b.recv(16) == b"tail"
+    a.close()
+    b.close()
+
+
+@pytest.mark.skipif(not hasattr(socket, "MSG_DONTWAIT"), reason="writer thread is permanent without MSG_DONTWAIT")
+def test_outbound_queue_starts_writer_only_for_slow_client():
+    a, b = socket.socketpair()
+    a.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+    q = OutboundQueue(a, high_water=1 << 20)
+    q.start()
+    assert q.put(b"fast") and q._writer is None
+    assert b.recv(16) == b"fast"
+
+    assert q.put(b"x" * (256 * 1024)) and q._writer is not None  # сокет принял не всё
+    received = 0
+    b.settimeout(1)
+    while received < 256 * 1024:
+        received += len(b.recv(1 << 20))
+    deadline = time.time() + 1
+    while q._writer is not None and time.time() < deadline:
+        time.sleep(0.01)
+    assert q._writer is None and q.pending_bytes == 0
+    q.close(timeout=1)
+    a.close()
+    b.close()
+
+
+def test_outbound_queue_close_stops_writer_blocked_on_client():
+    a, b = socket.socketpair()
+    a.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+    q = OutboundQueue(a, high_water=1 << 20)
+    q.start()
+    assert q.put(b"x" * (256 * 1024))  # клиент не читает — поток записи висит в sendall
+    writer = q._writer
+    assert writer is not None
+    start = time.time()
+    q.close(timeout=0.2)
+    assert not writer.is_alive()
+    assert time.time() - start < 2
+    a.close()
+    b.close()
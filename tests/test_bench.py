@@ -0,0 +1,17 @@
+from bench.bench_load import parse_mix, percentile, run_benchmark
+
+
+def test_percentile_and_mix():
+    values = list(range(1, 101))
+    assert percentile(values, 0.5) == 50
+    assert percentile(values, 0.99) == 99
+    assert percentile([], 0.5) is None
+    assert parse_mix("buy=1,whoami=3") == {"buy": 1.0, "whoami": 3.0}
+
+
+def test_run_benchmark_smoke():
+    result = run_benchmark(clients=5, ops=4, ramp=0.1)
+    assert result["connect_failures"] == 0 and result["disconnects"] == 0
+    assert result["actions"]["login"]["count"] == 5
+    assert result["requests"] == 5 * (4 + 2)
+    assert result["actions"]["login"]["p99_ms"] >= result["actions"]["login"]["p50_ms"]
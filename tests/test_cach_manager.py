@@ -22,3 +22,33 @@ def test_load_items_file_not_exists(tmp_path):
     cache = CacheManager(filename)
 
     assert cache.load_items() is None
+
+
+def test_load_old_list_format(tmp_path):
+    filename = tmp_path / "items.json"
+    filename.write_text('[{"id": 1, "name": "sword", "price": 100}]', encoding="utf-8")
+    cache = CacheManager(filename)
+
+    assert cache.load_items() == [{"id": 1, "name": "sword", "price": 100}]
+    assert cache.load_version() == (None, None)
+
+
+def test_sync_from_login_full_not_modified_and_delta(tmp_path):
+    cache = CacheManager(tmp_path / "items.json")
+    items = [{"id": 1, "name": "sword", "price": 100}, {"id": 2, "name": "shield", "price": 50}]
+
+    assert cache.sync_from_login({"items_master": items, "catalog_status": "full",
+                                  "catalog_version": "e:1", "catalog_hash": "h1"}) == items
+    assert cache.load_version() == ("e:1", "h1")
+
+    assert cache.sync_from_login({"catalog_status": "not_modified",
+                                  "catalog_version": "e:1", "catalog_hash": "h1"}) == items
+
+    delta = {"added": [{"id": 3, "name": "bow", "price": 70}],
+             "changed": [{"id": 1, "name": "sword", "price": 120}],
+             "removed": [2]}
+    synced = cache.sync_from_login({"catalog_status": "delta", "catalog_delta": delta,
+                                    "catalog_version": "e:4", "catalog_hash": "h4"})
+    assert synced == [{"id": 1, "name": "sword", "price": 120}, {"id": 3, "name": "bow", "price": 70}]
+    assert cache.load_items() == synced
+    assert cache.load_version() == ("e:4", "h4")
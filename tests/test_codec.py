@@ -0,0 +1,68 @@
+import io
+import json
+
+import pytest
+
+from common.common_codec import BINARY_CODEC, JSON_CODEC, FrameError, Raw, JsonLinesCodec
+
+
+SAMPLE = {
+    "status": "ok",
+    "n": [0, 1, 127, 128, 255, 256, 65535, 65536, 2 ** 32, 2 ** 40, -1, -32, -33, -128, -129, -40000, -2 ** 40],
+    "f": 1.5,
+    "s": "Щит" * 20,
+    "long": "x" * 70000,
+    "b": b"\x00\x01",
+    "t": True,
+    "none": None,
+    "map": {str(i): i for i in range(20)},
+    "list": list(range(20)),
+}
+
+
+def test_binary_roundtrip():
+    frame = BINARY_CODEC.encode(SAMPLE)
+    assert int.from_bytes(frame[:4], "big") == len(frame) - 4
+    assert BINARY_CODEC.decode(frame) == SAMPLE
+
+
+def test_binary_is_msgpack_compatible_for_simple_values():
+    assert BINARY_CODEC.encode_value({"a": 1}) == b"\x81\xa1a\x01"
+    assert BINARY_CODEC.encode_value([None, False, True]) == b"\x93\xc0\xc2\xc3"
+    assert BINARY_CODEC.encode_value(-1) == b"\xff"
+
+
+def test_raw_values_are_spliced():
+    items = [{"id": 1, "name": "Меч"}]
+    for codec in (JSON_CODEC, BINARY_CODEC):
+        frame = codec.encode({"status": "ok", "items_master": Raw(codec.encode_value(items))})
+        assert codec.decode(frame) == {"status": "ok", "items_master": items}
+    assert json.loads(JSON_CODEC.encode({"a": Raw(b"[1]")})) == {"a": [1]}
+
+
+def test_split_handles_partial_and_coalesced_frames():
+    for codec in (JSON_CODEC, BINARY_CODEC):
+        stream = b"".join(codec.encode({"i": i}) for i in range(3))
+        buffer = bytearray(stream[:-2])
+        frames = codec.split(buffer)
+        assert [codec.decode(f) for f in frames] == [{"i": 0}, {"i": 1}]
+        buffer += stream[-2:]
+        assert [codec.decode(f) for f in codec.split(buffer)] == [{"i": 2}]
+        assert buffer == bytearray()
+
+
+def test_read_from_stream():
+    for codec in (JSON_CODEC, BINARY_CODEC):
+        f = io.BytesIO(codec.encode({"a": 1}) + codec.encode({"b": 2}))
+        assert codec.decode(codec.read_from(f)) == {"a": 1}
+        assert codec.decode(codec.read_from(f)) == {"b": 2}
+        assert codec.read_from(f) is None
+
+
+def test_frame_limits():
+    with pytest.raises(FrameError):
+        BINARY_CODEC.split(bytearray(b"\xff\xff\xff\xff"))
+    with pytest.raises(FrameError):
+        JsonLinesCodec(max_frame=4).split(bytearray(b"123456"))
+    with pytest.raises(FrameError):
+        BINARY_CODEC.decode(b"\x00\x00\x00\x01\xc1")
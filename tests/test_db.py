@@ -0,0 +1,200 @@
+import threading
+
+from srv.srv_db import DB
+
+
+def test_account_roundtrip(tmp_path):
+    db = DB(str(tmp_path / "game.db"))
+    assert db.get_account("nick") is None
+
+    db.create_account_if_missing("nick", 10)
+    db.create_account_if_missing("nick", 999)
+    db.add_credits("nick", 5)
+    db.add_item("nick", 3)
+    db.add_item("nick", 3)
+    assert db.get_account("nick") == {"nickname": "nick", "credits": 15, "items": [3]}
+
+    db.remove_item("nick", 3)
+    db.set_credits("nick", 1)
+    assert db.get_account("nick") == {"nickname": "nick", "credits": 1, "items": []}
+
+
+def test_pool_reuses_connections_and_uses_wal(tmp_path):
+    db = DB(str(tmp_path / "game.db"), pool_size=2)
+    db.create_account_if_missing("nick", 0)
+    for _ in range(50):
+        db.add_credits("nick", 1)
+        db.get_account("nick")
+    assert db._created == 1
+    with db._connection() as conn:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def test_pool_is_bounded_under_concurrency(tmp_path):
+    db = DB(str(tmp_path / "game.db"), pool_size=3)
+    db.create_account_if_missing("nick", 0)
+
+    def worker():
+        for _ in range(100):
+            db.add_credits("nick", 1)
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert db._created <= 3
+    assert db.get_account("nick")["credits"] == 800
+
+
+def test_execute_trade_checks_and_applies_atomically(tmp_path):
+    db = DB(str(tmp_path / "game.db"))
+    db.create_account_if_missing("nick", 100)
+
+    assert db.execute_trade("nick", 1, -150, acquire=True) == {"error": "not_enough_credits"}
+    assert db.get_account("nick") == {"nickname": "nick", "credits": 100, "items": []}
+
+    res = db.execute_trade("nick", 1, -60, acquire=True)
+    assert res["account"] == {"nickname": "nick", "credits": 40, "items": [1]}
+    assert db.execute_trade("nick", 1, -10, acquire=True) == {"error": "already_owned"}
+
+    res = db.execute_trade("nick", 1, 30, acquire=False)
+    assert res["account"] == {"nickname": "nick", "credits": 70, "items": []}
+    assert db.execute_trade("nick", 1, 30, acquire=False) == {"error": "not_owned"}
+
+
+def test_execute_trade_prevents_double_spend(tmp_path):
+    db = DB(str(tmp_path / "game.db"), pool_size=4)
+    db.create_account_if_missing("nick", 100)
+    results = []
+
+    def buy(item_id):
+        results.append(db.execute_trade("nick", item_id, -100, acquire=True))
+
+    threads = [threading.Thread(target=buy, args=(i,)) for i in range(1, 9)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert sum(1 for r in results if "account" in r) == 1
+    acc = db.get_account("nick")
+    assert acc["credits"] == 0
+    assert len(acc["items"]) == 1
+
+
+def test_nested_transactions_use_savepoints(tmp_path):
+    db = DB(str(tmp_path / "game.db"))
+    db.create_account_if_missing("nick", 100)
+    with db.transaction(immediate=True):
+        db.add_credits("nick", 10)
+        assert db.execute_trade("nick", 1, -500, acquire=True) == {"error": "not_enough_credits"}
+        assert db.execute_trade("nick", 2, -10, acquire=True)["account"]["items"] == [2]
+        assert db._created == 1
+    assert db.get_account("nick") == {"nickname": "nick", "credits": 100, "items": [2]}
+
+    try:
+        with db.transaction():
+            db.add_credits("nick", 1000)
+            raise RuntimeError
+    except RuntimeError:
+        pass
+    assert db.get_account("nick")["credits"] == 100
+
+
+def test_migrations_upgrade_legacy_database(tmp_path):
+    import sqlite3
+
+    import pytest
+
+    from srv.srv_migrations import SCHEMA_VERSION
+
+    path = str(tmp_path / "legacy.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE accounts (nickname TEXT PRIMARY KEY, credits INTEGER NOT NULL)")
+    conn.execute("CREATE TABLE account_items (nickname TEXT, item_id INTEGER, PRIMARY KEY (nickname, item_id),"
+                 " FOREIGN KEY (nickname) REFERENCES accounts(nickname))")
+    conn.execute("INSERT INTO accounts VALUES ('old', 70)")
+    conn.execute("INSERT INTO account_items VALUES ('old', 2)")
+    conn.commit()
+    conn.close()
+
+    db = DB(path)
+    assert db.schema_version == SCHEMA_VERSION
+    assert db.get_account("old") == {"nickname": "old", "credits": 70, "items": [2]}
+    with db._connection() as conn:
+        assert conn.execute("SELECT quantity FROM account_items").fetchone()[0] == 1
+        plan = conn.execute("EXPLAIN QUERY PLAN SELECT nickname FROM account_items WHERE item_id = 2").fetchall()
+        assert "idx_account_items_item_id" in str(plan)
+    with pytest.raises(sqlite3.IntegrityError):
+        db.set_credits("old", -1)
+    assert db.execute_trade("old", 5, -100, True) == {"error": "not_enough_credits"}
+    db.close()
+
+    # повторное открытие ничего не применяет заново
+    assert DB(path).schema_version == SCHEMA_VERSION
+
+
+def test_login_account_grants_bonus_once_per_period(tmp_path):
+    db = DB(str(tmp_path / "game.db"))
+    day = 86400
+    acc, bonus = db.login_account("nick", 50, period_start=day, now=day + 10)
+    assert (acc, bonus) == ({"nickname": "nick", "credits": 50, "items": []}, 50)
+
+    db.add_item("nick", 3)
+    acc, bonus = db.login_account("nick", 70, period_start=day, now=day + 500)
+    assert (acc, bonus) == ({"nickname": "nick", "credits": 50, "items": [3]}, 0)
+
+    acc, bonus = db.login_account("nick", 20, period_start=2 * day, now=2 * day + 1, read_account=False)
+    assert (acc, bonus) == (None, 20)
+    assert db.get_account("nick")["credits"] == 70
+
+    # аккаунт из старой схемы без last_bonus_at получает бонус
+    db.create_account_if_missing("old", 5)
+    assert db.login_account("old", 1, period_start=day, now=day)[1] == 1
+
+
+def test_execute_trade_with_stacks(tmp_path):
+    db = DB(str(tmp_path / "game.db"))
+    db.create_account_if_missing("nick", 100)
+
+    res = db.execute_trade("nick", 7, -30, acquire=True, quantity=3, max_stack=5)
+    assert res["account"] == {"nickname": "nick", "credits": 70, "items": [7], "quantities": {"7": 3}}
+    assert db.execute_trade("nick", 7, -30, acquire=True, quantity=3, max_stack=5) == {"error": "stack_limit"}
+    assert db.execute_trade("nick", 7, 0, acquire=False, quantity=4) == {"error": "not_enough_items"}
+
+    res = db.execute_trade("nick", 7, 10, acquire=False, quantity=2)
+    assert res["account"] == {"nickname": "nick", "credits": 80, "items": [7]}
+    res = db.execute_trade("nick", 7, 5, acquire=False, quantity=1)
+    assert res["account"] == {"nickname": "nick", "credits": 85, "items": []}
+    assert db.execute_trade("nick", 7, 5, acquire=False) == {"error": "not_owned"}
+
+    # несколько штук предмета без стопок: stack_limit, already_owned — только если он уже есть
+    assert db.execute_trade("nick", 8, -20, acquire=True, quantity=2) == {"error": "stack_limit"}
+    db.execute_trade("nick", 8, -10, acquire=True)
+    assert db.execute_trade("nick", 8, -10, acquire=True) == {"error": "already_owned"}
+
+
+def test_bulk_operations_in_chunks(tmp_path):
+    db = DB(str(tmp_path / "game.db"))
+    for i in range(7):
+        db.create_account_if_missing(f"p{i}", 10)
+
+    assert db.grant_credits_all(5, chunk_size=3) == 7
+    assert db.grant_credits([("p0", 100), ("p1", -50), ("ghost", 1)], chunk_size=2) == 2
+    assert [db.get_account(f"p{i}")["credits"] for i in range(3)] == [115, 0, 15]
+
+    assert db.grant_items([(f"p{i}", 3, 2) for i in range(7)] + [("ghost", 3, 1)], chunk_size=3) == 7
+    db.grant_items([("p0", 3, 1)])
+    assert db.get_account("p0")["quantities"] == {"3": 3}
+    assert db.get_account("ghost") is None
+
+    assert db.revoke_items([("p0", 3, 1), ("p1", 3, 2), ("p2", 3, None)]) == 3
+    assert db.get_account("p0")["quantities"] == {"3": 2}
+    assert db.get_account("p1")["items"] == db.get_account("p2")["items"] == []
+
+    # у p0 и p3..p6 по стопке: возврат 1 кредит за штуку
+    assert db.purge_item(3, refund=1, chunk_size=2) == 5
+    assert db.get_account("p0") == {"nickname": "p0", "credits": 117, "items": []}
+    assert db.get_account("p6")["credits"] == 17
@@ -11,6 +11,7 @@ def game_client():
     gc = GameClient()
     gc.network = MagicMock()
     gc.cache = MagicMock()
+    gc.cache.load_version.return_value = (None, None)
     gc.menu = MagicMock()
     return gc
 
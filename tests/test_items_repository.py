@@ -0,0 +1,261 @@
+import json
+import threading
+import time
+
+from srv.srv_catalog_watcher import CatalogWatcher
+from srv.srv_items_repository import ItemRepository
+
+
+def make_repo(tmp_path, items):
+    path = tmp_path / "items.json"
+    path.write_text(json.dumps(items, ensure_ascii=False), encoding="utf-8")
+    return ItemRepository(str(path))
+
+
+def test_load_get_and_order(tmp_path):
+    repo = make_repo(tmp_path, [{"id": 5, "name": "B", "price": 2}, {"id": 2, "name": "A", "price": 1}])
+    assert [it["id"] for it in repo.list_all()] == [5, 2]
+    assert repo.get(2) == {"id": 2, "name": "A", "price": 1}
+    assert repo.get(3) is None
+
+
+def test_add_remove_update(tmp_path):
+    repo = make_repo(tmp_path, [{"id": 1, "name": "A", "price": 1}, {"id": 7, "name": "B", "price": 2}])
+    new = repo.add("C", 3)
+    assert new == {"id": 8, "name": "C", "price": 3}
+
+    assert repo.remove(8) is True
+    assert repo.remove(8) is False
+    assert repo.add("D", 4)["id"] == 9
+
+    assert repo.update(1, price=10, id=99) == {"id": 1, "name": "A", "price": 10}
+    assert repo.update(42, price=1) is None
+    assert [it["id"] for it in repo.list_all()] == [1, 7, 9]
+
+
+def test_returned_items_are_copies(tmp_path):
+    repo = make_repo(tmp_path, [{"id": 1, "name": "A", "price": 1}])
+    repo.get(1)["price"] = 100
+    repo.list_all()[0]["price"] = 100
+    assert repo.get(1)["price"] == 1
+
+
+def test_save_roundtrip(tmp_path):
+    repo = make_repo(tmp_path, [{"id": 1, "name": "A", "price": 1}])
+    repo.add("Б", 2)
+    repo.save()
+    assert ItemRepository(repo.path).list_all() == repo.list_all()
+
+
+def test_snapshots_are_immutable_and_versioned(tmp_path):
+    repo = make_repo(tmp_path, [{"id": 1, "name": "A", "price": 1}])
+    old = repo.snapshot()
+    v = repo.version
+
+    repo.update(1, price=5)
+    repo.add("B", 2)
+    assert repo.version == v + 2
+    assert old.version == v
+    assert old.get(1)["price"] == 1
+    assert len(old) == 1
+    assert repo.snapshot().get(1)["price"] == 5
+
+    repo.remove(2)
+    repo.remove(2)
+    assert repo.version == v + 3
+
+
+def test_catalog_payload_cached_per_version(tmp_path):
+    repo = make_repo(tmp_path, [{"id": 1, "name": "Меч", "price": 1}])
+    payload = repo.catalog_payload()
+    assert json.loads(payload) == repo.list_all()
+    assert repo.catalog_payload() is payload
+
+    repo.add("B", 2)
+    updated = repo.catalog_payload()
+    assert updated is not payload
+    assert [it["id"] for it in json.loads(updated)] == [1, 2]
+
+
+def test_delta_since_tracks_added_changed_removed(tmp_path):
+    repo = make_repo(tmp_path, [{"id": 1, "name": "A", "price": 1}, {"id": 2, "name": "B", "price": 2}])
+    base = repo.version
+
+    repo.add("C", 3)
+    repo.update(1, price=10)
+    repo.remove(2)
+    repo.add("D", 4)
+    repo.remove(4)
+
+    delta = repo.snapshot().delta_since(base)
+    assert delta == {"added": [{"id": 3, "name": "C", "price": 3}],
+                     "changed": [{"id": 1, "name": "A", "price": 10}],
+                     "removed": [2]}
+    assert json.loads(repo.snapshot().delta_payload(base)) == delta
+    assert repo.snapshot().delta_since(repo.version) == {"added": [], "changed": [], "removed": []}
+
+
+def test_delta_since_outside_history(tmp_path):
+    path = tmp_path / "items.json"
+    path.write_text("[]", encoding="utf-8")
+    repo = ItemRepository(str(path), history_size=2)
+    base = repo.version
+    for i in range(3):
+        repo.add(f"x{i}", i)
+    assert repo.snapshot().delta_since(base) is None
+    assert repo.snapshot().delta_since(base + 1) is not None
+
+
+def test_version_token_is_bound_to_epoch(tmp_path):
+    repo = make_repo(tmp_path, [])
+    token = repo.version_token(repo.snapshot())
+    assert repo.parse_version_token(token) == repo.version
+    assert repo.parse_version_token("other:1") is None
+    assert repo.parse_version_token(None) is None
+
+
+def test_import_csv_and_jsonl_publish_once(tmp_path):
+    import pytest
+
+    from srv.srv_catalog_store import read_import_file
+
+    repo = make_repo(tmp_path, [{"id": 1, "name": "A", "price": 1}])
+    csv_file = tmp_path / "items.csv"
+    csv_file.write_text("id,name,price\n1,A2,5\n,New,7\n", encoding="utf-8")
+    jsonl_file = tmp_path / "items.jsonl"
+    jsonl_file.write_text('{"name": "J", "price": 3}\n\n{"id": 10, "name": "K", "price": "4"}\n', encoding="utf-8")
+
+    base = repo.version
+    assert repo.import_items(read_import_file(str(csv_file))) == 2
+    assert repo.version == base + 1
+    assert repo.list_all() == [{"id": 1, "name": "A2", "price": 5}, {"id": 2, "name": "New", "price": 7}]
+
+    repo.import_items(read_import_file(str(jsonl_file)), replace=True)
+    assert repo.list_all() == [{"id": 11, "name": "J", "price": 3}, {"id": 10, "name": "K", "price": 4}]
+    assert repo.snapshot().delta_since(base + 1)["removed"] == [1, 2]
+
+    jsonl_file.write_text('{"name": "ok", "price": 1}\n{"name": "bad", "price": -1}\n', encoding="utf-8")
+    with pytest.raises(ValueError, match="items.jsonl:2"):
+        repo.import_items(read_import_file(str(jsonl_file)))
+    assert len(repo.snapshot()) == 2  # ошибка — каталог не изменён
+
+
+def test_schedule_save_coalesces_edits(tmp_path):
+    import time
+
+    path = tmp_path / "items.json"
+    path.write_text("[]", encoding="utf-8")
+    repo = ItemRepository(str(path), save_delay=0.2)
+    saves = []
+    repo.add_save_listener(lambda: saves.append(repo.version))
+    for i in range(5):
+        repo.add(f"x{i}", i)
+        repo.schedule_save()
+    assert json.loads(path.read_text(encoding="utf-8")) == []
+    time.sleep(0.5)
+    assert saves == [repo.version]
+    assert len(json.loads(path.read_text(encoding="utf-8"))) == 5
+
+    repo.add("late", 1)
+    repo.schedule_save()
+    repo.close()  # отложенная запись выполняется при закрытии
+    assert len(json.loads(path.read_text(encoding="utf-8"))) == 6
+
+
+def test_sqlite_store_seeds_and_saves_changes(tmp_path):
+    from srv.srv_catalog_store import SqliteCatalogStore
+
+    seed = tmp_path / "items.json"
+    seed.write_text(json.dumps([{"id": 2, "name": "A", "price": 1}, {"name": "B", "price": 2}]), encoding="utf-8")
+    store = SqliteCatalogStore(str(tmp_path / "catalog.db"), seed_path=str(seed))
+    repo = ItemRepository(store=store)
+    assert [it["id"] for it in repo.list_all()] == [2, 3]
+
+    repo.add("C", 3)
+    repo.update(2, price=9)
+    repo.remove(3)
+    repo.save()
+    seed.write_text("[]", encoding="utf-8")  # таблица уже заполнена, seed больше не читается
+
+    reloaded = ItemRepository(store=SqliteCatalogStore(store.path, seed_path=str(seed)))
+    assert reloaded.list_all() == [{"id": 2, "name": "A", "price": 9}, {"id": 4, "name": "C", "price": 3}]
+
+
+def test_sqlite_store_concurrent_first_start_seeds_once(tmp_path):
+    from srv.srv_catalog_store import SqliteCatalogStore
+
+    seed = tmp_path / "items.json"
+    seed.write_text(json.dumps([{"name": f"I{i}", "price": i} for i in range(500)]), encoding="utf-8")
+    barrier = threading.Barrier(4)
+    results, errors = [], []
+
+    def start():
+        store = SqliteCatalogStore(str(tmp_path / "catalog.db"), seed_path=str(seed))
+        barrier.wait()
+        try:
+            results.append(len(list(store.load())))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=start) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == [] and results == [500] * 4
+
+
+def test_query_filters_sorts_and_paginates(tmp_path):
+    items = [{"id": i, "name": name, "price": price} for i, (name, price) in enumerate(
+        [("Sword", 50), ("shield", 30), ("Spear", 30), ("Axe", 70), ("Bow", 40), ("Staff", 30)], 1)]
+    snap = make_repo(tmp_path, items).snapshot()
+
+    page, last = snap.query("price", min_price=30, max_price=40, limit=2)
+    assert [it["id"] for it in page] == [2, 3]
+    page, last = snap.query("price", min_price=30, max_price=40, after=last, limit=2)
+    assert [it["id"] for it in page] == [6, 5] and last is None
+
+    page, _ = snap.query("name", name_prefix="s", limit=10)
+    assert [it["name"] for it in page] == ["shield", "Spear", "Staff", "Sword"]
+    page, _ = snap.query("name", descending=True, name_prefix="S", max_price=30, limit=10)
+    assert [it["name"] for it in page] == ["Staff", "Spear", "shield"]
+
+    page, last = snap.query("id", descending=True, limit=4)
+    assert [it["id"] for it in page] == [6, 5, 4, 3]
+    page, last = snap.query("id", descending=True, after=last, limit=4)
+    assert [it["id"] for it in page] == [2, 1] and last is None
+    assert snap.sorted_index("price") is snap.sorted_index("price")
+
+
+def test_watcher_reloads_external_changes_only(tmp_path):
+    repo = make_repo(tmp_path, [{"id": 1, "name": "A", "price": 1}])
+    watcher = CatalogWatcher(repo, interval=0.01)
+    assert watcher.check() is False
+
+    repo.add("B", 2)
+    repo.save()  # своя запись не считается внешней правкой
+    assert watcher.check() is False
+    version = repo.version
+
+    path = tmp_path / "items.json"
+    path.write_text(json.dumps([{"id": 1, "name": "A", "price": 5}, {"name": "C", "price": "7"}]), encoding="utf-8")
+    assert watcher.check() is True
+    assert repo.version == version + 1
+    assert repo.list_all() == [{"id": 1, "name": "A", "price": 5}, {"id": 2, "name": "C", "price": 7}]
+    assert repo.snapshot().delta_since(version) is not None
+
+    # битый файл не публикуется и не перечитывается повторно
+    path.write_text(json.dumps([{"id": 1, "name": "A", "price": -1}, {"id": 3}]), encoding="utf-8")
+    assert watcher.check() is False
+    assert watcher.check() is False
+    assert repo.get(1)["price"] == 5
+
+    shutdown_event = threading.Event()
+    thread = watcher.start(shutdown_event)
+    path.write_text(json.dumps([{"id": 4, "name": "D", "price": 1}]), encoding="utf-8")
+    deadline = time.time() + 5
+    while repo.get(4) is None and time.time() < deadline:
+        time.sleep(0.01)
+    shutdown_event.set()
+    thread.join()
+    assert [it["id"] for it in repo.list_all()] == [4]
@@ -36,3 +36,22 @@ def test_handle_choice_exit(menu, capsys):
     menu.network.disconnect = MagicMock()
     with pytest.raises(SystemExit):
         menu.handle_choice("Exit")
+
+
+def test_refresh_catalog_restarts_when_version_changes(menu, capsys):
+    v1, v2 = "e:1", "e:2"
+    menu.catalog_stale = True
+    menu.network.recv.side_effect = [
+        {"status": "ok", "items": [{"id": 1, "name": "sword", "price": 100}], "next_cursor": "c1",
+         "catalog_version": v1},
+        {"status": "ok", "items": [{"id": 3, "name": "bow", "price": 70}], "next_cursor": None,
+         "catalog_version": v2},  # каталог изменился между страницами
+        {"status": "ok", "items": [{"id": 1, "name": "sword", "price": 90}], "next_cursor": "c1",
+         "catalog_version": v2},
+        {"status": "ok", "items": [{"id": 3, "name": "bow", "price": 70}], "next_cursor": None,
+         "catalog_version": v2},
+    ]
+    menu.refresh_catalog()
+    assert [it["price"] for it in menu.master_items] == [90, 70]
+    menu.cache.save_items.assert_called_once_with(menu.master_items, v2)
+    assert not menu.catalog_stale
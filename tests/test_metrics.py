@@ -0,0 +1,48 @@
+import urllib.request
+
+from srv.srv_metrics import MetricsRegistry, action_label, call_with_db_time, add_db_time, start_metrics_server
+
+
+def test_counter_histogram_render():
+    reg = MetricsRegistry()
+    requests = reg.counter("t_requests_total", "Requests", ("action",))
+    latency = reg.histogram("t_latency_seconds", "Latency", ("action",), buckets=(0.01, 0.1))
+    requests.inc("buy")
+    requests.inc("buy")
+    latency.observe(0.005, "buy")
+    latency.observe(0.05, "buy")
+    latency.observe(5, "buy")
+    reg.register_collector(lambda: {"t_pool_size": 4})
+
+    text = reg.render()
+    assert 't_requests_total{action="buy"} 2' in text
+    assert 't_latency_seconds_bucket{action="buy",le="0.01"} 1' in text
+    assert 't_latency_seconds_bucket{action="buy",le="0.1"} 2' in text
+    assert 't_latency_seconds_bucket{action="buy",le="+Inf"} 3' in text
+    assert 't_latency_seconds_count{action="buy"} 3' in text
+    assert "t_pool_size 4" in text
+    assert latency.quantile(0.5, "buy") == 0.1
+    assert latency.quantile(0.99, "buy") == float("inf")
+
+
+def test_db_time_is_attributed_to_the_call():
+    def work():
+        add_db_time(0.25)
+        add_db_time(0.25)
+        return "ok"
+
+    result, elapsed, db = call_with_db_time(work)
+    assert result == "ok"
+    assert db == 0.5
+    assert action_label({"action": "buy"}, {"buy": None}) == "buy"
+    assert action_label({"action": "x" * 100}, {"buy": None}) == "unknown"
+
+
+def test_metrics_http_endpoint():
+    httpd = start_metrics_server("127.0.0.1", 0)
+    try:
+        port = httpd.server_address[1]
+        body = urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=2).read().decode()
+        assert "tzl_active_connections" in body
+    finally:
+        httpd.shutdown()
@@ -43,3 +43,64 @@ def test_network_client_connect_and_disconnect(monkeypatch):
 
     nc.disconnect()
     assert nc.sock is None
+
+
+class ChunkedSocket:
+    """Отдаёт заранее заданные куски данных, как TCP может их разрезать или склеить."""
+
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+
+    def recv(self, bufsize):
+        return self.chunks.pop(0) if self.chunks else b""
+
+    def sendall(self, data):
+        self.sent = data
+
+
+def test_recv_keeps_coalesced_and_split_messages():
+    nc = cli_network.NetworkClient()
+    nc.sock = ChunkedSocket([b'{"id": 1}\n{"id": 2}\n{"i', b'd": 3', b'}\n'])
+    assert nc.recv() == {"id": 1}
+    assert nc.recv() == {"id": 2}
+    assert nc.recv() == {"id": 3}
+    assert nc.recv() is None
+
+
+def test_recv_large_message_in_many_chunks():
+    import json
+
+    payload = json.dumps({"items_master": [{"id": i, "name": "x" * 50} for i in range(5000)]}).encode() + b"\n"
+    chunks = [payload[i:i + 1000] for i in range(0, len(payload), 1000)]
+    nc = cli_network.NetworkClient()
+    nc.sock = ChunkedSocket(chunks)
+    resp = nc.recv()
+    assert len(resp["items_master"]) == 5000
+    assert nc._buffer == bytearray()
+
+
+def test_recv_switches_codec_between_frames():
+    from common.common_codec import BINARY_CODEC
+
+    nc = cli_network.NetworkClient()
+    nc.sock = ChunkedSocket([b'{"encoding": "msgpack"}\n' + BINARY_CODEC.encode({"a": 1})[:3],
+                             BINARY_CODEC.encode({"a": 1})[3:]])
+    assert nc.recv() == {"encoding": "msgpack"}
+    nc.set_encoding("msgpack")
+    assert nc.recv() == {"a": 1}
+
+
+def test_send_many_pipelines_requests():
+    nc = cli_network.NetworkClient()
+    nc.sock = ChunkedSocket([])
+    nc.send_many([{"action": "whoami", "id": 1}, {"action": "whoami", "id": 2}])
+    assert nc.sock.sent.count(b"\n") == 2
+
+
+def test_push_messages_are_kept_apart_from_responses():
+    nc = cli_network.NetworkClient()
+    nc.sock = ChunkedSocket([b'{"type": "push", "event": "catalog_changed"}\n{"id": 1}\n'])
+    nc.sock.setblocking = lambda flag: None
+    assert nc.recv() == {"id": 1}
+    assert nc.poll_pushes() == [{"type": "push", "event": "catalog_changed"}]
+    assert nc.poll_pushes() == []
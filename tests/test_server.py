@@ -68,7 +68,7 @@ def run_server_in_thread(cfg, shutdown_event):
 
     t = threading.Thread(target=loop, daemon=True)
     t.start()
-    return t
+    return t, service
 
 
 def send_recv(sock, obj):
@@ -110,3 +110,495 @@ def test_login_whoami_buy_sell_logout(test_env):
     sock.close()
     shutdown_event.set()
     time.sleep(0.2)
+
+
+def run_async_server_in_thread(cfg, shutdown_event):
+    items_repo = ItemRepository(cfg["items_file"])
+    db = DB(cfg["db_file"])
+    service = GameService(db, items_repo, cfg)
+    s = server.create_listener(cfg["host"], 0, 128)
+    t = threading.Thread(target=server.run_async_server, args=(s, service, cfg, shutdown_event), daemon=True)
+    t.start()
+    return s.getsockname()[1], service
+
+
+def test_async_mode_login_buy_and_concurrent_clients(test_env):
+    shutdown_event = threading.Event()
+    port, _ = run_async_server_in_thread(test_env, shutdown_event)
+    time.sleep(0.3)
+
+    socks = [socket.create_connection((test_env["host"], port)) for _ in range(20)]
+    for i, sock in enumerate(socks):
+        resp = send_recv(sock, {"action": "login", "nickname": f"p{i}"})
+        assert resp["status"] == "ok"
+        assert resp["account"]["nickname"] == f"p{i}"
+
+    resp = send_recv(socks[0], {"action": "buy", "item_id": 2})
+    assert resp["status"] == "ok"
+    assert resp["account"]["items"] == [2]
+
+    resp = send_recv(socks[1], {"action": "nope"})
+    assert resp == {"status": "error", "error": "unknown_action"}
+
+    resp = send_recv(socks[0], {"action": "logout"})
+    assert resp["status"] == "ok"
+    assert socks[0].recv(1) == b""
+
+    for sock in socks:
+        sock.close()
+    shutdown_event.set()
+    time.sleep(0.7)
+
+
+def test_login_catalog_sync(test_env):
+    shutdown_event = threading.Event()
+    port, service = run_async_server_in_thread(test_env, shutdown_event)
+    time.sleep(0.3)
+    sock = socket.create_connection((test_env["host"], port))
+
+    resp = send_recv(sock, {"action": "login", "nickname": "p"})
+    assert resp["catalog_status"] == "full"
+    assert [it["id"] for it in resp["items_master"]] == [1, 2]
+    version, catalog_hash = resp["catalog_version"], resp["catalog_hash"]
+
+    resp = send_recv(sock, {"action": "login", "nickname": "p",
+                            "catalog_version": version, "catalog_hash": catalog_hash})
+    assert resp["catalog_status"] == "not_modified"
+    assert "items_master" not in resp
+
+    service.items.add("Bow", 70)
+    service.items.remove(2)
+    resp = send_recv(sock, {"action": "login", "nickname": "p",
+                            "catalog_version": version, "catalog_hash": catalog_hash})
+    assert resp["catalog_status"] == "delta"
+    assert resp["catalog_delta"] == {"added": [{"id": 3, "name": "Bow", "price": 70}], "changed": [], "removed": [2]}
+    assert resp["catalog_hash"] != catalog_hash
+
+    resp = send_recv(sock, {"action": "login", "nickname": "p", "catalog_version": "stale:1", "catalog_hash": "x"})
+    assert resp["catalog_status"] == "full"
+
+    sock.close()
+    shutdown_event.set()
+    time.sleep(0.7)
+
+
+def test_binary_encoding_negotiated_at_login(test_env):
+    from common.common_codec import BINARY_CODEC
+
+    shutdown_event = threading.Event()
+    run_server_in_thread(test_env, shutdown_event)
+    time.sleep(0.3)
+    sock = socket.create_connection((test_env["host"], test_env["port"]))
+
+    resp = send_recv(sock, {"action": "login", "nickname": "bin", "encoding": "msgpack"})
+    assert resp["status"] == "ok"
+    assert resp["encoding"] == "msgpack"
+
+    sock.sendall(BINARY_CODEC.encode({"action": "buy", "item_id": 2}))
+    f = sock.makefile("rb")
+    resp = BINARY_CODEC.decode(BINARY_CODEC.read_from(f))
+    assert resp["status"] == "ok"
+    assert resp["bought"] == {"id": 2, "name": "Shield", "price": 30}
+    assert resp["account"]["items"] == [2]
+
+    sock.close()
+    shutdown_event.set()
+    time.sleep(0.7)
+
+
+def test_batch_and_request_ids(test_env):
+    shutdown_event = threading.Event()
+    port, service = run_async_server_in_thread(test_env, shutdown_event)
+    time.sleep(0.3)
+    sock = socket.create_connection((test_env["host"], port))
+
+    resp = send_recv(sock, {"action": "batch", "requests": [{"action": "whoami"}]})
+    assert resp["error"] == "not_logged_in"
+
+    resp = send_recv(sock, {"action": "login", "nickname": "bot", "id": 7})
+    assert resp["id"] == 7
+
+    resp = send_recv(sock, {"action": "batch", "id": "b1", "requests": [
+        {"action": "buy", "item_id": 1, "id": 1},
+        {"action": "buy", "item_id": 1, "id": 2},
+        {"action": "buy", "item_id": 99},
+        {"action": "login", "nickname": "x"},
+        {"action": "whoami"},
+    ]})
+    assert resp["status"] == "ok"
+    assert resp["id"] == "b1"
+    results = resp["results"]
+    assert [r["status"] for r in results] == ["ok", "error", "error", "error", "ok"]
+    assert results[0]["id"] == 1 and results[1]["id"] == 2
+    assert results[1]["error"] == "already_owned"
+    assert results[3]["error"] == "unknown_action"
+    assert results[4]["account"]["items"] == [1]
+    assert results[4]["account"]["credits"] == 0
+
+    resp = send_recv(sock, {"action": "batch", "atomic": True, "requests": [
+        {"action": "sell", "item_id": 1},
+        {"action": "buy", "item_id": 2},
+        {"action": "whoami"},
+    ]})
+    assert resp["error"] == "batch_aborted"
+    assert [r["status"] for r in resp["results"]] == ["ok", "error"]
+    acc = service.whoami("bot")
+    assert acc["items"] == [1]
+    assert acc["credits"] == 0
+
+    sock.close()
+    shutdown_event.set()
+    time.sleep(0.7)
+
+
+@pytest.mark.parametrize("mode", ["threaded", "async"])
+def test_bad_item_id_keeps_connection(test_env, mode):
+    shutdown_event = threading.Event()
+    if mode == "threaded":
+        run_server_in_thread(test_env, shutdown_event)
+        port = test_env["port"]
+    else:
+        port, _ = run_async_server_in_thread(test_env, shutdown_event)
+    time.sleep(0.3)
+    sock = socket.create_connection((test_env["host"], port))
+    send_recv(sock, {"action": "login", "nickname": "bot"})
+
+    assert send_recv(sock, {"action": "buy", "item_id": "x"})["error"] == "bad_item_id"
+    assert send_recv(sock, {"action": "sell", "item_id": [1]})["error"] == "bad_item_id"
+    resp = send_recv(sock, {"action": "batch", "requests": [
+        {"action": "buy", "item_id": "x", "id": 1},
+        {"action": "buy", "item_id": "2", "id": 2},
+    ]})
+    assert [(r["id"], r["status"]) for r in resp["results"]] == [(1, "error"), (2, "ok")]
+    assert resp["results"][0]["error"] == "bad_item_id"
+    assert send_recv(sock, {"action": "whoami"})["account"]["items"] == [2]
+
+    sock.close()
+    shutdown_event.set()
+    time.sleep(0.7)
+
+
+def test_write_behind_account_cache(test_env, tmp_path):
+    cfg = dict(test_env, account_flush_interval=60, account_journal_file=str(tmp_path / "acc.journal"))
+    shutdown_event = threading.Event()
+    port, service = run_async_server_in_thread(cfg, shutdown_event)
+    time.sleep(0.3)
+    sock = socket.create_connection((cfg["host"], port))
+
+    assert send_recv(sock, {"action": "login", "nickname": "c"})["account"]["credits"] == 50
+    resp = send_recv(sock, {"action": "buy", "item_id": 2})
+    assert resp["account"] == {"nickname": "c", "credits": 20, "items": [2]}
+    assert send_recv(sock, {"action": "whoami"})["account"]["credits"] == 20
+    assert service.db.get_account("c")["credits"] == 50
+
+    send_recv(sock, {"action": "logout"})
+    sock.close()
+    shutdown_event.set()
+    time.sleep(0.7)
+    service.close()
+    assert service.db.get_account("c") == {"nickname": "c", "credits": 20, "items": [2]}
+
+
+def test_reuse_port_listeners_share_port():
+    a = server.create_listener("127.0.0.1", 0, 16, reuse_port=True)
+    port = a.getsockname()[1]
+    b = server.create_listener("127.0.0.1", port, 16, reuse_port=True)
+    assert b.getsockname()[1] == port
+    a.close()
+    b.close()
+
+
+def test_prefork_workers_serve_and_reload_catalog(test_env):
+    probe = server.create_listener("127.0.0.1", 0, 1)
+    port = probe.getsockname()[1]
+    probe.close()
+    cfg = dict(test_env, port=port)
+
+    pool = server.WorkerPool(cfg, 2)
+    pool.start()
+    try:
+        deadline = time.time() + 10
+        while True:
+            try:
+                sock = socket.create_connection((cfg["host"], port))
+                break
+            except ConnectionRefusedError:
+                assert time.time() < deadline
+                time.sleep(0.1)
+        sock.close()
+
+        for i in range(6):
+            sock = socket.create_connection((cfg["host"], port))
+            resp = send_recv(sock, {"action": "login", "nickname": "w"})
+            assert resp["status"] == "ok"
+            sock.close()
+
+        repo = ItemRepository(cfg["items_file"])
+        repo.add("Bow", 70)
+        repo.save()
+        pool.broadcast("reload")
+        time.sleep(0.5)
+        for i in range(4):
+            sock = socket.create_connection((cfg["host"], port))
+            resp = send_recv(sock, {"action": "login", "nickname": "w"})
+            assert [it["id"] for it in resp["items_master"]] == [1, 2, 3]
+            sock.close()
+    finally:
+        pool.stop()
+    assert all(not p.is_alive() for p, _ in pool.workers.values())
+
+
+def _wait_listening(host, port, timeout=10):
+    deadline = time.time() + timeout
+    while True:
+        try:
+            return socket.create_connection((host, port))
+        except ConnectionRefusedError:
+            assert time.time() < deadline
+            time.sleep(0.1)
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/stat"), reason="needs /proc")
+def test_prefork_restarts_worker_outside_threaded_supervisor(test_env):
+    probe = server.create_listener("127.0.0.1", 0, 1)
+    port = probe.getsockname()[1]
+    probe.close()
+    cfg = dict(test_env, port=port)
+
+    pool = server.WorkerPool(cfg, 1)
+    pool.start()
+    shutdown_event = threading.Event()
+    supervisor = threading.Thread(target=pool.supervise, args=(shutdown_event,), daemon=True)
+    supervisor.start()
+    try:
+        _wait_listening(cfg["host"], port).close()
+        old = pool.workers[0][0]
+        old.kill()
+        old.join(5)
+        deadline = time.time() + 10
+        while pool.workers[0][0] is old:
+            assert time.time() < deadline
+            time.sleep(0.1)
+        sock = _wait_listening(cfg["host"], port)
+        assert send_recv(sock, {"action": "login", "nickname": "w"})["status"] == "ok"
+        sock.close()
+        # новый воркер — потомок однопоточного forkserver, а не многопоточного супервизора
+        with open(f"/proc/{pool.workers[0][0].pid}/stat") as f:
+            ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        assert ppid != os.getpid()
+    finally:
+        shutdown_event.set()
+        supervisor.join(2)
+        pool.stop()
+
+
+def test_connection_limit_answers_server_busy(test_env):
+    cfg = dict(test_env, max_connections=1)
+    shutdown_event = threading.Event()
+    port, _ = run_async_server_in_thread(cfg, shutdown_event)
+    time.sleep(0.3)
+
+    first = socket.create_connection((cfg["host"], port))
+    assert send_recv(first, {"action": "login", "nickname": "a"})["status"] == "ok"
+    second = socket.create_connection((cfg["host"], port))
+    assert json.loads(second.recv(4096)) == {"status": "error", "error": "server_busy"}
+    assert second.recv(1) == b""
+
+    first.close()
+    second.close()
+    shutdown_event.set()
+    time.sleep(0.7)
+
+
+def test_requests_are_recorded_in_metrics(test_env):
+    from srv import srv_metrics
+
+    before = srv_metrics.REQUESTS.value("whoami")
+    errors_before = srv_metrics.ERRORS.value("buy", "item_not_found")
+    shutdown_event = threading.Event()
+    port, service = run_async_server_in_thread(test_env, shutdown_event)
+    srv_metrics.REGISTRY.register_collector(service.db.stats)
+    time.sleep(0.3)
+    sock = socket.create_connection((test_env["host"], port))
+    send_recv(sock, {"action": "login", "nickname": "m"})
+    send_recv(sock, {"action": "whoami"})
+    send_recv(sock, {"action": "buy", "item_id": 99})
+    time.sleep(0.1)  # метрики записываются после отправки ответа
+
+    assert srv_metrics.REQUESTS.value("whoami") == before + 1
+    assert srv_metrics.ERRORS.value("buy", "item_not_found") == errors_before + 1
+    assert srv_metrics.LATENCY.quantile(0.5, "login", "db") is not None
+    assert "tzl_db_connections_open" in srv_metrics.summary()
+
+    sock.close()
+    shutdown_event.set()
+    time.sleep(0.7)
+
+
+def test_list_items_pagination_over_protocol(test_env):
+    shutdown_event = threading.Event()
+    port, service = run_async_server_in_thread(test_env, shutdown_event)
+    time.sleep(0.3)
+    sock = socket.create_connection((test_env["host"], port))
+
+    resp = send_recv(sock, {"action": "list_items", "sort": "price", "limit": 1})
+    assert resp["action"] == "list_items_result"
+    assert [it["name"] for it in resp["items"]] == ["Shield"]
+    resp = send_recv(sock, {"action": "list_items", "sort": "price", "limit": 1, "cursor": resp["next_cursor"]})
+    assert [it["name"] for it in resp["items"]] == ["Sword"] and resp["next_cursor"] is None
+
+    assert send_recv(sock, {"action": "list_items", "sort": "name", "cursor": "junk"})["error"] == "bad_cursor"
+    assert send_recv(sock, {"action": "list_items", "sort": "weight"})["error"] == "bad_sort"
+    assert send_recv(sock, {"action": "list_items", "limit": 100000})["error"] == "bad_filter"
+
+    sock.close()
+    shutdown_event.set()
+    time.sleep(0.7)
+
+
+def test_buy_and_sell_quantities(test_env):
+    test_env = dict(test_env, default_max_stack=5, login_credit_min=200, login_credit_max=200)
+    shutdown_event = threading.Event()
+    port, service = run_async_server_in_thread(test_env, shutdown_event)
+    time.sleep(0.3)
+    sock = socket.create_connection((test_env["host"], port))
+    send_recv(sock, {"action": "login", "nickname": "stack"})
+
+    resp = send_recv(sock, {"action": "buy", "item_id": 2, "quantity": 4})
+    assert resp["quantity"] == 4
+    assert resp["account"] == {"nickname": "stack", "credits": 80, "items": [2], "quantities": {"2": 4}}
+    assert send_recv(sock, {"action": "buy", "item_id": 2, "quantity": 2})["error"] == "stack_limit"
+    assert send_recv(sock, {"action": "buy", "item_id": 2, "quantity": 0})["error"] == "bad_quantity"
+
+    resp = send_recv(sock, {"action": "sell", "item_id": 2, "quantity": 3})
+    assert resp["received"] == 45
+    assert resp["account"] == {"nickname": "stack", "credits": 125, "items": [2]}
+
+    sock.close()
+    shutdown_event.set()
+    time.sleep(0.7)
+
+
+def test_catalog_update_notice_after_reload(test_env):
+    shutdown_event = threading.Event()
+    port, service = run_async_server_in_thread(test_env, shutdown_event)
+    time.sleep(0.3)
+    sock = socket.create_connection((test_env["host"], port))
+    send_recv(sock, {"action": "login", "nickname": "watcher"})
+    assert "catalog_update" not in send_recv(sock, {"action": "whoami"})
+
+    with open(test_env["items_file"], "w", encoding="utf-8") as f:
+        json.dump([{"id": 1, "name": "Sword", "price": 70}], f)
+    assert server.CatalogWatcher(service.items).check() is True
+    resp = send_recv(sock, {"action": "whoami"})
+    assert resp["catalog_update"] == service.items.version_token(service.items.snapshot())
+    assert "catalog_update" not in send_recv(sock, {"action": "whoami"})
+
+    sock.close()
+    shutdown_event.set()
+    time.sleep(0.7)
+
+
+def read_frames(reader, count):
+    return [json.loads(reader.readline()) for _ in range(count)]
+
+
+@pytest.mark.parametrize("mode", ["threaded", "asyncio"])
+def test_push_notifications(test_env, mode):
+    shutdown_event = threading.Event()
+    if mode == "asyncio":
+        port, service = run_async_server_in_thread(test_env, shutdown_event)
+    else:
+        port = test_env["port"]
+        _, service = run_server_in_thread(test_env, shutdown_event)
+    time.sleep(0.3)
+    watcher = socket.create_connection((test_env["host"], port))
+    watcher_in = watcher.makefile("rb")
+
+    send_recv(watcher, {"action": "login", "nickname": "pusher"})
+    assert send_recv(watcher, {"action": "subscribe", "events": ["nope"]})["error"] == "bad_events"
+    assert send_recv(watcher, {"action": "subscribe"})["events"] == ["catalog_changed", "credits_changed"]
+
+    # массовое начисление из консоли
+    assert service.db.grant_credits([("pusher", 5), ("nobody", 5)]) == 1
+    push = read_frames(watcher_in, 1)[0]
+    assert push == {"type": "push", "event": "credits_changed",
+                    "account": {"nickname": "pusher", "credits": 55, "items": []}}
+
+    # правка каталога — всем подписанным; своя сделка push не порождает
+    service.items.add("Bow", 10)
+    watcher.sendall(b'{"action": "buy", "item_id": 3, "id": 7}\n')
+    push, resp = read_frames(watcher_in, 2)
+    assert push["event"] == "catalog_changed" and push["catalog_version"].endswith(":2")
+    assert resp["id"] == 7 and resp["status"] == "ok"
+
+    watcher.sendall(b'{"action": "unsubscribe"}\n')
+    assert read_frames(watcher_in, 1)[0]["action"] == "unsubscribe_result"
+    service.db.grant_credits([("pusher", 5)])
+    watcher.sendall(b'{"action": "whoami"}\n')
+    assert "type" not in read_frames(watcher_in, 1)[0]
+
+    watcher.close()
+    shutdown_event.set()
+    time.sleep(0.7)
+
+
+@pytest.mark.parametrize("mode", ["threaded", "asyncio"])
+def test_duplicate_login_kicks_old_session_and_resume(test_env, mode):
+    shutdown_event = threading.Event()
+    if mode == "asyncio":
+        port, service = run_async_server_in_thread(test_env, shutdown_event)
+    else:
+        port = test_env["port"]
+        _, service = run_server_in_thread(test_env, shutdown_event)
+    time.sleep(0.3)
+    first = socket.create_connection((test_env["host"], port))
+    first_in = first.makefile("rb")
+    send_recv(first, {"action": "login", "nickname": "twin"})
+
+    second = socket.create_connection((test_env["host"], port))
+    resp = send_recv(second, {"action": "login", "nickname": "twin"})
+    assert resp["status"] == "ok" and resp["login_bonus"] == 0
+    assert json.loads(first_in.readline()) == {"type": "push", "event": "session_closed",
+                                               "reason": "duplicate_login"}
+    assert first_in.readline() == b""  # сервер закрыл старое подключение
+    assert service.sessions.get("twin") is not None and len(service.sessions) == 1
+
+    # обрыв и возобновление по токену: без login и бонуса
+    second.close()
+    time.sleep(0.2)
+    third = socket.create_connection((test_env["host"], port))
+    assert send_recv(third, {"action": "resume", "resume_token": "junk"})["error"] == "bad_resume_token"
+    resumed = send_recv(third, {"action": "resume", "resume_token": resp["resume_token"]})
+    assert resumed["action"] == "resume_result" and resumed["account"]["credits"] == 50
+    assert resumed["resume_token"] != resp["resume_token"]
+    assert send_recv(third, {"action": "whoami"})["account"]["nickname"] == "twin"
+
+    # после logout токен недействителен
+    send_recv(third, {"action": "logout"})
+    third.close()
+    fourth = socket.create_connection((test_env["host"], port))
+    assert send_recv(fourth, {"action": "resume", "resume_token": resumed["resume_token"]})["error"] == \
+        "bad_resume_token"
+
+    fourth.close()
+    first.close()
+    shutdown_event.set()
+    time.sleep(0.7)
+
+
+def test_reject_new_policy(test_env):
+    test_env = dict(test_env, duplicate_login_policy="reject_new")
+    shutdown_event = threading.Event()
+    port, service = run_async_server_in_thread(test_env, shutdown_event)
+    time.sleep(0.3)
+    first = socket.create_connection((test_env["host"], port))
+    second = socket.create_connection((test_env["host"], port))
+    assert send_recv(first, {"action": "login", "nickname": "solo"})["status"] == "ok"
+    assert send_recv(second, {"action": "login", "nickname": "solo"})["error"] == "already_logged_in"
+    assert send_recv(first, {"action": "whoami"})["account"]["nickname"] == "solo"
+
+    first.close()
+    second.close()
+    shutdown_event.set()
+    time.sleep(0.7)
@@ -0,0 +1,117 @@
+import sqlite3
+
+import pytest
+
+from srv.srv_cli_handler import ClientSession
+from srv.srv_db import DB
+from srv.srv_game import GameService
+from srv.srv_items_repository import ItemRepository
+from srv.srv_sessions import REJECT_NEW, SessionRegistry
+
+
+class FakeSession:
+    def __init__(self, last_active=0.0):
+        self.last_active = last_active
+        self.closed = False
+        self.kicked = None
+
+    def kick(self, reason):
+        self.kicked = reason
+
+
+def test_kick_old_and_reject_new():
+    reg = SessionRegistry()
+    a, b = FakeSession(), FakeSession()
+    token = reg.claim("nick", a)["token"]
+    assert reg.claim("nick", a)["token"] != token  # повторный вход той же сессией
+    reg.claim("nick", b)
+    assert a.kicked == "duplicate_login" and reg.get("nick") is b
+    reg.release("nick", a)  # закрытие вытесненной сессии запись не трогает
+    assert reg.get("nick") is b and len(reg) == 1
+
+    reg = SessionRegistry(policy=REJECT_NEW)
+    reg.claim("nick", a)
+    assert reg.claim("nick", b) == {"error": "already_logged_in"}
+    assert reg.get("nick") is a and b.kicked is None
+
+    with pytest.raises(ValueError):
+        SessionRegistry(policy="allow")
+
+
+def test_resume_tokens():
+    reg = SessionRegistry(resume_timeout=10)
+    a, b, c = FakeSession(), FakeSession(), FakeSession()
+    token = reg.claim("nick", a)["token"]
+    reg.release("nick", a)  # обрыв соединения
+    assert reg.get("nick") is None and len(reg) == 0
+
+    res = reg.resume(token, b)
+    assert res["nickname"] == "nick" and res["token"] != token
+    assert reg.resume(token, c) == {"error": "bad_resume_token"}  # токен одноразовый
+    # возобновление по действующему токену вытесняет живое подключение
+    assert reg.resume(res["token"], c)["nickname"] == "nick"
+    assert b.kicked == "resumed_elsewhere" and reg.get("nick") is c
+
+    reg.release("nick", c, resumable=False)  # logout
+    assert reg.resume(reg.claim("other", a)["token"], b)["nickname"] == "other"
+    assert reg.get("nick") is None
+
+
+def test_reap_idle_sessions_and_expired_tokens():
+    reg = SessionRegistry(idle_timeout=30, resume_timeout=60)
+    busy, idle, gone = FakeSession(last_active=90), FakeSession(last_active=50), FakeSession()
+    reg.claim("busy", busy)
+    reg.claim("idle", idle)
+    token = reg.claim("gone", gone)["token"]
+    reg.release("gone", gone)
+
+    assert reg.reap(now=100) == 1
+    assert idle.kicked == "idle_timeout" and busy.kicked is None
+    assert reg.resume(token, FakeSession())["nickname"] == "gone"
+
+    token = reg.claim("gone", gone)["token"]
+    reg.release("gone", gone)
+    reg.reap(now=10 ** 9)
+    assert reg.resume(token, FakeSession()) == {"error": "bad_resume_token"}
+
+
+def test_reap_frees_nickname_of_closed_session():
+    reg = SessionRegistry(policy=REJECT_NEW, resume_timeout=0)
+    dead, new = FakeSession(), FakeSession()
+    reg.claim("nick", dead)
+    dead.closed = True  # подключение завершилось, не вызвав release
+    reg.reap()
+    assert reg.get("nick") is None
+    assert "token" in reg.claim("nick", new)
+
+
+def test_failed_login_does_not_keep_claim(tmp_path):
+    db = DB(str(tmp_path / "game.db"))
+    service = GameService(db, ItemRepository(str(tmp_path / "items.json")),
+                          {"duplicate_login_policy": "reject_new"})
+    session = ClientSession(service)
+    real_login = service.login
+
+    def locked(nickname):
+        raise sqlite3.OperationalError("database is locked")
+
+    service.login = locked
+    with pytest.raises(sqlite3.OperationalError):
+        session.handle({"action": "login", "nickname": "nick"})
+    assert service.sessions.get("nick") is None
+
+    service.login = real_login
+    resp = ClientSession(service).handle({"action": "login", "nickname": "nick"})
+    assert resp["status"] == "ok"
+
+
+def test_ping_keeps_listening_session_alive(tmp_path):
+    service = GameService(DB(str(tmp_path / "game.db")), ItemRepository(str(tmp_path / "items.json")),
+                          {"session_idle_timeout": 60})
+    session = ClientSession(service)
+    session.handle({"action": "login", "nickname": "bot"})
+    session.last_active -= 50  # слушали push 50 секунд
+    assert session.handle({"action": "ping"}) == {"status": "ok", "action": "pong"}
+    pinged_at = session.last_active
+    assert service.sessions.reap(now=pinged_at + 50) == 0
+    assert service.sessions.reap(now=pinged_at + 61) == 1 and session.closed